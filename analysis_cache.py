@@ -0,0 +1,178 @@
+"""
+解析結果キャッシュ（app.pyとapi/analyze.pyで共有）
+アップロード画像のハッシュをキーに解析結果を保持し、リトライ・二度押し・同じ写真の再投稿で再計算しない
+
+環境変数:
+  PALM_CACHE_SIZE  メモリに保持する件数（LRU、0で無効）
+  PALM_CACHE_TTL   有効期間（秒）
+  PALM_CACHE_DIR   指定するとディスクにも保存し、再起動後も再利用する
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 16
+DEFAULT_TTL = 600
+
+
+def content_key(data):
+    """画像バイト列からキャッシュキーを作る"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class _Flight:
+    """計算中のキー（同じキーの同時リクエストはこれを待つ）"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class AnalysisCache:
+    """
+    LRU + TTL のメモリキャッシュ（任意でディスク保存）
+    同じキーの同時リクエストは1回の計算結果を共有する（single-flight）
+    返す値は呼び出し元の間で共有されるため、変更しないこと
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, cache_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_or_compute(self, key, compute, is_valid=None):
+        """
+        キャッシュにあればそれを返し、なければ compute() の結果を保存して返す
+        is_valid(value) が偽を返すキャッシュ値（参照先が失効した結果など）は使わずに再計算する
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.time() - stored_at < self.ttl and (is_valid is None or is_valid(value)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = self._load_from_disk(key)
+            if value is not None and (is_valid is None or is_valid(value)):
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+            else:
+                with self._lock:
+                    self.misses += 1
+                value = compute()
+                self._save_to_disk(key, value)
+            self._remember(key, value)
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{content_key(key.encode())}.json')
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_to_disk(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """環境変数の設定でプロセス共通のキャッシュを作成して返す"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnalysisCache(
+                max_entries=int(os.environ.get('PALM_CACHE_SIZE', DEFAULT_MAX_ENTRIES)),
+                ttl=float(os.environ.get('PALM_CACHE_TTL', DEFAULT_TTL)),
+                cache_dir=os.environ.get('PALM_CACHE_DIR') or None,
+            )
+        return _cache
@@ -5,61 +5,29 @@ Pillowのみ使用（numpyなし・250MB制限対策）
 cgi非使用（Python 3.13互換）
 """
 
-import io
-import base64
+import binascii
 import json
 import os
-import re
 import sys
+import time
 from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
 
 # プロジェクトルートをパスに追加（image_processing をインポートするため）
 _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if _root not in sys.path:
     sys.path.insert(0, _root)
 
-from image_processing import (
-    load_image,
-    resize_if_needed,
-    assess_lighting,
-    detect_palm_lines,
-    analyze_line_characteristics,
-    create_visualization,
-    edges_to_visible_display,
-    encode_image_to_base64,
-)
-
-
-def parse_multipart(body: bytes, content_type: str):
-    """multipart/form-data を手動パース（cgi非依存）"""
-    match = re.search(r'boundary=([^;\s]+)', content_type)
-    if not match:
-        return {}
-    boundary = match.group(1).strip().encode()
-    if boundary.startswith(b'"') and boundary.endswith(b'"'):
-        boundary = boundary[1:-1]
-    parts = body.split(b'--' + boundary)
-    result = {}
-    for part in parts:
-        if not part or part.strip() in (b'', b'--'):
-            continue
-        header_end = part.find(b'\r\n\r\n')
-        if header_end == -1:
-            header_end = part.find(b'\n\n')
-        if header_end == -1:
-            continue
-        headers = part[:header_end].decode('utf-8', errors='ignore')
-        content = part[header_end + 4:].rstrip(b'\r\n')
-        disp_match = re.search(r'name="([^"]+)"', headers)
-        if not disp_match:
-            continue
-        name = disp_match.group(1)
-        filename_match = re.search(r'filename="([^"]*)"', headers)
-        if filename_match:
-            result[name] = ('file', content)
-        else:
-            result[name] = ('field', content.decode('utf-8', errors='ignore'))
-    return result
+from analysis_cache import get_cache
+from burst import MAX_BURST_FRAMES, analyze_burst
+from deadline import request_deadline
+from multipart_stream import MAX_BODY_SIZE, PayloadTooLarge, iter_multipart
+from image_output import parse_output_options
+from instrumentation import TracedStream, begin_trace, end_trace
+from palm_analysis import analyze_image_bytes, catalog_response, render_image, similar_response
+from progressive import STREAM_MIME_TYPES, encode_event, iter_progressive, stream_format
+from render_store import get_render_store
+
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
@@ -68,102 +36,74 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def get_palm_reading_interpretation(analysis):
-    interpretations = []
-    def add(line, cat, high, mid, low, score):
-        if score > 70:
-            interpretations.append({'line': line, 'category': cat, 'reading': high, 'score': score})
-        elif score > 40:
-            interpretations.append({'line': line, 'category': cat, 'reading': mid, 'score': score})
-        else:
-            interpretations.append({'line': line, 'category': cat, 'reading': low, 'score': score})
-
-    add('感情線', 'love_marriage',
-        '感情が豊かで、恋愛運に恵まれています。愛情表現が上手く、相手に尽くすタイプ。情熱的でロマンチックな恋愛を好み、周囲からも慕われやすいでしょう。',
-        'バランスの取れた恋愛観の持ち主。理性的でありながら、適度な情熱も兼ね備えています。相手を大切にし、安定した関係を築く傾向があります。',
-        '控えめで慎重な性格。感情を表に出すより、内に秘める傾向があります。一度心を許した相手には深い愛情を注ぎ、長く続く絆を大切にします。',
-        analysis.get('heart_zone', 50))
-    add('結婚線', 'love_marriage',
-        '結婚運が強い方です。良縁に恵まれ、パートナーとの絆が深まりやすい傾向があります。家庭を大切にし、長く続く関係を築けるでしょう。',
-        '結婚に対して真摯な気持ちを持っています。相手を選ぶ目があり、慎重に考えた末に良いパートナーと結ばれる傾向があります。',
-        '自由な恋愛観の持ち主。結婚は人生の選択肢の一つとして、焦らず自分らしいタイミングで考える傾向があります。',
-        analysis.get('marriage_zone', 50))
-    add('知能線', 'intelligence',
-        '知的好奇心が旺盛で、学習意欲が高い方です。論理的思考に優れ、問題解決能力に長けています。',
-        'バランスの取れた思考力を持っています。直感と論理の両方を活用できる柔軟な頭脳の持ち主です。',
-        '実践的で行動派。考えるより先に動くタイプ。経験から学ぶことが得意です。',
-        analysis.get('head_zone', 50))
-    add('生命線', 'health',
-        '生命力が強く、健康運に恵まれています。活力に満ち、困難にも立ち向かう力があります。',
-        '安定した生命力。規則正しい生活を心がけることで、長く健康を維持できるでしょう。',
-        '繊細な体質。休息とリフレッシュを大切にすることで、持てる力を最大限発揮できます。',
-        analysis.get('life_zone', 50))
-    add('運命線', 'work_success',
-        'キャリア運が強い方。運命に導かれる力があり、チャンスを掴む才能があります。努力が実を結びやすいでしょう。',
-        '自分で道を切り開く力があります。努力次第でキャリアを好転させられるタイプです。',
-        '自由な精神の持ち主。型にはまらない生き方を好み、独自の道を歩む傾向があります。',
-        analysis.get('fate_zone', 50))
-    add('太陽線', 'work_success',
-        '成功運・名声運に恵まれています。才能が開花しやすく、人から認められやすい傾向。芸術や創造の分野でも花開く可能性があります。',
-        '努力が報われやすいタイプ。地道な積み重ねが評価につながり、着実に成功に近づいていけるでしょう。',
-        '内なる才能を秘めています。自分を表現する機会を大切にすると、隠れた能力が発揮されるでしょう。',
-        analysis.get('sun_zone', 50))
-    add('金運線', 'money',
-        '金運に恵まれる傾向があります。お金が入るチャンスに恵まれ、貯蓄や投資のセンスもあるでしょう。',
-        '堅実な金銭感覚の持ち主。計画的に貯めることが得意で、安定した財産形成が期待できます。',
-        'お金より心の豊かさを大切にする傾向。必要な時に必要な分が入ってくる、流れに任せるタイプです。',
-        analysis.get('money_zone', 50))
-    add('健康線', 'health',
-        '体のバランスが良く、自己治癒力が高い傾向。健康管理への意識が高く、長く元気でいられるでしょう。',
-        '体調の波はありますが、休息を取れば回復するタイプ。無理をしすぎないことが長く健康でいる秘訣です。',
-        '繊細な体質。睡眠や食事を大切にし、ストレスを溜め込まない生活がおすすめです。',
-        analysis.get('health_zone', 50))
-    add('直感線', 'intuition',
-        '直感力・第六感が鋭い方。ひらめきに恵まれ、スピリチュアルな感覚にも敏感。芸術やヒーリングの才能があるかもしれません。',
-        '時々「なんとなく」で正解を導くことがあります。自分の感覚を信じることで、より良い選択ができるでしょう。',
-        '論理や経験を大切にするタイプ。直感を磨くには、静かに自分と向き合う時間を持つと良いでしょう。',
-        analysis.get('intuition_zone', 50))
-    return interpretations
+def decode_data_url(data):
+    """data:image/...;base64, の接頭辞を飛ばしてそのままデコード"""
+    comma = bytes(data[:256]).find(b',')
+    return binascii.a2b_base64(data[comma + 1:])
+
+
+def read_frame(name, kind, data, index):
+    """連写の1フレーム分のパート → (名前, バイト列, 入力エラー)"""
+    if name == 'image_data':
+        try:
+            return f'image_data[{index}]', decode_data_url(data), None
+        except binascii.Error:
+            return f'image_data[{index}]', None, '画像データの形式が正しくありません'
+    if kind != 'file' or not len(data):
+        return f'image[{index}]', None, '画像が送信されていません'
+    return f'image[{index}]', data, None
+
+
+def send_server_timing(handler):
+    timing = end_trace()
+    if timing:
+        handler.send_header('Server-Timing', timing)
+        handler.send_header('Timing-Allow-Origin', '*')
 
 
 def send_json(handler, data, status=200):
     handler.send_response(status)
     handler.send_header('Content-Type', 'application/json; charset=utf-8')
     handler.send_header('Access-Control-Allow-Origin', '*')
+    send_server_timing(handler)
     handler.end_headers()
     handler.wfile.write(json.dumps(data, ensure_ascii=False).encode('utf-8'))
 
 
-def process_analyze(img_bytes):
-    img = load_image(img_bytes)
-    if img is None or 0 in img.size:
-        return None, '画像の読み込みに失敗しました'
-    img = resize_if_needed(img)
-    lighting = assess_lighting(img)
-    edges, _ = detect_palm_lines(img)
-    analysis = analyze_line_characteristics(edges)
-    interpretations = get_palm_reading_interpretation(analysis)
-    visualization = create_visualization(img, edges)
-    viz_base64 = encode_image_to_base64(visualization)
-    edges_display = edges_to_visible_display(edges)
-    edges_base64 = encode_image_to_base64(edges_display)
-    categories = [
-        {'id': 'love_marriage', 'name': '恋愛・結婚', 'icon': '💕'},
-        {'id': 'work_success', 'name': '仕事・成功', 'icon': '💼'},
-        {'id': 'money', 'name': '金運・財産', 'icon': '💰'},
-        {'id': 'health', 'name': '健康・生命力', 'icon': '💪'},
-        {'id': 'intelligence', 'name': '知性・才能', 'icon': '📚'},
-        {'id': 'intuition', 'name': '直感・スピリチュアル', 'icon': '✨'},
-    ]
-    return {
-        'success': True,
-        'interpretations': interpretations,
-        'categories': categories,
-        'analysis': analysis,
-        'lighting': lighting,
-        'visualization': f'data:image/png;base64,{viz_base64}',
-        'edges_image': f'data:image/png;base64,{edges_base64}',
-    }, None
+def send_stream(handler, events, fmt):
+    """
+    イベントを1件ずつ書き出す（クライアントが切断したら残りの段階は実行しない）
+    記録は送り終えたときに終える（Server-Timing は本文より前に送るので付けない）
+    """
+    events = TracedStream(events)
+    handler.send_response(200)
+    handler.send_header('Content-Type', STREAM_MIME_TYPES[fmt])
+    handler.send_header('Cache-Control', 'no-cache')
+    handler.send_header('X-Accel-Buffering', 'no')
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    handler.end_headers()
+    try:
+        for event in events:
+            handler.wfile.write(encode_event(event, fmt))
+            handler.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        events.close()
+
+
+def send_image(handler, data, meta):
+    handler.send_response(200)
+    handler.send_header('Content-Type', meta['mime'])
+    handler.send_header('Content-Length', str(len(data)))
+    handler.send_header('Cache-Control', f'private, max-age={int(get_render_store().ttl)}')
+    handler.send_header('Vary', 'Accept')
+    handler.send_header('X-Render-Time-Ms', str(meta['render_ms']))
+    handler.send_header('X-Encode-Time-Ms', str(meta['encode_ms']))
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    send_server_timing(handler)
+    handler.end_headers()
+    handler.wfile.write(data)
 
 
 class handler(BaseHTTPRequestHandler):
@@ -174,10 +114,45 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
 
+    def query_params(self):
+        return {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+
     def do_GET(self):
-        send_json(self, {'status': 'ok', 'message': '手相解析API'}, 200)
+        begin_trace('analyze_image')
+        params = self.query_params()
+        if 'catalog' in params:
+            # 解釈カタログ（catalog=バージョン）
+            status, body, headers = catalog_response(params['catalog'], self.headers.get('If-None-Match'))
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            send_server_timing(self)
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if 'similar' in params:
+            # 似た手のひら（similar=署名、k=件数）。索引はインスタンスの /tmp などに置く
+            status, body = similar_response(params['similar'], params.get('k'))
+            send_json(self, body, status)
+            return
+        token = params.get('image')
+        if not token:
+            send_json(self, {'status': 'ok', 'message': '手相解析API', 'cache': get_cache().stats()}, 200)
+            return
+        # images=url で返した画像URL。取得された時点で描画・エンコードする
+        output = parse_output_options(params, self.headers.get('Accept', ''))
+        rendered = render_image(token, params.get('kind', ''), output)
+        if rendered is None:
+            send_json(self, {'error': '画像の有効期限が切れています。もう一度解析してください'}, 404)
+            return
+        send_image(self, *rendered)
 
     def do_POST(self):
+        begin_trace('analyze')
+        # 時間の予算はリクエストの受け付けから数える
+        started = time.monotonic()
         try:
             content_type = self.headers.get('Content-Type', '')
             content_length = int(self.headers.get('Content-Length', 0) or 0)
@@ -186,32 +161,74 @@ class handler(BaseHTTPRequestHandler):
                 send_json(self, {'error': '画像が送信されていません'}, 400)
                 return
 
-            body = self.rfile.read(content_length)
+            if content_length > MAX_BODY_SIZE:
+                send_json(self, {'error': '画像サイズが大きすぎます（最大16MB）'}, 413)
+                return
+
             img_bytes = None
+            params = self.query_params()
+            frames = []
 
             if 'multipart/form-data' in content_type:
-                form = parse_multipart(body, content_type)
-                if 'image' in form:
-                    kind, data = form['image']
-                    if kind == 'file' and data:
+                # 本文を最後まで読んでパートを取り出す（画像は memoryview のままデコーダへ渡す）
+                # フィールドは画像の前後どちらにあってもよい（Flask版の request.values と同じ）
+                # 本文は1つのバッファに読み込まれるので、画像のパートを全部持っていても余分なメモリは使わない
+                image_files, image_data = [], []
+                for name, kind, data in iter_multipart(self.rfile, content_type, content_length):
+                    if name == 'image':
+                        image_files.append((kind, data))
+                    elif name == 'image_data':
+                        image_data.append(data)
+                    elif kind == 'field':
+                        params[name] = bytes(data).decode('utf-8', errors='ignore').strip()
+                if params.get('burst') in ('1', 'true'):
+                    # 連写は image ファイル → image_data の順にすべてフレームにする（Flask版と同じ順）
+                    for kind, data in image_files:
+                        frames.append(read_frame('image', kind, data, len(frames)))
+                    for data in image_data:
+                        frames.append(read_frame('image_data', 'field', data, len(frames)))
+                elif image_files:
+                    # 最初の image を使う（image_data より優先）
+                    kind, data = image_files[0]
+                    if kind == 'file' and len(data):
                         img_bytes = data
-                elif 'image_data' in form:
-                    kind, image_data = form['image_data']
-                    if image_data and ',' in image_data:
-                        image_data = image_data.split(',')[1]
-                    if image_data:
-                        img_bytes = base64.b64decode(image_data)
+                elif image_data and len(image_data[0]):
+                    img_bytes = decode_data_url(image_data[0])
+
+            output = parse_output_options(params, self.headers.get('Accept', ''))
+            image_mode = params.get('images', 'inline')
+            interpretations = params.get('interpretations', 'full')
+            deadline = request_deadline(params.get('deadline_ms'), started)
+
+            if frames:
+                # 連写から一番よいフレームを選んで解析する
+                if len(frames) > MAX_BURST_FRAMES:
+                    send_json(self, {'error': f'一度に送れるフレームは{MAX_BURST_FRAMES}枚までです'}, 400)
+                    return
+                result, err = analyze_burst(frames, image_mode, output, interpretations, deadline)
+                if err:
+                    send_json(self, {'error': err}, 400)
+                    return
+                send_json(self, result, 200)
+                return
 
             if img_bytes is None:
                 send_json(self, {'error': '画像が送信されていません'}, 400)
                 return
 
-            result, err = process_analyze(img_bytes)
+            fmt = stream_format(params.get('progressive'), self.headers.get('Accept', ''))
+            if fmt:
+                # 縮小画像での速報 → 解析結果 → 画像 の順に届いたものから返す
+                send_stream(self, iter_progressive(img_bytes, image_mode, output, interpretations, deadline), fmt)
+                return
+            result, err = analyze_image_bytes(img_bytes, image_mode, output, interpretations, deadline)
             if err:
                 send_json(self, {'error': err}, 400)
                 return
 
             send_json(self, result, 200)
 
+        except PayloadTooLarge:
+            send_json(self, {'error': '画像サイズが大きすぎます（最大16MB）'}, 413)
         except Exception as e:
             send_json(self, {'error': str(e)}, 500)
@@ -4,110 +4,272 @@ Flask + Pillow による画像処理（Vercel互換）
 """
 
 import os
+import json
 import base64
-from flask import Flask, request, jsonify, send_from_directory
-
-from image_processing import (
-    load_image,
-    resize_if_needed,
-    assess_lighting,
-    detect_palm_lines,
-    analyze_line_characteristics,
-    create_visualization,
-    edges_to_visible_display,
-    encode_image_to_base64,
-)
-from palm_interpretation import get_palm_reading_interpretation
-
-app = Flask(__name__, static_folder='public', static_url_path='')
+from flask import Flask, Response, request, jsonify
+
+from analysis_cache import get_cache
+from batch import MAX_BATCH_ITEMS, analyze_batch, iter_batch
+from burst import MAX_BURST_FRAMES, analyze_burst
+from deadline import request_deadline
+from image_output import parse_output_options
+from instrumentation import TracedStream, begin_trace, end_trace, registry
+from jobs import QueueFull, get_job_queue
+from palm_analysis import analyze_image_bytes, catalog_response, render_image, similar_response
+from progressive import STREAM_MIME_TYPES, encode_event, iter_progressive, stream_format
+from render_store import get_render_store
+from static_assets import get_static_assets
+
+# public/ は static_assets で配信する（フィンガープリント・圧縮・ETag）
+app = Flask(__name__, static_folder=None)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+# ジョブの完了を待つ時間の上限（秒）
+MAX_JOB_WAIT = 30
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-@app.route('/')
-def index():
-    return send_from_directory('public', 'index.html')
+@app.before_request
+def start_trace():
+    if request.path.startswith('/api/'):
+        begin_trace(request.endpoint or request.path)
+
+
+@app.after_request
+def add_server_timing(response):
+    if response.is_streamed:
+        # 本文はこの後に作られるので、送り終えたときに記録を終える（Server-Timing は付けない）
+        response.response = TracedStream(response.response)
+        return response
+    timing = end_trace()
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+
+@app.route('/', defaults={'filename': 'index.html'})
+@app.route('/<path:filename>')
+def static_asset(filename):
+    """
+    public/ のファイル（圧縮済みのものを Accept-Encoding で選び、If-None-Match なら 304）
+    v=フィンガープリント 付きのURL（index.html・manifest.json の参照）は長期キャッシュを許す
+    """
+    status, body, headers = get_static_assets(reload=app.debug).response(
+        filename, request.args.get('v'), request.headers.get('Accept-Encoding', ''),
+        request.headers.get('If-None-Match'))
+    if status == 404:
+        return jsonify({'error': 'ファイルが見つかりません'}), 404
+    return Response(body, status=status, headers=headers)
 
 
-@app.route('/manifest.json')
-def manifest():
-    return send_from_directory('public', 'manifest.json')
+def read_image_upload():
+    """
+    リクエストから画像バイト列を取り出す（image ファイルまたは image_data の data URL）
+    戻り値: (バイト列, エラーレスポンス)
+    """
+    if 'image' not in request.files and 'image_data' not in request.form:
+        return None, (jsonify({'error': '画像が送信されていません'}), 400)
+    if 'image' in request.files:
+        file = request.files['image']
+        if file.filename == '':
+            return None, (jsonify({'error': 'ファイルが選択されていません'}), 400)
+        if not allowed_file(file.filename):
+            return None, (jsonify({'error': '許可されていないファイル形式です（png, jpg, jpeg, webp）'}), 400)
+        return file.read(), None
+    image_data = request.form['image_data']
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data), None
 
 
-@app.route('/sw.js')
-def service_worker():
-    return send_from_directory('public', 'sw.js'), 200, {
-        'Content-Type': 'application/javascript',
-        'Service-Worker-Allowed': '/'
-    }
+def read_image_items():
+    """複数の画像（image ファイル・image_data の data URL）を [(名前, バイト列, 入力エラー)] にする"""
+    items = []
+    for file in request.files.getlist('image'):
+        if not allowed_file(file.filename):
+            items.append((file.filename, None, '許可されていないファイル形式です（png, jpg, jpeg, webp）'))
+        else:
+            items.append((file.filename, file.read(), None))
+    for i, image_data in enumerate(request.form.getlist('image_data')):
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        try:
+            items.append((f'image_data[{i}]', base64.b64decode(image_data), None))
+        except ValueError:
+            items.append((f'image_data[{i}]', None, '画像データの形式が正しくありません'))
+    return items
 
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
-    if 'image' not in request.files and 'image_data' not in request.form:
-        return jsonify({'error': '画像が送信されていません'}), 400
-    
+    # 時間の予算はリクエストの受け付けから数える
+    deadline = request_deadline(request.values.get('deadline_ms'))
     try:
-        if 'image' in request.files:
-            file = request.files['image']
-            if file.filename == '':
-                return jsonify({'error': 'ファイルが選択されていません'}), 400
-            if not allowed_file(file.filename):
-                return jsonify({'error': '許可されていないファイル形式です（png, jpg, jpeg, webp）'}), 400
-            
-            img_bytes = file.read()
-        else:
-            image_data = request.form['image_data']
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            img_bytes = base64.b64decode(image_data)
-        
-        img = load_image(img_bytes)
-        if img is None or 0 in img.size:
-            return jsonify({'error': '画像の読み込みに失敗しました'}), 400
-        
-        img = resize_if_needed(img)
-        lighting = assess_lighting(img)
+        if request.values.get('burst') in ('1', 'true'):
+            return analyze_burst_view(deadline)
+        img_bytes, error = read_image_upload()
+        if error:
+            return error
 
-        # 手相解析
-        edges, enhanced = detect_palm_lines(img)
-        analysis = analyze_line_characteristics(edges)
-        interpretations = get_palm_reading_interpretation(analysis)
-        
-        # ビジュアル画像生成
-        visualization = create_visualization(img, edges)
-        viz_base64 = encode_image_to_base64(visualization)
-        edges_display = edges_to_visible_display(edges)
-        edges_base64 = encode_image_to_base64(edges_display)
-        
-        # カテゴリ一覧（見たい分野を選べるように）
-        categories = [
-            {'id': 'love_marriage', 'name': '恋愛・結婚', 'icon': '💕'},
-            {'id': 'work_success', 'name': '仕事・成功', 'icon': '💼'},
-            {'id': 'money', 'name': '金運・財産', 'icon': '💰'},
-            {'id': 'health', 'name': '健康・生命力', 'icon': '💪'},
-            {'id': 'intelligence', 'name': '知性・才能', 'icon': '📚'},
-            {'id': 'intuition', 'name': '直感・スピリチュアル', 'icon': '✨'},
-        ]
-        
-        return jsonify({
-            'success': True,
-            'interpretations': interpretations,
-            'categories': categories,
-            'analysis': analysis,
-            'lighting': lighting,
-            'visualization': f'data:image/png;base64,{viz_base64}',
-            'edges_image': f'data:image/png;base64,{edges_base64}',
-        })
+        image_mode = request.values.get('images', 'inline')
+        output = parse_output_options(request.values, request.headers.get('Accept', ''))
+        interpretations = request.values.get('interpretations', 'full')
+        fmt = stream_format(request.values.get('progressive'), request.headers.get('Accept', ''))
+        if fmt:
+            # 縮小画像での速報 → 解析結果 → 画像 の順に届いたものから返す
+            events = (encode_event(event, fmt) for event in iter_progressive(img_bytes, image_mode, output, interpretations, deadline))
+            return Response(events, mimetype=STREAM_MIME_TYPES[fmt],
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        result, err = analyze_image_bytes(img_bytes, image_mode, output, interpretations, deadline)
+        if err:
+            return jsonify({'error': err}), 400
+
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def analyze_burst_view(deadline=None):
+    """連写（image / image_data を複数）から一番よいフレームを選んで解析する（burst=1）"""
+    frames = read_image_items()
+    if not frames:
+        return jsonify({'error': '画像が送信されていません'}), 400
+    if len(frames) > MAX_BURST_FRAMES:
+        return jsonify({'error': f'一度に送れるフレームは{MAX_BURST_FRAMES}枚までです'}), 400
+    output = parse_output_options(request.values, request.headers.get('Accept', ''))
+    result, err = analyze_burst(frames, request.values.get('images', 'inline'), output,
+                                request.values.get('interpretations', 'full'), deadline)
+    if err:
+        return jsonify({'error': err}), 400
+    return jsonify(result)
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch_view():
+    """
+    複数画像の一括解析（image を複数ファイル、または image_data を複数送信）
+    stream=1 なら終わった順に1行1件のJSON（NDJSON）で返す
+    """
+    items = read_image_items()
+    if not items:
+        return jsonify({'error': '画像が送信されていません'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'一度に解析できるのは{MAX_BATCH_ITEMS}枚までです'}), 400
+
+    image_mode = request.values.get('images', 'none')
+    if image_mode == 'url':
+        image_mode = 'inline'
+    output = parse_output_options(request.values, request.headers.get('Accept', ''))
+    interpretations = request.values.get('interpretations', 'full')
+    if request.values.get('stream') in ('1', 'true'):
+        lines = (json.dumps(r, ensure_ascii=False) + '\n'
+                 for r in iter_batch(items, image_mode, output, interpretations))
+        return Response(lines, mimetype='application/x-ndjson')
+    results = analyze_batch(items, image_mode, output, interpretations)
+    return jsonify({'success': True, 'count': len(results), 'results': results})
+
+
+@app.route('/api/analyze', methods=['GET'])
+def analyze_image():
+    """
+    images=url で返した画像URL。取得された時点で描画・エンコードする
+    catalog=バージョン なら解釈カタログを返す
+    similar=署名 なら似た手のひらを返す（k=件数）
+    """
+    if 'catalog' in request.args:
+        status, body, headers = catalog_response(request.args['catalog'], request.headers.get('If-None-Match'))
+        return Response(body, status=status, mimetype='application/json', headers=headers)
+    if 'similar' in request.args:
+        status, body = similar_response(request.args['similar'], request.args.get('k'))
+        return jsonify(body), status
+    token = request.args.get('image')
+    if not token:
+        return jsonify({'status': 'ok', 'message': '手相解析API'})
+    output = parse_output_options(request.args, request.headers.get('Accept', ''))
+    rendered = render_image(token, request.args.get('kind', ''), output)
+    if rendered is None:
+        return jsonify({'error': '画像の有効期限が切れています。もう一度解析してください'}), 404
+    data, meta = rendered
+    return Response(data, mimetype=meta['mime'], headers={
+        'Cache-Control': f'private, max-age={int(get_render_store().ttl)}',
+        'Vary': 'Accept',
+        'X-Render-Time-Ms': str(meta['render_ms']),
+        'X-Encode-Time-Ms': str(meta['encode_ms']),
+    })
+
+
+def wait_seconds():
+    """wait=秒 の指定（ジョブの完了を待つ時間、上限 MAX_JOB_WAIT）"""
+    try:
+        return min(max(float(request.values.get('wait') or 0), 0.0), MAX_JOB_WAIT)
+    except ValueError:
+        return 0.0
+
+
+def job_response(job):
+    info = get_job_queue().describe(job)
+    if job.done.is_set():
+        return jsonify(info)
+    return jsonify(info), 202, {'Location': f'/api/jobs/{job.id}'}
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    解析ジョブを受け付ける（入力は /api/analyze と同じ）
+    wait=秒 を付けるとその間は完了を待ち、終わっていれば結果を返す（未完了なら 202 と状態）
+    待ち行列が満杯なら 429 と Retry-After を返す
+    """
+    try:
+        img_bytes, error = read_image_upload()
+    except ValueError:
+        return jsonify({'error': '画像データの形式が正しくありません'}), 400
+    if error:
+        return error
+    image_mode = request.values.get('images', 'inline')
+    output = parse_output_options(request.values, request.headers.get('Accept', ''))
+    try:
+        job = get_job_queue().submit(img_bytes, image_mode, output, request.values.get('interpretations', 'full'))
+    except QueueFull as full:
+        return jsonify({
+            'error': '混み合っています。しばらくしてからもう一度お試しください',
+            'queue_depth': full.queue_depth,
+            'estimated_wait': round(full.estimated_wait, 2),
+        }), 429, {'Retry-After': str(full.retry_after)}
+    job.done.wait(wait_seconds())
+    return job_response(job)
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """ジョブの状態（wait=秒 で完了を待てる）。完了していれば結果を含む"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません（期限切れの可能性があります）'}), 404
+    job.done.wait(wait_seconds())
+    return job_response(job)
+
+
+@app.route('/api/jobs')
+def job_stats():
+    return jsonify(get_job_queue().stats())
+
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    return jsonify(get_cache().stats())
+
+
+@app.route('/metrics')
+def metrics():
+    """段階別レイテンシのヒストグラム（Prometheus のテキスト形式）"""
+    return Response(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
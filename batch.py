@@ -0,0 +1,91 @@
+"""
+複数画像の一括解析（app.py の /api/analyze/batch 用）
+画像処理はCPUを使い切るので、プロセスプールに振り分けてGILに縛られずコア数分並列に処理する
+プールは最初の利用時に作り、以降のリクエストで使い回す
+
+環境変数:
+  PALM_BATCH_WORKERS  ワーカープロセス数（既定: CPUコア数）
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from palm_analysis import compact_result, process_analyze
+
+MAX_BATCH_ITEMS = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _analyze_item(img_bytes, image_mode, output, interpretations):
+    """ワーカープロセスで1枚解析する（失敗は結果に入れて返し、他の画像に影響させない）"""
+    try:
+        result, err = process_analyze(img_bytes, image_mode, output)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    if err:
+        return {'success': False, 'error': err}
+    if interpretations == 'compact':
+        result = compact_result(result)
+    return result
+
+
+def get_pool():
+    """プロセス共通のワーカープールを返す（なければ作る）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get('PALM_BATCH_WORKERS', 0)) or os.cpu_count() or 1
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def _reset_pool(pool):
+    """ワーカーが異常終了したプールを捨て、次の一括解析で作り直す"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(items, image_mode, output, interpretations):
+    pool = get_pool()
+    futures = {}
+    for index, (name, img_bytes, error) in enumerate(items):
+        if error is None:
+            futures[pool.submit(_analyze_item, img_bytes, image_mode, output, interpretations)] = index
+    return pool, futures
+
+
+def _result(pool, future):
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        return {'success': False, 'error': '解析プロセスが異常終了しました'}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+def iter_batch(items, image_mode='none', output=None, interpretations='full'):
+    """
+    items: [(名前, 画像バイト列, 入力エラー)] を並列に解析し、終わった順に結果を返す
+    入力エラーがある項目は解析せずにそのエラーを返す
+    各結果には入力順の index と name が入る
+    """
+    for index, (name, _, error) in enumerate(items):
+        if error is not None:
+            yield {'index': index, 'name': name, 'success': False, 'error': error}
+    pool, futures = _submit(items, image_mode, output, interpretations)
+    for future in as_completed(futures):
+        index = futures[future]
+        yield {'index': index, 'name': items[index][0], **_result(pool, future)}
+
+
+def analyze_batch(items, image_mode='none', output=None, interpretations='full'):
+    """iter_batch の結果を入力順に並べて返す"""
+    return sorted(iter_batch(items, image_mode, output, interpretations), key=lambda r: r['index'])
@@ -0,0 +1 @@
+"""手相解析パイプラインのベンチマーク・負荷試験ツール"""
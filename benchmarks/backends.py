@@ -0,0 +1,134 @@
+"""
+計算の実装（compute_backend の pillow / numpy）の一致の確認と速度の比較
+合成画像（サイズ × 照明条件）ごとに、同じ縮小画像から各実装で線の検出・ゾーン採点・重ね合わせを行い
+- ゾーンのスコアの差が SCORE_TOLERANCE 以内か（超えたら終了コード1）
+- 検出線・重ね合わせ画像の画素が異なる数
+- 段階ごとの時間の中央値
+を報告する。numpy が読み込めない環境では pillow だけを計測する
+
+使い方:
+  python -m benchmarks.backends
+  python -m benchmarks.backends --sizes 2,12 --repeat 5 -o backends.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+from PIL import ImageChops
+
+from benchmarks.synthetic import LIGHTING_FACTORS, encode_upload, make_palm_image
+from compute_backend import BACKEND_NAMES, NumpyBackend, PillowBackend, count_nonzero, set_backend
+from image_processing import (
+    WORKING_SIZE,
+    AnalysisContext,
+    analyze_line_characteristics,
+    create_visualization,
+    detect_palm_lines,
+    load_image,
+    resize_if_needed,
+)
+
+DEFAULT_SIZES = (0.3, 2.0, 12.0)
+# 実装間で許すゾーンのスコア（0〜100）の差。どちらも同じ画素の整数の集計なので、実際には0になる
+SCORE_TOLERANCE = 0.01
+
+
+def available_backends():
+    backends = [PillowBackend()]
+    try:
+        backends.append(NumpyBackend())
+    except ImportError:
+        pass
+    return backends
+
+
+def run_backend(backend, img, repeat):
+    """1つの実装で線の検出・ゾーン採点・重ね合わせを repeat 回行い、(結果, 段階ごとの中央値ms) を返す"""
+    previous = set_backend(backend)
+    try:
+        timings = {'detect_palm_lines': [], 'analyze_line_characteristics': [], 'create_visualization': []}
+        for _ in range(repeat):
+            started = time.perf_counter()
+            edges, _ = detect_palm_lines(img, ctx=AnalysisContext(img))
+            detected = time.perf_counter()
+            analysis = analyze_line_characteristics(edges)
+            scored = time.perf_counter()
+            visualization = create_visualization(img, edges)
+            rendered = time.perf_counter()
+            timings['detect_palm_lines'].append((detected - started) * 1000)
+            timings['analyze_line_characteristics'].append((scored - detected) * 1000)
+            timings['create_visualization'].append((rendered - scored) * 1000)
+    finally:
+        set_backend(previous)
+    medians = {name: round(statistics.median(values), 3) for name, values in timings.items()}
+    return (edges, analysis, visualization), medians
+
+
+def different_pixels(a, b):
+    difference = ImageChops.difference(a, b)
+    if difference.mode != 'L':
+        difference = difference.convert('L')
+    return count_nonzero(difference)
+
+
+def compare_case(megapixels, lighting, repeat, seed, backends):
+    upload = encode_upload(make_palm_image(megapixels, lighting, seed))
+    img = resize_if_needed(load_image(upload, max_size=WORKING_SIZE))
+    results = {backend.name: run_backend(backend, img, repeat) for backend in backends}
+    (base_edges, base_analysis, base_viz), _ = results['pillow']
+    case = {'megapixels': megapixels, 'lighting': lighting, 'backends': {}}
+    for name, ((edges, analysis, visualization), timings) in results.items():
+        max_diff = max(abs(analysis[zone] - base_analysis[zone]) for zone in base_analysis)
+        case['backends'][name] = {
+            'timings_ms': timings,
+            'max_score_diff': round(max_diff, 6),
+            'edge_pixels_diff': different_pixels(edges, base_edges),
+            'visualization_pixels_diff': different_pixels(visualization, base_viz),
+            'within_tolerance': max_diff <= SCORE_TOLERANCE,
+        }
+    return case
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='計算の実装（pillow / numpy）の一致の確認と速度の比較')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES), help='画像の画素数（MP、カンマ区切り）')
+    parser.add_argument('--lighting', default=','.join(LIGHTING_FACTORS), help='照明条件（カンマ区切り）')
+    parser.add_argument('--repeat', type=int, default=3, help='ケースごとの計測回数')
+    parser.add_argument('--seed', type=int, default=0, help='合成画像の乱数シード')
+    parser.add_argument('-o', '--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    backends = available_backends()
+    missing = [name for name in BACKEND_NAMES if name not in {b.name for b in backends}]
+    if missing:
+        print(f'読み込めない実装: {", ".join(missing)}（pillow だけを計測します）', file=sys.stderr)
+
+    cases = {}
+    failed = False
+    for megapixels in (float(s) for s in args.sizes.split(',') if s):
+        for lighting in (name for name in args.lighting.split(',') if name):
+            case_id = f'{megapixels}MP-{lighting}'
+            case = cases[case_id] = compare_case(megapixels, lighting, args.repeat, args.seed, backends)
+            for name, info in case['backends'].items():
+                timings = ' '.join(f'{stage} {ms:.1f}ms' for stage, ms in info['timings_ms'].items())
+                mark = 'OK' if info['within_tolerance'] else 'NG'
+                print(f'{case_id:<20} {name:<7} {mark} スコア差 {info["max_score_diff"]:.4f}'
+                      f' 画素差 {info["edge_pixels_diff"]}/{info["visualization_pixels_diff"]}  {timings}')
+                failed = failed or not info['within_tolerance']
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            json.dump({'tolerance': SCORE_TOLERANCE, 'cases': cases}, out, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
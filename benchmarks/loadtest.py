@@ -0,0 +1,367 @@
+"""
+ローカルの負荷試験（Flask の app.py と Vercel の api/analyze.handler を実際のHTTPサーバーとして起動して計測）
+サーバーは別プロセスで起動し、合成画像の multipart（image ファイル）と image_data（base64）のアップロードを
+決まった割合で混ぜて送る。同時接続数（閉じた系）または到着率（開いた系、ポアソン到着）を段階ごとに変え、
+- スループット・レイテンシの p50 / p95 / p99・エラー率・レスポンスの大きさ
+- サーバープロセスの CPU 使用率・常駐メモリの推移（/proc から一定間隔で取得）
+を報告する。同時接続数を増やしてもスループットが伸びなくなる点が、そのコア数での飽和点
+
+使い方:
+  python -m benchmarks.loadtest
+  python -m benchmarks.loadtest --target flask,vercel --concurrency 1,2,4,8 --duration 15
+  python -m benchmarks.loadtest --target vercel --rate 2,4,8 --mix multipart=1,image_data=1 -o load.json
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+from benchmarks.synthetic import encode_upload, make_palm_image
+
+HOST = '127.0.0.1'
+# 対象 → サーバーを起動するスクリプト（{port} にポート番号が入る）
+SERVER_SCRIPTS = {
+    'flask': (
+        'from app import app\n'
+        'app.run(host={host!r}, port={port}, threaded=True, use_reloader=False)\n'
+    ),
+    'vercel': (
+        'from http.server import ThreadingHTTPServer\n'
+        'from api.analyze import handler\n'
+        'handler.log_message = lambda *args: None\n'
+        'ThreadingHTTPServer(({host!r}, {port}), handler).serve_forever()\n'
+    ),
+}
+UPLOAD_KINDS = ('multipart', 'image_data')
+SERVER_START_TIMEOUT = 30
+REQUEST_TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(target, env_overrides):
+    """対象のサーバーを別プロセスで起動し、応答するまで待つ。戻り値: (プロセス, ポート)"""
+    port = free_port()
+    env = {**os.environ, **env_overrides}
+    script = SERVER_SCRIPTS[target].format(host=HOST, port=port)
+    process = subprocess.Popen([sys.executable, '-c', script], cwd=_root, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{target} のサーバーが起動できませんでした（終了コード {process.returncode}）')
+        try:
+            conn = http.client.HTTPConnection(HOST, port, timeout=2)
+            conn.request('GET', '/api/analyze')
+            conn.getresponse().read()
+            conn.close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{target} のサーバーが {SERVER_START_TIMEOUT} 秒以内に応答しませんでした')
+
+
+def multipart_body(fields, files):
+    """fields: {名前: 値}、files: [(名前, ファイル名, バイト列)] から multipart/form-data の本文を作る"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def build_payloads(sizes, variants, fields):
+    """アップロードの種類 → [(本文, Content-Type)]（画像ごとに乱数シードを変えてキャッシュに当たらないようにする）"""
+    payloads = {kind: [] for kind in UPLOAD_KINDS}
+    for megapixels in sizes:
+        for seed in range(variants):
+            upload = encode_upload(make_palm_image(megapixels, 'normal', seed))
+            payloads['multipart'].append(multipart_body(fields, [('image', f'palm{seed}.jpg', upload)]))
+            data_url = 'data:image/jpeg;base64,' + base64.b64encode(upload).decode('ascii')
+            payloads['image_data'].append(multipart_body({**fields, 'image_data': data_url}, []))
+    return payloads
+
+
+def parse_mix(value):
+    """multipart=3,image_data=1 → {種類: 重み}"""
+    mix = {}
+    for item in value.split(','):
+        if not item:
+            continue
+        name, _, weight = item.partition('=')
+        if name not in UPLOAD_KINDS:
+            raise ValueError(f'不明なアップロードの種類: {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def send_request(port, body, content_type):
+    """1件送信する。戻り値: (ステータス（接続エラーは0）, レイテンシ秒, レスポンスのバイト数)"""
+    started = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection(HOST, port, timeout=REQUEST_TIMEOUT)
+        conn.request('POST', '/api/analyze', body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response.status, time.perf_counter() - started, len(data)
+    except OSError:
+        return 0, time.perf_counter() - started, 0
+
+
+class ProcessSampler:
+    """サーバープロセスの CPU 時間・常駐メモリを一定間隔で記録する（Linux の /proc から）"""
+
+    def __init__(self, pid, interval):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _read(self):
+        try:
+            with open(f'/proc/{self.pid}/stat', encoding='ascii') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / self._ticks  # utime + stime
+            with open(f'/proc/{self.pid}/status', encoding='ascii') as f:
+                rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+            return cpu, rss
+        except (OSError, StopIteration, IndexError, ValueError):
+            return None
+
+    def _run(self):
+        started = time.monotonic()
+        previous = self._read()
+        previous_at = started
+        while not self._stop.wait(self.interval):
+            current = self._read()
+            now = time.monotonic()
+            if current is None or previous is None:
+                break
+            self.samples.append({
+                't': round(now - started, 2),
+                'cpu_percent': round((current[0] - previous[0]) / (now - previous_at) * 100, 1),
+                'rss_mb': round(current[1] / 1024 / 1024, 1),
+            })
+            previous, previous_at = current, now
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+
+def percentile(values, q):
+    """最近傍順位法の百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_step(port, payloads, mix, duration, concurrency=None, rate=None, seed=0):
+    """
+    1段階分の負荷をかける
+    concurrency: 同時接続数（前の応答が返ったらすぐ次を送る）
+    rate: 1秒あたりの到着数（応答を待たずにポアソン到着で送る。同時に送る数は concurrency までに制限しない）
+    """
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    results = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def pick():
+        with lock:
+            kind = rng.choices(kinds, weights)[0]
+            return kind, rng.choice(payloads[kind])
+
+    def record(kind, outcome):
+        with lock:
+            results.append((kind, *outcome))
+
+    def closed_worker():
+        while time.monotonic() < deadline:
+            kind, (body, content_type) = pick()
+            record(kind, send_request(port, body, content_type))
+
+    threads = []
+    started = time.monotonic()
+    if rate:
+        next_at = started
+        while True:
+            next_at += rng.expovariate(rate)
+            if next_at >= deadline:
+                break
+            time.sleep(max(0.0, next_at - time.monotonic()))
+            kind, (body, content_type) = pick()
+            thread = threading.Thread(target=lambda k=kind, b=body, c=content_type: record(k, send_request(port, b, c)),
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+    else:
+        threads = [threading.Thread(target=closed_worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return summarize(results, elapsed)
+
+
+def summarize(results, elapsed):
+    latencies = [latency * 1000 for _, status, latency, _ in results if status == 200]
+    sizes = [size for _, status, _, size in results if status == 200]
+    statuses = {}
+    for _, status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    by_kind = {}
+    for kind, status, latency, _ in results:
+        if status == 200:
+            by_kind.setdefault(kind, []).append(latency * 1000)
+    errors = len(results) - len(latencies)
+
+    def rounded(value):
+        return round(value, 1) if value is not None else None
+
+    return {
+        'requests': len(results),
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'error_rate': round(errors / len(results), 4) if results else 0,
+        'statuses': statuses,
+        'latency_ms': {f'p{q}': rounded(percentile(latencies, q)) for q in (50, 95, 99)},
+        'latency_ms_by_upload': {kind: rounded(percentile(values, 50)) for kind, values in by_kind.items()},
+        'response_bytes': {
+            'mean': round(statistics.mean(sizes)) if sizes else None,
+            'p50': percentile(sizes, 50),
+        },
+    }
+
+
+def resource_summary(samples):
+    if not samples:
+        return {}
+    cpu = [s['cpu_percent'] for s in samples]
+    rss = [s['rss_mb'] for s in samples]
+    return {
+        'cpu_percent_mean': round(statistics.mean(cpu), 1),
+        'cpu_percent_max': max(cpu),
+        'rss_mb_max': max(rss),
+        'rss_mb_last': rss[-1],
+    }
+
+
+def run_target(target, args, payloads, mix):
+    env = {'PALM_CACHE_SIZE': '0'} if not args.cache else {}
+    process, port = start_server(target, env)
+    steps = []
+    try:
+        # 1回目は読み込み・初回の解析の分遅いので、計測前に数件流しておく
+        for body, content_type in payloads[next(iter(mix))][:args.warmup]:
+            send_request(port, body, content_type)
+        plan = [('rate', value) for value in args.rate] if args.rate else [('concurrency', value) for value in args.concurrency]
+        for mode, value in plan:
+            sampler = ProcessSampler(process.pid, args.sample_interval).start()
+            step = run_step(port, payloads, mix, args.duration, seed=args.seed,
+                            **({'rate': value} if mode == 'rate' else {'concurrency': int(value)}))
+            samples = sampler.stop()
+            step.update({mode: value, 'server': resource_summary(samples), 'timeline': samples})
+            steps.append(step)
+            server = step['server']
+            print(f'{target:<7} {mode} {value:<5} {step["throughput_rps"]:7.2f} req/s'
+                  f'  p50 {step["latency_ms"]["p50"]} p95 {step["latency_ms"]["p95"]} p99 {step["latency_ms"]["p99"]} ms'
+                  f'  エラー {step["error_rate"]:.1%}  {step["response_bytes"]["mean"]} B'
+                  f'  CPU {server.get("cpu_percent_mean")}%  RSS {server.get("rss_mb_max")} MB')
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    best = max(steps, key=lambda step: step['throughput_rps'])
+    cores = os.cpu_count() or 1
+    return {
+        'steps': steps,
+        'peak_throughput_rps': best['throughput_rps'],
+        'peak_throughput_per_core': round(best['throughput_rps'] / cores, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Flask版・Vercel版サーバーのローカル負荷試験')
+    parser.add_argument('--target', default='flask,vercel', help='対象（flask / vercel、カンマ区切り）')
+    parser.add_argument('--concurrency', default='1,2,4', help='同時接続数の段階（カンマ区切り）')
+    parser.add_argument('--rate', default='', help='到着率（req/s）の段階。指定すると同時接続数の代わりに使う')
+    parser.add_argument('--duration', type=float, default=10.0, help='1段階の時間（秒）')
+    parser.add_argument('--mix', default='multipart=1,image_data=1', help='アップロードの種類の重み')
+    parser.add_argument('--sizes', default='2', help='画像の画素数（MP、カンマ区切り）')
+    parser.add_argument('--variants', type=int, default=4, help='画像の種類数（サイズごと）')
+    parser.add_argument('--images', default='none', help='images の指定（inline / url / vector / none）')
+    parser.add_argument('--interpretations', default='compact', help='interpretations の指定（full / compact）')
+    parser.add_argument('--cache', action='store_true', help='サーバーの解析結果キャッシュを有効のままにする')
+    parser.add_argument('--warmup', type=int, default=2, help='計測前に送る件数')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='CPU・メモリを記録する間隔（秒）')
+    parser.add_argument('--seed', type=int, default=0, help='送る画像・到着間隔の乱数シード')
+    parser.add_argument('-o', '--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    targets = [name for name in args.target.split(',') if name]
+    unknown = [name for name in targets if name not in SERVER_SCRIPTS]
+    if unknown:
+        parser.error(f'不明な対象: {", ".join(unknown)}')
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    args.concurrency = [int(v) for v in args.concurrency.split(',') if v]
+    args.rate = [float(v) for v in args.rate.split(',') if v]
+
+    fields = {'images': args.images, 'interpretations': args.interpretations}
+    payloads = build_payloads([float(s) for s in args.sizes.split(',') if s], args.variants, fields)
+    results = {target: run_target(target, args, payloads, mix) for target in targets}
+    for target, result in results.items():
+        print(f'{target}: 最大 {result["peak_throughput_rps"]} req/s'
+              f'（1コアあたり {result["peak_throughput_per_core"]}、{os.cpu_count()} コア）')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            json.dump({'meta': {'cpu_count': os.cpu_count(), 'mix': mix, 'images': args.images,
+                                'duration_s': args.duration, 'cache': args.cache},
+                       'targets': results}, out, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+解析パイプラインの段階別ベンチマーク
+合成画像（サイズ × 照明条件）ごとに /api/analyze と同じ順で各段階を実行し、段階ごとの時間をJSONに書き出す
+--compare で保存済みの結果と比べ、遅くなった段階があれば終了コード1で知らせる
+
+使い方:
+  python -m benchmarks.run -o bench.json
+  python -m benchmarks.run --sizes 0.3,12,48 --repeat 5 --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+# プロジェクトルートをパスに追加（python benchmarks/run.py でも動くように）
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import PIL
+
+from benchmarks.synthetic import LIGHTING_FACTORS, encode_upload, make_palm_image
+from image_processing import (
+    WORKING_SIZE,
+    AnalysisContext,
+    load_image,
+    resize_if_needed,
+    assess_lighting,
+    detect_palm_lines,
+    analyze_line_characteristics,
+    create_visualization,
+    edges_to_visible_display,
+    encode_image_to_base64,
+)
+
+DEFAULT_SIZES = (0.3, 2.0, 12.0, 48.0)
+# 比較時、この時間（ms）未満の差は誤差として扱う
+NOISE_FLOOR_MS = 2.0
+
+
+def run_pipeline_once(upload):
+    """1回分のパイプラインを実行し、段階名 → 秒 を返す"""
+    timings = {}
+
+    def timed(name, func, *args, **kwargs):
+        started = time.perf_counter()
+        value = func(*args, **kwargs)
+        timings[name] = time.perf_counter() - started
+        return value
+
+    img = timed('load_image', load_image, upload, max_size=WORKING_SIZE)
+    img = timed('resize_if_needed', resize_if_needed, img)
+    ctx = AnalysisContext(img)
+    timed('assess_lighting', assess_lighting, img, ctx)
+    edges, _ = timed('detect_palm_lines', detect_palm_lines, img, ctx=ctx)
+    timed('analyze_line_characteristics', analyze_line_characteristics, edges)
+    visualization = timed('create_visualization', create_visualization, img, edges)
+    edges_display = timed('edges_to_visible_display', edges_to_visible_display, edges)
+    timed('encode_visualization', encode_image_to_base64, visualization)
+    timed('encode_edges', encode_image_to_base64, edges_display)
+    return timings
+
+
+def bench_case(megapixels, lighting, repeat, seed):
+    """1ケースを repeat 回計測し、段階ごとの中央値・最小値（ms）を返す"""
+    upload = encode_upload(make_palm_image(megapixels, lighting, seed))
+    runs = [run_pipeline_once(upload) for _ in range(repeat)]
+    stages = {}
+    for name in runs[0]:
+        values = [run[name] * 1000 for run in runs]
+        stages[name] = {'median_ms': round(statistics.median(values), 3), 'min_ms': round(min(values), 3)}
+    total = [sum(run.values()) * 1000 for run in runs]
+    stages['total'] = {'median_ms': round(statistics.median(total), 3), 'min_ms': round(min(total), 3)}
+    return {'megapixels': megapixels, 'lighting': lighting, 'upload_bytes': len(upload), 'stages': stages}
+
+
+def run_benchmarks(sizes, lightings, repeat, seed=0, log=None):
+    cases = {}
+    for megapixels in sizes:
+        for lighting in lightings:
+            case_id = f'{megapixels}MP-{lighting}'
+            cases[case_id] = bench_case(megapixels, lighting, repeat, seed)
+            if log:
+                log(f'{case_id}: total {cases[case_id]["stages"]["total"]["median_ms"]:.1f} ms')
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'seed': seed,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'cases': cases,
+    }
+
+
+def compare(current, baseline, threshold, noise_floor=NOISE_FLOOR_MS):
+    """
+    基準の結果と比べて段階ごとの変化を返す（中央値で比較）
+    戻り値: [(ケース, 段階, 基準ms, 今回ms, 比率, 劣化したか)]
+    """
+    rows = []
+    for case_id, case in current['cases'].items():
+        base_case = baseline.get('cases', {}).get(case_id)
+        if not base_case:
+            continue
+        for stage, value in case['stages'].items():
+            base = base_case['stages'].get(stage)
+            if not base:
+                continue
+            before, after = base['median_ms'], value['median_ms']
+            ratio = after / before if before > 0 else float('inf')
+            regressed = ratio > 1 + threshold and after - before > noise_floor
+            rows.append((case_id, stage, before, after, ratio, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='手相解析パイプラインの段階別ベンチマーク')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES), help='画像の画素数（MP、カンマ区切り）')
+    parser.add_argument('--lighting', default=','.join(LIGHTING_FACTORS), help='照明条件（カンマ区切り）')
+    parser.add_argument('--repeat', type=int, default=3, help='ケースごとの計測回数')
+    parser.add_argument('--seed', type=int, default=0, help='合成画像の乱数シード')
+    parser.add_argument('-o', '--output', help='結果を書き出すJSONファイル（省略時は標準出力）')
+    parser.add_argument('--compare', metavar='BASELINE', help='比較する基準の結果JSON')
+    parser.add_argument('--threshold', type=float, default=0.2, help='劣化とみなす増加率（0.2 = 20%%）')
+    args = parser.parse_args(argv)
+
+    sizes = [float(s) for s in args.sizes.split(',') if s]
+    lightings = [name for name in args.lighting.split(',') if name]
+    unknown = [name for name in lightings if name not in LIGHTING_FACTORS]
+    if unknown:
+        parser.error(f'不明な照明条件: {", ".join(unknown)}')
+
+    log = lambda message: print(message, file=sys.stderr)
+    results = run_benchmarks(sizes, lightings, args.repeat, args.seed, log)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if not args.compare:
+        return 0
+    with open(args.compare, encoding='utf-8') as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, args.threshold)
+    regressions = [row for row in rows if row[5]]
+    for case_id, stage, before, after, ratio, regressed in rows:
+        mark = '劣化' if regressed else ''
+        log(f'{case_id:>22} {stage:<30} {before:9.2f} → {after:9.2f} ms  x{ratio:5.2f} {mark}')
+    log(f'劣化: {len(regressions)} 件（しきい値 +{args.threshold:.0%}）')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+似た手のひらの索引（palm_signature.SignatureIndex）の計測
+一時ファイルに乱数の署名を entries 件書き込み、
+- 1件ずつの追加の時間
+- 同じキーの有無を全件から確かめる時間（add_unique が追加の前に行う）
+- 検索の時間（起動直後の1回目は署名の列の画像を作る分を含む。2回目以降・追加の直後も計る）
+- 検索結果が全件の総当たりと一致するか（--verify 件まで。一致しなければ終了コード1）
+を報告する
+
+使い方:
+  python -m benchmarks.signatures
+  python -m benchmarks.signatures --entries 2000000 --k 10 -o signatures.json
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+from palm_signature import RECORD, SIGNATURE_SIZE, SignatureIndex, signature_distance
+
+# まとめて書き込むレコード数（計測の準備を速くするため、索引の add を通さずにファイルへ書く）
+_CHUNK = 100000
+
+
+def random_signature(rng):
+    return bytes(rng.randrange(256) for _ in range(SIGNATURE_SIZE))
+
+
+def fill_index(path, entries, rng):
+    """乱数の署名を entries 件書いた索引ファイルを作る"""
+    SignatureIndex(path).close()
+    with open(path, 'ab') as f:
+        for start in range(0, entries, _CHUNK):
+            count = min(_CHUNK, entries - start)
+            f.write(rng.randbytes(count * RECORD.size))
+
+
+def brute_force(index, query, k):
+    """全件の距離を1件ずつ計算した上位 k 件（番号と距離）"""
+    distances = []
+    for number in range(len(index)):
+        _, stored = index.entry(number)
+        distances.append((signature_distance(query, stored), number))
+    return sorted(distances)[:k]
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    value = func(*args)
+    return value, (time.perf_counter() - started) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='似た手のひらの索引の追加・検索の計測')
+    parser.add_argument('--entries', type=int, default=1000000, help='索引の件数')
+    parser.add_argument('--k', type=int, default=10, help='検索で返す件数')
+    parser.add_argument('--queries', type=int, default=5, help='検索の回数')
+    parser.add_argument('--adds', type=int, default=100, help='1件ずつ追加する回数')
+    parser.add_argument('--verify', type=int, default=200000, help='総当たりと照合する件数の上限（0で照合しない）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+    parser.add_argument('-o', '--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'palms.sig')
+        fill_index(path, args.entries, rng)
+        _, open_ms = timed(SignatureIndex, path)
+        index = SignatureIndex(path)
+        queries = [random_signature(rng) for _ in range(args.queries)]
+
+        _, first_ms = timed(index.search, queries[0], args.k)
+        search_ms = [timed(index.search, query, args.k)[1] for query in queries]
+        add_ms = [timed(index.add, rng.randbytes(8), random_signature(rng))[1] for _ in range(args.adds)]
+        _, after_add_ms = timed(index.search, queries[0], args.k)
+        _, find_key_ms = timed(index.find_key, rng.randbytes(8))
+
+        verified = None
+        if args.verify and len(index) <= args.verify:
+            verified = all(
+                [(distance, number) for distance, number, _ in index.search(query, args.k)]
+                == brute_force(index, query, args.k)
+                for query in queries)
+        report = {
+            'entries': len(index),
+            'file_bytes': os.path.getsize(path),
+            'open_ms': round(open_ms, 3),
+            'first_search_ms': round(first_ms, 3),
+            'search_ms': round(statistics.median(search_ms), 3),
+            'add_ms': round(statistics.median(add_ms), 4),
+            'search_after_add_ms': round(after_add_ms, 3),
+            'find_key_ms': round(find_key_ms, 3),
+            'matches_brute_force': verified,
+        }
+        index.close()
+
+    print(f'{report["entries"]}件（{report["file_bytes"] / 1024 / 1024:.1f}MB） 読み込み {report["open_ms"]:.2f}ms'
+          f'  検索 1回目 {report["first_search_ms"]:.1f}ms・以降 {report["search_ms"]:.1f}ms'
+          f'・追加の直後 {report["search_after_add_ms"]:.1f}ms  追加 {report["add_ms"]:.3f}ms/件'
+          f'  キーの確認 {report["find_key_ms"]:.1f}ms'
+          f'  総当たりとの一致 {"未確認" if verified is None else ("OK" if verified else "NG")}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            json.dump(report, out, ensure_ascii=False, indent=2)
+    return 1 if verified is False else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+コールドスタートの計測（Vercel の api/analyze.py を想定）
+新しいPythonプロセスを毎回起動し、
+- python -X importtime によるモジュールごとの読み込み時間（自身の分・配下を含む分）
+- 読み込み直後の1回目の解析と2回目の解析の時間
+を計測して中央値を報告する
+
+使い方:
+  python -m benchmarks.startup
+  python -m benchmarks.startup --runs 10 --top 30 -o startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+from benchmarks.synthetic import encode_upload, make_palm_image
+
+TARGET_MODULE = 'api.analyze'
+
+# 子プロセスで実行する: 読み込み → 1回目の解析 → 2回目の解析（キャッシュは無効）
+_FIRST_REQUEST_SCRIPT = '''
+import json, os, sys, time
+os.environ['PALM_CACHE_SIZE'] = '0'
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from palm_analysis import analyze_image_bytes
+with open({upload!r}, 'rb') as f:
+    data = f.read()
+output = {{'accept': 'image/webp'}}
+analyze_image_bytes(data, 'inline', output)
+first = time.perf_counter()
+analyze_image_bytes(data, 'inline', output)
+second = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first - imported) * 1000,
+    'second_request_ms': (second - first) * 1000,
+    'modules': len(sys.modules),
+    'pil_modules': sum(1 for name in sys.modules if name.startswith('PIL')),
+}}))
+'''
+
+
+def project_modules():
+    """プロジェクト直下のモジュール名（読み込み時間の分類用）"""
+    names = {os.path.splitext(name)[0] for name in os.listdir(_root) if name.endswith('.py')}
+    names.add('api')
+    return names
+
+
+def classify(module, project):
+    top = module.split('.')[0]
+    if top in project:
+        return 'project'
+    if top == 'PIL':
+        return 'pillow'
+    return 'other'
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力 → {モジュール: (自身のμs, 配下を含むμs, 深さ)}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def measure_imports(module, runs):
+    """新しいプロセスで module を runs 回読み込み、モジュールごとの中央値（ms）を返す"""
+    samples = {}
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=_root, capture_output=True, text=True, check=True)
+        for name, (self_us, cumulative_us, depth) in parse_importtime(completed.stderr).items():
+            samples.setdefault(name, []).append((self_us, cumulative_us, depth))
+    project = project_modules()
+    result = {}
+    for name, values in samples.items():
+        result[name] = {
+            'self_ms': round(statistics.median(v[0] for v in values) / 1000, 3),
+            'cumulative_ms': round(statistics.median(v[1] for v in values) / 1000, 3),
+            'depth': values[0][2],
+            'group': classify(name, project),
+        }
+    return result
+
+
+def measure_first_request(module, runs, upload_path):
+    """新しいプロセスで読み込み・1回目・2回目の解析時間を runs 回計測し中央値（ms）を返す"""
+    script = _FIRST_REQUEST_SCRIPT.format(root=_root, module=module, upload=upload_path)
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-c', script], cwd=_root,
+                                   capture_output=True, text=True, check=True)
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {key: round(statistics.median(s[key] for s in samples), 2) for key in samples[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='コールドスタート（モジュール読み込み・初回リクエスト）の計測')
+    parser.add_argument('--module', default=TARGET_MODULE, help='読み込むモジュール')
+    parser.add_argument('--runs', type=int, default=5, help='プロセスを起動する回数')
+    parser.add_argument('--top', type=int, default=20, help='表示するモジュール数（配下を含む時間の長い順）')
+    parser.add_argument('--megapixels', type=float, default=2.0, help='初回リクエストに使う合成画像の画素数（MP）')
+    parser.add_argument('-o', '--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    imports = measure_imports(args.module, args.runs)
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+        f.write(encode_upload(make_palm_image(args.megapixels, 'normal', 0)))
+    try:
+        requests = measure_first_request(args.module, args.runs, f.name)
+    finally:
+        os.unlink(f.name)
+
+    groups = {}
+    for info in imports.values():
+        groups[info['group']] = groups.get(info['group'], 0.0) + info['self_ms']
+
+    print(f'{"モジュール":<40} {"自身 ms":>9} {"配下込み ms":>12}')
+    ranked = sorted(imports.items(), key=lambda item: item[1]['cumulative_ms'], reverse=True)
+    for name, info in ranked[:args.top]:
+        label = '  ' * info['depth'] + name
+        print(f'{label:<40} {info["self_ms"]:9.2f} {info["cumulative_ms"]:12.2f}')
+    print()
+    for group, total in sorted(groups.items(), key=lambda item: -item[1]):
+        print(f'{group:<10} {total:8.2f} ms')
+    print(f'読み込み {requests["import_ms"]:.1f} ms / 1回目の解析 {requests["first_request_ms"]:.1f} ms'
+          f' / 2回目 {requests["second_request_ms"]:.1f} ms'
+          f'（モジュール {requests["modules"]}・うち Pillow {requests["pil_modules"]}）')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            json.dump({'module': args.module, 'runs': args.runs, 'groups': groups,
+                       'requests': requests, 'imports': imports}, out, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
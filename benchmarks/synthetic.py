@@ -0,0 +1,89 @@
+"""
+ベンチマーク用の合成手のひら画像（同じ引数なら毎回同じ画像になる）
+肌色の手のひら・指・主要な手相の線・細かいしわ状のテクスチャを描き、照明条件で明るさを変える
+"""
+
+import io
+import math
+import random
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+# 照明条件 → 明るさの倍率
+LIGHTING_FACTORS = {
+    'dark': 0.35,
+    'normal': 1.0,
+    'overexposed': 1.9,
+}
+
+
+def image_size(megapixels, aspect=4 / 3):
+    """画素数（MP）から 4:3 の画像サイズを求める"""
+    height = int(math.sqrt(megapixels * 1_000_000 / aspect))
+    return int(height * aspect), height
+
+
+def _curve(rng, start, end, bend, steps=24):
+    """start から end への緩い曲線（二次ベジェ）の点列"""
+    (x0, y0), (x2, y2) = start, end
+    x1 = (x0 + x2) / 2 + rng.uniform(-bend, bend)
+    y1 = (y0 + y2) / 2 + rng.uniform(-bend, bend)
+    points = []
+    for i in range(steps + 1):
+        t = i / steps
+        x = (1 - t) ** 2 * x0 + 2 * (1 - t) * t * x1 + t ** 2 * x2
+        y = (1 - t) ** 2 * y0 + 2 * (1 - t) * t * y1 + t ** 2 * y2
+        points.append((x, y))
+    return points
+
+
+def make_palm_image(megapixels=1.0, lighting='normal', seed=0):
+    """合成した手のひら画像（RGB）を返す"""
+    rng = random.Random(f'{seed}-{megapixels}-{lighting}')
+    w, h = image_size(megapixels)
+    img = Image.new('RGB', (w, h), (70, 78, 92))
+    draw = ImageDraw.Draw(img)
+
+    skin = (224, 172, 140)
+    crease = (150, 96, 80)
+    # 手のひらと指
+    draw.ellipse([w * 0.22, h * 0.28, w * 0.78, h * 1.05], fill=skin)
+    for i in range(4):
+        cx = w * (0.3 + 0.13 * i)
+        draw.rounded_rectangle([cx - w * 0.05, h * -0.05, cx + w * 0.05, h * 0.42], radius=w * 0.05, fill=skin)
+    draw.rounded_rectangle([w * 0.05, h * 0.45, w * 0.3, h * 0.62], radius=w * 0.06, fill=skin)
+
+    # 主要な線（感情線・知能線・生命線・運命線）
+    unit = min(w, h)
+    lines = [
+        ((w * 0.26, h * 0.5), (w * 0.74, h * 0.44)),
+        ((w * 0.3, h * 0.6), (w * 0.7, h * 0.66)),
+        ((w * 0.34, h * 0.55), (w * 0.42, h * 0.98)),
+        ((w * 0.52, h * 0.98), (w * 0.5, h * 0.5)),
+    ]
+    for start, end in lines:
+        draw.line(_curve(rng, start, end, unit * 0.08), fill=crease, width=max(2, unit // 220), joint='curve')
+    # 細かいしわ
+    for _ in range(40):
+        x, y = rng.uniform(w * 0.28, w * 0.72), rng.uniform(h * 0.45, h * 0.95)
+        length = unit * rng.uniform(0.02, 0.08)
+        angle = rng.uniform(0, math.pi)
+        end = (x + math.cos(angle) * length, y + math.sin(angle) * length)
+        draw.line(_curve(rng, (x, y), end, length * 0.3, steps=6), fill=crease, width=max(1, unit // 600))
+
+    # 皮膚のきめ（乱数で作った小さなノイズを引き伸ばして重ねる）
+    tile = Image.frombytes('L', (128, 96), rng.randbytes(128 * 96))
+    texture = tile.resize((w, h), Image.Resampling.BICUBIC).convert('RGB')
+    img = Image.blend(img, texture, 0.08)
+    img = img.filter(ImageFilter.GaussianBlur(max(1, unit // 1000)))
+    return ImageEnhance.Brightness(img).enhance(LIGHTING_FACTORS[lighting])
+
+
+def encode_upload(img, fmt='JPEG', quality=90):
+    """アップロードされる形式（既定: スマホ写真相当の JPEG）にエンコードする"""
+    buffer = io.BytesIO()
+    if fmt == 'JPEG':
+        img.save(buffer, format='JPEG', quality=quality)
+    else:
+        img.save(buffer, format=fmt)
+    return buffer.getvalue()
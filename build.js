@@ -1,12 +1,30 @@
 /**
- * Vercel ビルド用 - public のファイルを dist にコピー
+ * Vercel ビルド用 - sw.js のキャッシュ名を更新してから public のファイルを dist にコピー
  */
+const { execFileSync } = require('child_process');
 const fs = require('fs');
 const path = require('path');
 
 const publicDir = path.join(__dirname, 'public');
 const distDir = path.join(__dirname, 'dist');
 
+// sw.js の CACHE_NAME と urlsToCache を public/ の現在のファイルから作り直す（static_assets.py）
+function updateServiceWorker() {
+  for (const python of ['python3', 'python']) {
+    try {
+      execFileSync(python, [path.join(__dirname, 'static_assets.py')], { stdio: 'inherit' });
+      return;
+    } catch (error) {
+      if (error.code !== 'ENOENT') {
+        throw error;
+      }
+    }
+  }
+  throw new Error('python が見つからないため sw.js を更新できません');
+}
+
+updateServiceWorker();
+
 if (!fs.existsSync(distDir)) {
   fs.mkdirSync(distDir, { recursive: true });
 }
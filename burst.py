@@ -0,0 +1,104 @@
+"""
+カメラの連写から解析に使う1枚を選ぶ（/api/analyze の burst モード、app.pyとapi/analyze.pyで共有）
+各フレームは縮小画像（THUMBNAIL_SIZE）だけで照明・ぶれ・線の量を採点し、
+一番よいフレームだけを通常の解析（線の検出まで）にかける
+撮り直しのたびに解析を往復する代わりに、安い採点1回と解析1回で済ませる
+"""
+
+from PIL import ImageFilter, ImageStat
+
+from image_processing import AnalysisContext, assess_lighting, load_image, resize_if_needed
+from instrumentation import stage
+from memory_budget import get_memory_budget
+from palm_analysis import analyze_image_bytes
+
+# 採点に使う縮小画像の長辺（JPEG は draft で縮小しながらデコードされる）
+THUMBNAIL_SIZE = 192
+MAX_BURST_FRAMES = 10
+# 線の量を数えるときのエッジの強さの閾値
+EDGE_DENSITY_THRESHOLD = 24
+
+# 照明の判定 → 採点の重み（解析に向かない明るさのフレームは後回しにする）
+LIGHTING_WEIGHTS = {
+    'good': 1.0,
+    'ok': 0.9,
+    'dark': 0.7,
+    'bright': 0.7,
+    'too_dark': 0.2,
+    'too_bright': 0.2,
+}
+# ぶれの少なさと線の量の配分
+SHARPNESS_WEIGHT = 0.6
+EDGE_DENSITY_WEIGHT = 0.4
+
+
+def measure_frame(img_bytes):
+    """
+    1フレームを縮小して採点の材料を求める（読み込めないフレームは None）
+    sharpness: エッジ画像の二乗平均（ぶれていると小さい）
+    edge_density: エッジが閾値を超える画素の割合
+    """
+    img = load_image(img_bytes, max_size=THUMBNAIL_SIZE, budget=get_memory_budget())
+    if img is None or 0 in img.size:
+        return None
+    thumb = resize_if_needed(img, THUMBNAIL_SIZE)
+    ctx = AnalysisContext(thumb)
+    lighting = assess_lighting(thumb, ctx)
+    # ぶれ・線の量はエッジ画像1枚から両方求める
+    edges = ctx.gray.filter(ImageFilter.FIND_EDGES)
+    hist = edges.histogram()
+    pixels = thumb.width * thumb.height
+    return {
+        'lighting': {'status': lighting['status'], 'brightness': lighting['brightness']},
+        'sharpness': ImageStat.Stat(edges).rms[0],
+        'edge_density': sum(hist[EDGE_DENSITY_THRESHOLD + 1:]) / pixels,
+    }
+
+
+def rank_frames(frames):
+    """
+    frames: [(名前, 画像バイト列, 入力エラー)] を採点し、よい順に並べた採点結果を返す
+    ぶれ・線の量は同じ連写の中での最大値を1として比べる（撮影条件の違う連写どうしは比べない）
+    """
+    entries = []
+    with stage('burst_rank') as s:
+        for index, (name, img_bytes, error) in enumerate(frames):
+            entry = {'index': index, 'name': name}
+            if error is None:
+                measured = measure_frame(img_bytes)
+                if measured is None:
+                    error = '画像の読み込みに失敗しました'
+                else:
+                    entry.update(measured)
+            if error is not None:
+                entry['error'] = error
+            entries.append(entry)
+        s.record(nbytes=sum(len(img_bytes) for _, img_bytes, error in frames if error is None))
+
+    scored = [entry for entry in entries if 'error' not in entry]
+    max_sharpness = max((entry['sharpness'] for entry in scored), default=0) or 1
+    max_density = max((entry['edge_density'] for entry in scored), default=0) or 1
+    for entry in scored:
+        weight = LIGHTING_WEIGHTS.get(entry['lighting']['status'], 0.5)
+        entry['score'] = round(weight * (SHARPNESS_WEIGHT * entry['sharpness'] / max_sharpness
+                                         + EDGE_DENSITY_WEIGHT * entry['edge_density'] / max_density) * 100, 1)
+        entry['sharpness'] = round(entry['sharpness'], 2)
+        entry['edge_density'] = round(entry['edge_density'], 4)
+    entries.sort(key=lambda entry: (-entry.get('score', -1), entry['index']))
+    return entries
+
+
+def analyze_burst(frames, image_mode='inline', output=None, interpretations='full', deadline=None):
+    """
+    連写のフレームから一番よいものを選んで解析する。戻り値: (result, error)
+    result は通常の解析結果に burst（選んだフレームの番号と全フレームの採点）を加えたもの
+    """
+    ranking = rank_frames(frames)
+    best = ranking[0] if ranking else None
+    if best is None or 'error' in best:
+        return None, '画像の読み込みに失敗しました'
+    # 時間の予算（deadline）は採点に使った分を差し引いた残りで解析する
+    result, err = analyze_image_bytes(frames[best['index']][1], image_mode, output, interpretations, deadline)
+    if err:
+        return None, err
+    return {**result, 'burst': {'best': best['index'], 'frames': ranking}}, None
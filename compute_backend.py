@@ -0,0 +1,180 @@
+"""
+画素単位の処理（二値化・線を太らせる・画素数の集計・ゾーンごとの集計・線の重ね合わせ）の実装
+pillow: Pillow だけで行う（既定の実装。Vercel の250MB制限に収めるため numpy を使わない）
+numpy:  numpy の配列演算で行う（自前のサーバーなど numpy を入れられる環境向け）
+どちらも同じ画素から同じ整数の集計になるので、解析のスコアは一致する（benchmarks.backends で確認）
+
+環境変数:
+  PALM_BACKEND  pillow / numpy / auto（既定: auto = numpy が読み込めれば numpy）
+"""
+
+import os
+
+from PIL import Image, ImageChops
+
+BACKEND_NAMES = ('pillow', 'numpy')
+
+
+def threshold_lut(threshold):
+    """x > threshold を 255、それ以外を 0 にする point 用テーブル"""
+    return [0] * (threshold + 1) + [255] * (255 - threshold)
+
+
+def count_nonzero(img):
+    """0以外の画素数（histogram で集計）"""
+    return img.width * img.height - img.histogram()[0]
+
+
+def dilate(img, size):
+    """
+    MaxFilter(size) と同じ結果を横→縦に分解した最大値フィルタで求める
+    （ずらした画像との lighter を取るだけなので MaxFilter より一桁速い）
+    """
+    radius = size // 2
+    out = img
+    for axis in (0, 1):
+        src = out
+        for d in range(1, radius + 1):
+            for offset in (d, -d):
+                shifted = Image.new(img.mode, img.size, 0)
+                shifted.paste(src, (offset, 0) if axis == 0 else (0, offset))
+                out = ImageChops.lighter(out, shifted)
+    return out
+
+
+def build_zone_integral(edges_img, bounds):
+    """
+    ゾーン境界の座標で画像を格子に区切り、セルごとの線画素数から積分テーブル（summed-area table）を作る
+    各画素は histogram() で1回だけ数えられ、以降は境界上のどの矩形の画素数も定数時間で求まる
+    戻り値: (xs, ys, table)  table[j][i] は (xs[0], ys[0])〜(xs[i], ys[j]) の矩形内の線画素数
+    """
+    if edges_img.mode != 'L':
+        edges_img = edges_img.convert('L')
+    w, h = edges_img.size
+    xs = sorted({0, w}.union(*((b[1], b[3]) for b in bounds)))
+    ys = sorted({0, h}.union(*((b[2], b[4]) for b in bounds)))
+    table = [[0] * len(xs)]
+    for j in range(1, len(ys)):
+        prev = table[j - 1]
+        row = [0]
+        row_total = 0
+        for i in range(1, len(xs)):
+            cw, ch = xs[i] - xs[i - 1], ys[j] - ys[j - 1]
+            if cw > 0 and ch > 0:
+                cell = edges_img.crop((xs[i - 1], ys[j - 1], xs[i], ys[j]))
+                # 0以外の画素数 = 全画素数 - 値0の画素数
+                row_total += cw * ch - cell.histogram()[0]
+            row.append(prev[i] + row_total)
+        table.append(row)
+    return xs, ys, table
+
+
+def zone_pixel_count(integral, left, upper, right, lower):
+    """積分テーブルから矩形内の線画素数を定数時間で求める"""
+    xs, ys, table = integral
+    l, r = xs.index(left), xs.index(right)
+    u, b = ys.index(upper), ys.index(lower)
+    return table[b][r] - table[u][r] - table[b][l] + table[u][l]
+
+
+# overlay 用: 線（0以外）→ マスクの1
+_MASK_LUT = [0] + [255] * 255
+
+
+class PillowBackend:
+    """Pillow だけの実装（LUT・ヒストグラム・ImageChops で画素をまとめて処理する）"""
+
+    name = 'pillow'
+
+    def threshold_dilate(self, edges, threshold, size):
+        """threshold を超える画素を線として size の最大値フィルタで太らせる。戻り値: (二値画像, 線の画素数)"""
+        binary = dilate(edges.point(threshold_lut(threshold)), size)
+        return binary, count_nonzero(binary)
+
+    def zone_counts(self, edges, bounds):
+        """bounds（(名前, 左, 上, 右, 下) の列）の矩形ごとの線の画素数"""
+        integral = build_zone_integral(edges, bounds)
+        return {name: zone_pixel_count(integral, left, upper, right, lower)
+                for name, left, upper, right, lower in bounds if right > left and lower > upper}
+
+    def overlay(self, img, edges, color):
+        """線の画素だけ color にした画像（img は RGB）"""
+        line_layer = Image.new('RGB', img.size, color)
+        # 1ビットのマスクは合成が速い（LUTは作り置きして毎回ラムダを評価しない）
+        mask = edges.point(_MASK_LUT, mode='1')
+        return Image.composite(line_layer, img, mask)
+
+
+class NumpyBackend(PillowBackend):
+    """
+    numpy の配列演算による実装（numpy がなければ作れない: ImportError）
+    重ね合わせは Pillow の1ビットマスクでの合成のほうが速いので、そのまま使う
+    """
+
+    name = 'numpy'
+
+    def __init__(self):
+        import numpy
+        self.np = numpy
+
+    def threshold_dilate(self, edges, threshold, size):
+        np = self.np
+        mask = np.asarray(edges) > threshold
+        radius = size // 2
+        # 横→縦の順に、ずらした配列との論理和で最大値フィルタをとる（範囲外は0として扱う）
+        for axis in (1, 0):
+            src = mask
+            mask = src.copy()
+            for d in range(1, radius + 1):
+                if axis == 1:
+                    mask[:, d:] |= src[:, :-d]
+                    mask[:, :-d] |= src[:, d:]
+                else:
+                    mask[d:] |= src[:-d]
+                    mask[:-d] |= src[d:]
+        return Image.fromarray(mask.view(np.uint8) * np.uint8(255)), int(np.count_nonzero(mask))
+
+    def zone_counts(self, edges, bounds):
+        pixels = self.np.asarray(edges)
+        return {name: int(self.np.count_nonzero(pixels[upper:lower, left:right]))
+                for name, left, upper, right, lower in bounds if right > left and lower > upper}
+
+
+def create_backend(name='auto'):
+    """
+    名前から実装を作る（auto は numpy が読み込めれば numpy、読み込めなければ pillow）
+    numpy を明示して numpy が読み込めなければ ImportError、知らない名前は ValueError
+    """
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        try:
+            return NumpyBackend()
+        except ImportError:
+            return PillowBackend()
+    if name == 'numpy':
+        try:
+            return NumpyBackend()
+        except ImportError as e:
+            raise ImportError('PALM_BACKEND=numpy ですが numpy を読み込めません（pip install numpy）') from e
+    if name == 'pillow':
+        return PillowBackend()
+    raise ValueError(f'不明な実装です: {name}（{" / ".join(BACKEND_NAMES + ("auto",))}）')
+
+
+_backend = None
+
+
+def get_backend():
+    """プロセス共通の実装（PALM_BACKEND で選ぶ）"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend(os.environ.get('PALM_BACKEND', 'auto'))
+    return _backend
+
+
+def set_backend(backend):
+    """実装を差し替える（名前または実装のオブジェクト。比較・計測用）。戻り値: 差し替える前の実装"""
+    global _backend
+    previous = get_backend()
+    _backend = create_backend(backend) if isinstance(backend, str) else backend
+    return previous
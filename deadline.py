@@ -0,0 +1,193 @@
+"""
+リクエストごとの時間の予算と、予算が足りないときの品質の段階的な引き下げ（app.pyとapi/analyze.pyで共有）
+段階の合間に残り時間を確かめ、次の段階の所要時間の見積もりが収まらなければ段階的に軽くする
+
+  full                 通常どおり
+  reduced_search       線の探索のぼかし半径を1つにする
+  reduced_resolution   解析用の画像をさらに縮める（DEGRADED_WORKING_SIZE）
+  fast_encoding        画像を小さく・軽い形式（写真は JPEG、検出線は PNG）でエンコードする
+  no_images            画像を作らない
+
+見積もりは段階ごとの「1メガピクセルあたりの秒数」で、実測の移動平均で更新する
+（負荷が高く処理が遅くなると見積もりも大きくなり、早めに軽くなる）
+段階の途中では止めないので、見積もりには余裕（SAFETY_FACTOR）を持たせる
+
+環境変数:
+  PALM_DEADLINE_MS  1リクエストの時間の予算（ミリ秒、0で無制限）。リクエストの deadline_ms で短くできる
+"""
+
+import os
+import threading
+import time
+
+from image_processing import BLUR_RADII
+
+# 既定の予算（Vercel の maxDuration 30秒から、アップロードの受信・レスポンスの送信の分を引いたもの）
+DEFAULT_BUDGET_MS = 25000
+# 品質の段階（軽い順に後ろ）
+QUALITY_LEVELS = ('full', 'reduced_search', 'reduced_resolution', 'fast_encoding', 'no_images')
+# reduced_search で使うぼかし半径（中くらいの線の太さに合うもの）
+REDUCED_BLUR_RADII = (2,)
+# reduced_resolution での解析用の画像の長辺
+DEGRADED_WORKING_SIZE = 640
+# fast_encoding の出力設定（長辺・品質。形式は Accept を見ずに写真は JPEG、検出線は PNG）
+FAST_OUTPUT_MAX_SIZE = 640
+FAST_OUTPUT_QUALITY = 60
+# 見積もりにかける余裕（段階の途中では止められないため）
+SAFETY_FACTOR = 1.5
+# 見積もりの移動平均の重み（新しい実測の割合）
+ESTIMATE_ALPHA = 0.2
+
+# 1メガピクセルあたりの秒数の初期値（2MPの合成画像を1000pxに縮めて1コアで実測したもの）
+# analysis は前処理・ぼかし半径1つ分の探索をそれぞれ1回と数えた1回あたり、output は2枚の画像の描画・エンコード
+_DEFAULT_COSTS = {'analysis': 0.045, 'output': 0.07, 'vectorize': 0.25}
+_costs = dict(_DEFAULT_COSTS)
+_costs_lock = threading.Lock()
+
+_MEGAPIXEL = 1000 * 1000
+
+
+def estimate(kind, pixels, passes=1):
+    """段階の所要時間の見積もり（秒）"""
+    return _costs[kind] * pixels / _MEGAPIXEL * passes
+
+
+def record_cost(kind, seconds, pixels, passes=1):
+    """実測した所要時間で見積もりを更新する"""
+    if pixels <= 0 or passes <= 0:
+        return
+    observed = seconds / (pixels / _MEGAPIXEL) / passes
+    with _costs_lock:
+        _costs[kind] += (observed - _costs[kind]) * ESTIMATE_ALPHA
+
+
+def reset_costs():
+    """見積もりを初期値に戻す（実測で更新された見積もりに左右されないテスト用）"""
+    with _costs_lock:
+        _costs.clear()
+        _costs.update(_DEFAULT_COSTS)
+
+
+def analysis_passes(blur_radii):
+    """線の検出の回数（前処理 + ぼかし半径ごとの探索）"""
+    return 1 + len(blur_radii)
+
+
+def default_budget_ms():
+    """環境変数の予算（ミリ秒、無制限なら None）"""
+    value = os.environ.get('PALM_DEADLINE_MS')
+    try:
+        budget = int(value) if value else DEFAULT_BUDGET_MS
+    except ValueError:
+        budget = DEFAULT_BUDGET_MS
+    return budget if budget > 0 else None
+
+
+class Deadline:
+    """
+    1リクエストの時間の予算と、そのリクエストで下げた品質の記録
+    budget_ms が None なら無制限（どの段階も軽くしない）
+    """
+
+    def __init__(self, budget_ms=None, started=None):
+        self.budget_ms = budget_ms
+        self.started = time.monotonic() if started is None else started
+        self.steps = []
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """残り時間（秒、無制限なら None）"""
+        if self.budget_ms is None:
+            return None
+        return self.budget_ms / 1000 - self.elapsed()
+
+    def fits(self, seconds):
+        """見積もり seconds の段階が残り時間に収まるか"""
+        remaining = self.remaining()
+        return remaining is None or seconds * SAFETY_FACTOR <= remaining
+
+    def degrade(self, level):
+        if level not in self.steps:
+            self.steps.append(level)
+
+    @property
+    def level(self):
+        """達成した品質（下げた段階のうち一番軽いもの）"""
+        if not self.steps:
+            return 'full'
+        return max(self.steps, key=QUALITY_LEVELS.index)
+
+    def plan_analysis(self, size, image_mode='inline'):
+        """
+        解析用の画像の大きさ（size）から、線の検出の設定を選ぶ
+        画像の出力（image_mode）の見積もりも残しておけるものを選ぶ
+        戻り値: (解析用の画像の長辺（縮めなければ None）, ぼかし半径)
+        """
+        pixels = size[0] * size[1]
+        reserve = self._output_estimate(pixels, image_mode, fast=True)
+        if self.fits(estimate('analysis', pixels, analysis_passes(BLUR_RADII)) + reserve):
+            return None, BLUR_RADII
+        self.degrade('reduced_search')
+        if max(size) <= DEGRADED_WORKING_SIZE or self.fits(
+                estimate('analysis', pixels, analysis_passes(REDUCED_BLUR_RADII)) + reserve):
+            return None, REDUCED_BLUR_RADII
+        self.degrade('reduced_resolution')
+        return DEGRADED_WORKING_SIZE, REDUCED_BLUR_RADII
+
+    def plan_output(self, pixels, image_mode, output=None):
+        """
+        画像の出力の設定を選ぶ（pixels は解析用の画像の画素数）
+        戻り値: (image_mode, output)。時間が足りなければ軽い出力設定、それでも足りなければ 'none'
+        """
+        if image_mode not in ('inline', 'vector'):
+            # url は取得時に描画するので、ここでは時間を使わない
+            return image_mode, output
+        if self.fits(self._output_estimate(pixels, image_mode)):
+            return image_mode, output
+        if image_mode == 'inline' and self.fits(self._output_estimate(pixels, image_mode, fast=True)):
+            self.degrade('fast_encoding')
+            return image_mode, fast_output(output)
+        self.degrade('no_images')
+        return 'none', output
+
+    def _output_estimate(self, pixels, image_mode, fast=False):
+        if image_mode == 'vector':
+            return estimate('vectorize', pixels)
+        if image_mode != 'inline':
+            return 0.0
+        if fast:
+            pixels = min(pixels, FAST_OUTPUT_MAX_SIZE * FAST_OUTPUT_MAX_SIZE)
+        return estimate('output', pixels)
+
+    def report(self):
+        """レスポンスの quality"""
+        report = {'level': self.level, 'degraded': list(self.steps)}
+        if self.budget_ms is not None:
+            report['budget_ms'] = self.budget_ms
+        report['elapsed_ms'] = round(self.elapsed() * 1000, 1)
+        return report
+
+
+def fast_output(output=None):
+    """fast_encoding の出力設定（指定された長辺・品質がより小さければそちらを使う）"""
+    output = output or {}
+    max_size = min(filter(None, (output.get('max_size'), FAST_OUTPUT_MAX_SIZE)))
+    quality = min(filter(None, (output.get('quality'), FAST_OUTPUT_QUALITY)))
+    return {'format': None, 'quality': quality, 'max_size': max_size, 'accept': ''}
+
+
+def request_deadline(value=None, started=None):
+    """
+    リクエストの deadline_ms（ミリ秒）と環境変数の予算から Deadline を作る
+    deadline_ms は予算を短くする方向にだけ効く（サーバーの上限は超えられない）
+    """
+    budget = default_budget_ms()
+    try:
+        requested = int(value) if value else None
+    except (TypeError, ValueError):
+        requested = None
+    if requested is not None and requested > 0:
+        budget = min(budget, requested) if budget is not None else requested
+    return Deadline(budget, started)
@@ -0,0 +1,141 @@
+"""
+解析画像の出力レイヤー（描画・形式の選択・エンコード）
+- 検出線画像は2色しか使わないので1ビットのパレットPNG
+- 写真に線を重ねた画像は WebP / JPEG（品質指定可）
+- 明示指定 → Accept ヘッダの順に画像ごとの形式を決め、最大サイズ指定があれば縮小してから描画する
+- 検出線の折れ線（lines）は SVG（写真はクライアントが手元の画像を使う）
+"""
+
+import time
+
+from PIL import Image
+
+from image_processing import create_visualization, edges_to_visible_display, encode_image, threshold_lut
+from instrumentation import stage
+from line_vectors import lines_to_svg, vectorize
+
+# 出力形式 → MIMEタイプ
+IMAGE_MIME_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'svg': 'image/svg+xml',
+}
+DEFAULT_QUALITY = {'webp': 80, 'jpeg': 85}
+
+# 画像の種類 → 描画関数（引数: 元画像, 検出線）
+RENDERERS = {
+    'visualization': create_visualization,
+    'edges': lambda img, edges: edges_to_visible_display(edges),
+    'lines': lambda img, edges: vectorize(edges),
+}
+
+
+def parse_output_options(params, accept=''):
+    """
+    リクエストの項目（image_format, image_quality, image_max_size）と Accept ヘッダから出力設定を作る
+    params は dict 風のオブジェクト（request.values など）
+    """
+    fmt = (params.get('image_format') or '').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+
+    def positive_int(name, upper):
+        try:
+            value = int(params.get(name) or 0)
+        except (TypeError, ValueError):
+            return None
+        return min(value, upper) if value > 0 else None
+
+    return {
+        'format': fmt if fmt in IMAGE_MIME_TYPES else None,
+        'quality': positive_int('image_quality', 100),
+        'max_size': positive_int('image_max_size', 4000),
+        'accept': accept or '',
+    }
+
+
+def negotiate_format(kind, options=None):
+    """画像の種類ごとに出力形式を選ぶ（明示指定 > 検出線は PNG > Accept に WebP があれば WebP > JPEG）"""
+    options = options or {}
+    if kind == 'lines':
+        return 'svg'
+    if options.get('format'):
+        return options['format']
+    if kind == 'edges':
+        return 'png'
+    if 'image/webp' in options.get('accept', ''):
+        from PIL import features  # 描画するときだけ使うので遅延読み込み
+        if features.check('webp'):
+            return 'webp'
+    return 'jpeg'
+
+
+def output_key(kind, options=None):
+    """出力結果を区別するキー（キャッシュ用）"""
+    options = options or {}
+    return (kind, negotiate_format(kind, options), options.get('quality'), options.get('max_size'))
+
+
+def scale_for_output(img, edges, max_size):
+    """長辺が max_size を超える場合は描画前に縮小する（細い線が消えないよう検出線は面積平均→二値化）"""
+    w, h = edges.size
+    if not max_size or max(w, h) <= max_size:
+        return img, edges
+    scale = max_size / max(w, h)
+    size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    if img is not None:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    edges = edges.resize(size, Image.Resampling.BOX).point(threshold_lut(0))
+    return img, edges
+
+
+def render_output(kind, img, edges, options=None):
+    """
+    画像を描画してエンコードする
+    戻り値: (バイト列, メタ情報 {format, mime, width, height, bytes, render_ms, encode_ms})
+    """
+    options = options or {}
+    fmt = negotiate_format(kind, options)
+    started = time.perf_counter()
+    if fmt == 'svg':
+        return _render_svg(kind, edges, started)
+    if kind == 'edges':
+        img = None
+    with stage(f'render_{kind}', pixels=edges.width * edges.height):
+        img, edges = scale_for_output(img, edges, options.get('max_size'))
+        rendered = RENDERERS[kind](img, edges)
+    rendered_at = time.perf_counter()
+    with stage(f'encode_{kind}', pixels=rendered.width * rendered.height) as s:
+        data = encode_image(rendered, fmt, options.get('quality') or DEFAULT_QUALITY.get(fmt))
+        s.record(nbytes=len(data))
+    encoded_at = time.perf_counter()
+    return data, {
+        'format': fmt,
+        'mime': IMAGE_MIME_TYPES[fmt],
+        'width': rendered.width,
+        'height': rendered.height,
+        'bytes': len(data),
+        'render_ms': round((rendered_at - started) * 1000, 2),
+        'encode_ms': round((encoded_at - rendered_at) * 1000, 2),
+    }
+
+
+def _render_svg(kind, edges, started):
+    """折れ線の SVG（縮小・品質の指定は関係しない）"""
+    with stage(f'render_{kind}', pixels=edges.width * edges.height):
+        vector = RENDERERS[kind](None, edges)
+    rendered_at = time.perf_counter()
+    with stage(f'encode_{kind}') as s:
+        data = lines_to_svg(vector)
+        s.record(nbytes=len(data))
+    encoded_at = time.perf_counter()
+    return data, {
+        'format': 'svg',
+        'mime': IMAGE_MIME_TYPES['svg'],
+        'width': vector['width'],
+        'height': vector['height'],
+        'bytes': len(data),
+        'render_ms': round((rendered_at - started) * 1000, 2),
+        'encode_ms': round((encoded_at - rendered_at) * 1000, 2),
+    }
@@ -1,36 +1,210 @@
 """
 手相解析 - 画像処理（Pillow版・numpyなし）
+画素単位の集計・二値化・重ね合わせは compute_backend の実装を通す（numpy があれば numpy 版も選べる）
 """
 
 import io
+import math
 import base64
-from PIL import Image, ImageFilter, ImageEnhance, ImageOps, ImageStat
+from PIL import Image, ImageChops, ImageFilter, ImageEnhance, ImageOps, ImageStat, UnidentifiedImageError
 
+from compute_backend import count_nonzero, get_backend, threshold_lut
+from instrumentation import stage
+from memory_budget import decoded_bytes
 
-def load_image(img_bytes):
+
+class _BufferReader(io.RawIOBase):
+    """memoryview などのバッファをコピーせずに読むファイルオブジェクト（Image.open 用）"""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+# 解析に使う画像の長辺（これより大きい画像は縮小する）
+WORKING_SIZE = 1000
+# これを超える画素数の画像は読み込まない（解凍爆弾対策・48MPのスマホ写真は通す）
+MAX_IMAGE_PIXELS = 50_000_000
+# 先に判定する画像形式（写真のアップロードはほぼこれ。これらでなければ Pillow が開ける形式をすべて試す）
+UPLOAD_FORMATS = ('JPEG', 'PNG', 'WEBP')
+_EXIF_ORIENTATION = 0x0112
+
+
+def _register_webp():
+    """
+    WebP のプラグインだけを読み込む
+    Pillow は未登録の形式を開く・保存するときに全プラグイン（約40モジュール）を読み込むため、先に登録しておく
+    """
+    from PIL import WebPImagePlugin  # noqa: F401
+
+
+# 予算モードで帯状に変換・縮小するときの1回分の行数の目安
+STRIP_ROWS = 256
+# デコード中に画素データを何枚分持つか（WebP はデコーダのバッファ・バイト列・画像などで実測約4枚分）
+_DECODE_COPIES = {'WEBP': 4}
+# EXIF の回転情報 → 向きを直す変換
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def _reduce_in_strips(img, max_size):
+    """
+    RGBへの変換と整数倍の縮小（reduce）を帯状に行う
+    全画素分のRGB画像を作らないので、デコード後の画像のほかに必要なメモリは縮小後の画像と帯1本分だけで済む
+    縮小率は resize_if_needed（reducing_gap=3.0）が内部で使うものと同じにする
+    """
+    w, h = img.size
+    factor = max(1, int(max(w, h) / max_size / 3.0))
+    if factor == 1:
+        if img.mode == 'RGB':
+            img.load()
+            return img
+        return img.convert('RGB')
+    out = Image.new('RGB', (math.ceil(w / factor), math.ceil(h / factor)))
+    rows = factor * max(1, STRIP_ROWS // factor)
+    for top in range(0, h, rows):
+        strip = img.crop((0, top, w, min(h, top + rows)))
+        if strip.mode != 'RGB':
+            strip = strip.convert('RGB')
+        out.paste(strip.reduce(factor), (0, top // factor))
+    img.close()
+    return out
+
+
+def load_image(img_bytes, max_size=None, max_pixels=MAX_IMAGE_PIXELS, budget=None):
+    """
+    画像を読み込む（bytes 以外のバッファはコピーせずにデコーダへ渡す）
+    max_size を指定すると JPEG は縮小デコード（draft）で max_size 以上の最小サイズまで縮めて読む
+    EXIF の回転情報を反映し、画素数が max_pixels を超える画像はデコードせずに None を返す
+    budget（バイト）を指定すると予算モード: デコード後の大きさが budget を超える画像は読み込まず、
+    max_size より大きい画像は変換・縮小を帯状に行ってから回転する
+    """
+    _register_webp()
     try:
-        return Image.open(io.BytesIO(img_bytes)).convert('RGB')
+        fp = io.BytesIO(img_bytes) if isinstance(img_bytes, bytes) else _BufferReader(img_bytes)
+        try:
+            img = Image.open(fp, formats=UPLOAD_FORMATS)
+        except UnidentifiedImageError:
+            # GIF・BMP・TIFF なども従来どおり受け付ける（このときだけ Pillow の全プラグインを読み込む）
+            fp.seek(0)
+            img = Image.open(fp)
+        w, h = img.size
+        if w * h > max_pixels:
+            return None
+        if max_size and max(w, h) > max_size:
+            scale = max_size / max(w, h)
+            img.draft('RGB', (math.ceil(w * scale), math.ceil(h * scale)))
+        if budget is not None and decoded_bytes(img.size, img.mode) * _DECODE_COPIES.get(img.format, 1) > budget:
+            return None
+        # PNG は EXIF を読むときに画素もデコードされる
+        orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+        if budget is not None:
+            if max_size:
+                img = _reduce_in_strips(img, max_size)
+                method = _ORIENTATION_TRANSPOSE.get(orientation)
+                return img.transpose(method) if method is not None else img
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+        if img.mode == 'RGB' and max_size and max(img.size) > max_size:
+            # どうせ縮小するので、同じモードへの convert（全画素のコピー）はしない
+            img.load()
+            return img
+        return img.convert('RGB')
     except Exception:
         return None
 
 
-def resize_if_needed(img, max_size=1000):
+def resize_if_needed(img, max_size=WORKING_SIZE):
     w, h = img.size
     if max(h, w) <= max_size:
         return img
     scale = max_size / max(h, w)
     new_w, new_h = int(w * scale), int(h * scale)
-    return img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    # 大きく縮める場合は先に reduce（整数倍の平均）で縮めてから LANCZOS をかける
+    return img.resize((new_w, new_h), Image.Resampling.LANCZOS, reducing_gap=3.0)
 
 
-def assess_lighting(img):
+class AnalysisContext:
+    """
+    1リクエスト分の中間結果（グレースケール・平均輝度など）を共有する
+    同じ画像から作るものは最初に必要になった段階で1回だけ計算し、以降の段階は再利用する
+    """
+
+    def __init__(self, img):
+        self.img = img
+        self.computed = {}
+        self.reused = {}
+        self._values = {}
+
+    def get(self, name, compute):
+        """name の中間結果を返す（なければ compute() で作って保持する）"""
+        if name in self._values:
+            self.reused[name] = self.reused.get(name, 0) + 1
+            return self._values[name]
+        value = self._values[name] = compute()
+        self.computed[name] = self.computed.get(name, 0) + 1
+        return value
+
+    @property
+    def gray(self):
+        return self.get('gray', lambda: self.img.convert('L'))
+
+    @property
+    def mean_brightness(self):
+        return self.get('mean_brightness', lambda: ImageStat.Stat(self.gray).mean[0])
+
+    def crop(self, box):
+        """box の範囲を切り出した画像の中間結果（グレースケールは作り直さず切り出す）"""
+        sub = AnalysisContext(self.img.crop(box))
+        sub._values['gray'] = self.gray.crop(box)
+        return sub
+
+    def report(self):
+        """計算した回数・再利用した回数（再利用1回 = 画像全体の変換・集計1回分の節約）"""
+        return {
+            'computed': dict(self.computed),
+            'reused': dict(self.reused),
+            'passes_saved': sum(self.reused.values()),
+        }
+
+
+def assess_lighting(img, ctx=None):
     """
     画像の照明度を評価する（補正前の元画像で判定）
     戻り値: { status, message, brightness }
     """
-    gray = img.convert('L')
-    stat = ImageStat.Stat(gray)
-    mean_brightness = stat.mean[0]
+    ctx = ctx or AnalysisContext(img)
+    mean_brightness = ctx.mean_brightness
 
     if mean_brightness < 60:
         return {
@@ -69,77 +243,243 @@ def assess_lighting(img):
     }
 
 
-def preprocess_for_lighting(img):
+def _brightness_lut(factor):
+    """ImageEnhance.Brightness(img).enhance(factor) と同じ変換のLUT（RGB 3チャンネル分）"""
+    ramp = Image.frombytes('RGB', (256, 1), bytes(v for v in range(256) for _ in range(3)))
+    return list(ImageEnhance.Brightness(ramp).enhance(factor).getchannel(0).tobytes()) * 3
+
+
+def preprocess_for_lighting(img, ctx=None):
     """照明条件に合わせて画像を補正（暗い・コントラスト不足に対応）"""
-    img = img.convert('RGB')
-    gray = img.convert('L')
-    stat = ImageStat.Stat(gray)
-    mean_brightness = stat.mean[0]
-    # 暗い画像は明るさを上げる
+    ctx = ctx or AnalysisContext(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    mean_brightness = ctx.mean_brightness
+    # 暗い画像は明るさを上げる（明るさの変更は画素値ごとの変換なのでLUT1回で済む）
     if mean_brightness < 80:
         factor = 100 / max(mean_brightness, 20)
-        img = ImageEnhance.Brightness(img).enhance(min(factor, 2.5))
+        img = img.point(_brightness_lut(min(factor, 2.5)))
     elif mean_brightness > 180:
         factor = 140 / mean_brightness
-        img = ImageEnhance.Brightness(img).enhance(max(factor, 0.6))
-    # コントラストを自動補正
-    r, g, b = img.split()
-    r = ImageOps.autocontrast(r, cutoff=2)
-    g = ImageOps.autocontrast(g, cutoff=2)
-    b = ImageOps.autocontrast(b, cutoff=2)
-    return Image.merge('RGB', (r, g, b))
-
-
-def detect_palm_lines(img):
-    img = preprocess_for_lighting(img)
-    gray = img.convert('L')
-    # ヒストグラム均等化でしわ・線のコントラストを強調
-    gray = ImageOps.equalize(gray)
-    enhanced = ImageEnhance.Contrast(gray).enhance(3.0)
-    enhanced = ImageEnhance.Sharpness(enhanced).enhance(3.0)
-    # エッジ強調フィルタで線をはっきりさせる
-    enhanced = enhanced.filter(ImageFilter.EDGE_ENHANCE_MORE)
-    results = []
-    for blur_radius in [1, 2, 3]:
+        img = img.point(_brightness_lut(max(factor, 0.6)))
+    # コントラストを自動補正（RGBのまま渡すとチャンネルごとに補正される）
+    return ImageOps.autocontrast(img, cutoff=2)
+
+
+# 手のひらの切り出し: 縮小画像（SEGMENT_SIZE）で肌色（YCbCr の Cb・Cr の範囲）のマスクを作り、
+# 肌色が見つからなければ輝度の大津の二値化で前景を推定する
+SEGMENT_SIZE = 128
+SKIN_CB_RANGE = (77, 127)
+SKIN_CR_RANGE = (133, 173)
+# マスクが画面に占める割合がこの範囲外なら切り出さない（見つからない・背景まで肌色と判定）
+MIN_PALM_COVERAGE = 0.05
+MAX_PALM_COVERAGE = 0.9
+# 切り出す範囲の余白（縮小画像の画素数）
+PALM_MARGIN = 2
+
+
+def _range_lut(low, high):
+    return [255 if low <= v <= high else 0 for v in range(256)]
+
+
+_SKIN_CB_LUT = _range_lut(*SKIN_CB_RANGE)
+_SKIN_CR_LUT = _range_lut(*SKIN_CR_RANGE)
+
+
+class PalmRegion:
+    """
+    手のひらの範囲（segment_palm の結果）
+    bbox は元画像の座標、mask は縮小画像での手のひら（輪郭を少し削ったもの、切り出さない場合は None）
+    """
+
+    def __init__(self, size, bbox=None, mask=None, mask_bbox=None, method='full', coverage=1.0):
+        self.size = size
+        self.bbox = bbox or (0, 0, size[0], size[1])
+        self.mask = mask
+        self.mask_bbox = mask_bbox
+        self.method = method
+        self.coverage = coverage
+
+    @property
+    def is_full(self):
+        return self.mask is None
+
+    @property
+    def area_ratio(self):
+        left, upper, right, lower = self.bbox
+        return (right - left) * (lower - upper) / (self.size[0] * self.size[1])
+
+    def crop_mask(self, size):
+        """切り出した画像の大きさに合わせた手のひらのマスク（L、0/255）"""
+        if self.mask is None:
+            return None
+        mask = self.mask.crop(self.mask_bbox).resize(size, Image.Resampling.BILINEAR)
+        return mask.point(threshold_lut(127))
+
+    def expand(self, edges):
+        """切り出した範囲の検出線を元画像の大きさに戻す（手のひらの範囲は info['palm_bbox'] に残す）"""
+        if self.is_full:
+            return edges
+        full = Image.new(edges.mode, self.size, 0)
+        full.paste(edges, self.bbox[:2])
+        full.info['palm_bbox'] = self.bbox
+        return full
+
+    def report(self):
+        return {'method': self.method, 'bbox': list(self.bbox), 'coverage': round(self.coverage, 3)}
+
+
+def _skin_mask(small):
+    _, cb, cr = small.convert('YCbCr').split()
+    return ImageChops.multiply(cb.point(_SKIN_CB_LUT), cr.point(_SKIN_CR_LUT))
+
+
+def _otsu_threshold(hist):
+    """ヒストグラムから大津の方法で二値化の閾値を求める"""
+    total = sum(hist)
+    weighted_total = sum(i * count for i, count in enumerate(hist))
+    weight = weighted = 0
+    best, best_var = 0, -1.0
+    for t in range(256):
+        weight += hist[t]
+        if weight == 0 or weight == total:
+            continue
+        weighted += t * hist[t]
+        mean_low = weighted / weight
+        mean_high = (weighted_total - weighted) / (total - weight)
+        var = weight * (total - weight) * (mean_low - mean_high) ** 2
+        if var > best_var:
+            best, best_var = t, var
+    return best
+
+
+def _luminance_mask(gray):
+    """輝度の二値化で、画像中央を多く含む側を前景とする"""
+    threshold = _otsu_threshold(gray.histogram())
+    mask = gray.point(threshold_lut(threshold))
+    w, h = gray.size
+    center = mask.crop((w // 3, h // 3, w - w // 3, h - h // 3))
+    if ImageStat.Stat(center).mean[0] < 128:
+        mask = ImageOps.invert(mask)
+    return mask
+
+
+def segment_palm(img, ctx=None):
+    """
+    手のひらの範囲を推定する（縮小画像で行うので画像の大きさによらず数ミリ秒）
+    肌色 → 輝度の順に試し、どちらも手のひららしい割合にならなければ画像全体を返す
+    """
+    ctx = ctx or AnalysisContext(img)
+    small = img.copy()
+    small.thumbnail((SEGMENT_SIZE, SEGMENT_SIZE), Image.Resampling.BOX)
+    sw, sh = small.size
+    candidates = (
+        ('skin', lambda: _skin_mask(small)),
+        ('luminance', lambda: _luminance_mask(ctx.gray.resize(small.size, Image.Resampling.BOX))),
+    )
+    for method, make_mask in candidates:
+        # 点状の誤検出を除いてから範囲を求める
+        mask = make_mask().filter(ImageFilter.MedianFilter(3))
+        coverage = count_nonzero(mask) / (sw * sh)
+        if not MIN_PALM_COVERAGE <= coverage <= MAX_PALM_COVERAGE:
+            continue
+        left, upper, right, lower = mask.getbbox()
+        mask_bbox = (max(0, left - PALM_MARGIN), max(0, upper - PALM_MARGIN),
+                     min(sw, right + PALM_MARGIN), min(sh, lower + PALM_MARGIN))
+        sx, sy = img.width / sw, img.height / sh
+        bbox = (int(mask_bbox[0] * sx), int(mask_bbox[1] * sy),
+                min(img.width, math.ceil(mask_bbox[2] * sx)), min(img.height, math.ceil(mask_bbox[3] * sy)))
+        # 手の輪郭そのものを線として拾わないよう、マスクを少し削る
+        return PalmRegion(img.size, bbox, mask.filter(ImageFilter.MinFilter(3)), mask_bbox, method, coverage)
+    return PalmRegion(img.size)
+
+
+# 線検出のパラメータ（detect_palm_lines の引数で上書き可能）
+BLUR_RADII = (1, 2, 3)
+EDGE_THRESHOLDS = (12,)
+EDGE_TARGET_PIXELS = 6000
+LINE_DILATE_SIZE = 5
+
+
+def detect_palm_lines(img, target_pixels=EDGE_TARGET_PIXELS, thresholds=EDGE_THRESHOLDS,
+                      blur_radii=BLUR_RADII, ctx=None, mask=None):
+    """
+    手相の線を検出する
+    ぼかし半径 × 閾値の各候補を、線を太らせた後の画素数で採点し target_pixels に最も近いものを採用
+    ctx を渡すと assess_lighting で作ったグレースケール・平均輝度を再利用する
+    mask（L、0/255）を渡すとその外側のエッジは数えない（背景を線として拾わない）
+    """
+    with stage('preprocess', pixels=img.width * img.height):
+        img = preprocess_for_lighting(img, ctx)
+        gray = img.convert('L')
+        # ヒストグラム均等化でしわ・線のコントラストを強調
+        gray = ImageOps.equalize(gray)
+        enhanced = ImageEnhance.Contrast(gray).enhance(3.0)
+        enhanced = ImageEnhance.Sharpness(enhanced).enhance(3.0)
+        # エッジ強調フィルタで線をはっきりさせる
+        enhanced = enhanced.filter(ImageFilter.EDGE_ENHANCE_MORE)
+    with stage('detect', pixels=img.width * img.height):
+        return _search_edges(enhanced, target_pixels, thresholds, blur_radii, mask), enhanced
+
+
+def _search_edges(enhanced, target_pixels, thresholds, blur_radii, mask=None):
+    """ぼかし半径 × 閾値の候補から、太らせた後の画素数が target_pixels に最も近い二値画像を選ぶ"""
+    backend = get_backend()
+    best, best_error = None, None
+    for blur_radius in blur_radii:
         blurred = enhanced.filter(ImageFilter.GaussianBlur(radius=blur_radius))
         edges = blurred.filter(ImageFilter.FIND_EDGES)
         edges = ImageEnhance.Contrast(edges).enhance(6.0)
-        # 閾値でノイズを抑えつつ線を検出（低すぎると塊になる）
-        edges_binary = edges.point(lambda x: 255 if x > 12 else 0, mode='L')
-        # 線を適度に太く（強くしすぎると塊になって見えなくなる）
-        edges_binary = edges_binary.filter(ImageFilter.MaxFilter(5))
-        line_count = sum(1 for p in edges_binary.getdata() if p > 0)
-        results.append((edges_binary, line_count))
-    results.sort(key=lambda x: abs(x[1] - 6000))
-    return results[0][0], enhanced
-
-
-def analyze_line_characteristics(edges_img):
-    w, h = edges_img.size
-    regions = [
-        ('heart_zone', 0, 0, w, int(h*0.35)),
-        ('marriage_zone', int(w*0.65), 0, w, int(h*0.25)),
-        ('head_zone', 0, int(h*0.35), w, int(h*0.55)),
-        ('life_zone', 0, 0, int(w*0.35), h),
-        ('fate_zone', int(w*0.35), 0, int(w*0.65), h),
-        ('sun_zone', int(w*0.5), int(h*0.2), int(w*0.8), int(h*0.6)),
-        ('money_zone', int(w*0.25), int(h*0.4), int(w*0.6), int(h*0.8)),
-        ('health_zone', int(w*0.3), int(h*0.5), int(w*0.55), h),
-        ('intuition_zone', int(w*0.55), int(h*0.55), w, h),
+        if mask is not None:
+            edges = ImageChops.darker(edges, mask)
+        # 閾値ごとの画素数はヒストグラム1回で分かる（太らせる前の数＝太らせた後の下限）
+        hist = edges.histogram()
+        for threshold in thresholds:
+            raw_count = sum(hist[threshold + 1:])
+            if best is not None and raw_count - target_pixels >= best_error:
+                continue
+            # 閾値でノイズを抑えつつ線を検出（低すぎると塊になる）
+            # 線を適度に太く（強くしすぎると塊になって見えなくなる）
+            edges_binary, count = backend.threshold_dilate(edges, threshold, LINE_DILATE_SIZE)
+            error = abs(count - target_pixels)
+            if best is None or error < best_error:
+                best, best_error = edges_binary, error
+    return best
+
+
+# 手相ゾーン定義: (名前, 左, 上, 右, 下) を画像の幅・高さに対する比率で指定
+LINE_ZONES = (
+    ('heart_zone', 0, 0, 1, 0.35),
+    ('marriage_zone', 0.65, 0, 1, 0.25),
+    ('head_zone', 0, 0.35, 1, 0.55),
+    ('life_zone', 0, 0, 0.35, 1),
+    ('fate_zone', 0.35, 0, 0.65, 1),
+    ('sun_zone', 0.5, 0.2, 0.8, 0.6),
+    ('money_zone', 0.25, 0.4, 0.6, 0.8),
+    ('health_zone', 0.3, 0.5, 0.55, 1),
+    ('intuition_zone', 0.55, 0.55, 1, 1),
+)
+
+
+def zone_bounds(size, zones=LINE_ZONES):
+    """ゾーン定義（比率）を画素座標 (名前, 左, 上, 右, 下) に変換"""
+    w, h = size
+    return [
+        (name, int(w * left), int(h * upper), int(w * right), int(h * lower))
+        for name, left, upper, right, lower in zones
     ]
+
+
+def analyze_line_characteristics(edges_img, zones=LINE_ZONES):
+    bounds = zone_bounds(edges_img.size, zones)
+    counts = get_backend().zone_counts(edges_img, bounds)
     analysis = {}
-    for name, left, upper, right, lower in regions:
-        if right <= left or lower <= upper:
-            analysis[name] = 50
-            continue
-        crop = edges_img.crop((left, upper, right, lower))
-        cw, ch = crop.size
-        total = cw * ch
-        if total == 0:
+    for name, left, upper, right, lower in bounds:
+        if name not in counts:
             analysis[name] = 50
             continue
-        count = sum(1 for p in crop.getdata() if p > 0)
-        density = count / total * 100
+        total = (right - left) * (lower - upper)
+        density = counts[name] / total * 100
         analysis[name] = min(100, density * 10)
     return analysis
 
@@ -147,23 +487,45 @@ def analyze_line_characteristics(edges_img):
 def create_visualization(img, edges):
     if img.mode != 'RGB':
         img = img.convert('RGB')
-    # 元写真の上に検出線を重ねる（元写真はそのまま見えるように）
-    line_color = (0, 255, 220)
-    line_layer = Image.new('RGB', img.size, line_color)
-    mask = edges.point(lambda x: 255 if x > 0 else 0, mode='1')
-    # 線の部分だけシアンを重ね、それ以外は元画像を表示
-    return Image.composite(line_layer, img, mask)
+    # 元写真の上に検出線を重ねる（線の部分だけシアン、それ以外は元画像を表示）
+    return get_backend().overlay(img, edges, (0, 255, 220))
+
+
+# edges_to_visible_display 用: 0 → 背景(0), それ以外 → 線(1)
+_DISPLAY_INDEX_LUT = [0] + [1] * 255
+_DISPLAY_PALETTE = [15, 15, 18, 0, 255, 220]
 
 
 def edges_to_visible_display(edges):
-    """検出された線をはっきり見える色で表示用に変換"""
-    dark_bg = Image.new('RGB', edges.size, (15, 15, 18))
-    bright_line = Image.new('RGB', edges.size, (0, 255, 220))
-    mask = edges.point(lambda x: 255 if x > 0 else 0, mode='1')
-    return Image.composite(bright_line, dark_bg, mask)
+    """検出された線をはっきり見える色で表示用に変換（背景・線の2色パレット画像）"""
+    display = edges.point(_DISPLAY_INDEX_LUT)
+    display.putpalette(_DISPLAY_PALETTE)
+    return display
 
 
-def encode_image_to_base64(img):
+def encode_image(img, fmt='png', quality=None):
+    """
+    画像をエンコードしてバイト列を返す
+    fmt: 'png' / 'webp' / 'jpeg'（quality は webp・jpeg のみ）
+    """
     buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+    if fmt == 'png':
+        if img.mode == 'P' and img.getextrema()[1] <= 1:
+            # 2色のパレット画像は1ビットPNGにする
+            img.save(buffer, format='PNG', bits=1)
+        else:
+            img.save(buffer, format='PNG')
+    else:
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        if fmt == 'webp':
+            _register_webp()
+            # method は圧縮の手間（既定の4は遅い割に小さくならない）
+            img.save(buffer, format='WEBP', quality=quality or 80, method=2)
+        else:
+            img.save(buffer, format='JPEG', quality=quality or 85)
+    return buffer.getvalue()
+
+
+def encode_image_to_base64(img):
+    return base64.b64encode(encode_image(img)).decode('utf-8')
@@ -0,0 +1,302 @@
+"""
+解析パイプラインの計測（app.pyとapi/analyze.pyで共有）
+段階ごとに経過時間・CPU時間・入力画素数・出力バイト数を記録し、
+リクエスト単位では Server-Timing ヘッダに、プロセス全体ではレイテンシのヒストグラムにまとめる
+ヒストグラムは Prometheus のテキスト形式で書き出せる（app.py の /metrics）
+
+無効にすると stage() は何もしない共有オブジェクトを返すだけになる
+
+リクエストごとのメモリのピーク（memory_budget.MemoryTracker）も、有効なら同じ流れで記録する
+
+環境変数:
+  PALM_METRICS  0 で計測を無効にする（既定: 有効）
+"""
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from memory_budget import MemoryTracker, report_enabled
+
+ENABLED = os.environ.get('PALM_METRICS', '1').lower() not in ('0', 'false', 'off')
+MEMORY_REPORT = ENABLED and report_enabled()
+
+# ヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# メモリのヒストグラムの区切り（バイト）
+MEMORY_BUCKETS = tuple(mb * 1024 * 1024 for mb in (16, 32, 64, 128, 256, 512, 768, 1024, 2048))
+
+_current_trace = ContextVar('palm_trace', default=None)
+
+
+class Histogram:
+    """累積バケットのヒストグラム（区切りごとの件数・合計・件数）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for upper, count in zip(self.buckets, self.counts):
+            total += count
+            yield upper, total
+
+
+class _StageTotals:
+    """段階ごとの集計（所要時間のヒストグラムとCPU時間・画素数・バイト数の合計）"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.cpu_seconds = 0.0
+        self.pixels = 0
+        self.bytes = 0
+
+
+class Registry:
+    """プロセス全体の計測値"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.requests = {}
+        self.memory = {}  # (指標, ルート) → Histogram
+
+    def record_stage(self, name, wall, cpu, pixels, nbytes):
+        with self._lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = _StageTotals()
+            totals.latency.observe(wall)
+            totals.cpu_seconds += cpu
+            totals.pixels += pixels or 0
+            totals.bytes += nbytes or 0
+
+    def record_request(self, route, wall):
+        with self._lock:
+            histogram = self.requests.get(route)
+            if histogram is None:
+                histogram = self.requests[route] = Histogram()
+            histogram.observe(wall)
+
+    def record_memory(self, route, peak_traced, peak_rss):
+        with self._lock:
+            for metric, value in (('traced', peak_traced), ('rss', peak_rss)):
+                if value is None:
+                    continue
+                histogram = self.memory.get((metric, route))
+                if histogram is None:
+                    histogram = self.memory[(metric, route)] = Histogram(MEMORY_BUCKETS)
+                histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.stages.clear()
+            self.requests.clear()
+            self.memory.clear()
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式（version 0.0.4）で書き出す"""
+        with self._lock:
+            lines = []
+            _histogram_lines(lines, 'palm_request_duration_seconds', 'リクエストの処理時間',
+                             'route', {route: h for route, h in self.requests.items()})
+            _histogram_lines(lines, 'palm_stage_duration_seconds', '解析段階ごとの経過時間',
+                             'stage', {name: t.latency for name, t in self.stages.items()})
+            for metric, help_text, attr in (
+                    ('palm_stage_cpu_seconds_total', '解析段階ごとのCPU時間', 'cpu_seconds'),
+                    ('palm_stage_pixels_total', '解析段階に入力された画素数', 'pixels'),
+                    ('palm_stage_bytes_total', '解析段階が扱ったバイト数（デコード前の入力・エンコード後の出力）', 'bytes')):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for name, totals in sorted(self.stages.items()):
+                    lines.append(f'{metric}{{stage="{name}"}} {_number(getattr(totals, attr))}')
+            for metric, help_text in (('traced', 'リクエスト中に tracemalloc で追跡したメモリのピーク'),
+                                      ('rss', 'リクエスト中の最大常駐メモリ')):
+                histograms = {route: h for (kind, route), h in self.memory.items() if kind == metric}
+                if histograms:
+                    _histogram_lines(lines, f'palm_request_peak_{metric}_bytes', help_text, 'route', histograms)
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(lines, metric, help_text, label, histograms):
+    lines.append(f'# HELP {metric} {help_text}')
+    lines.append(f'# TYPE {metric} histogram')
+    for key, histogram in sorted(histograms.items()):
+        for upper, count in histogram.cumulative():
+            lines.append(f'{metric}_bucket{{{label}="{key}",le="{upper}"}} {count}')
+        lines.append(f'{metric}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{metric}_sum{{{label}="{key}"}} {_number(histogram.sum)}')
+        lines.append(f'{metric}_count{{{label}="{key}"}} {histogram.count}')
+
+
+registry = Registry()
+
+
+class Trace:
+    """1リクエスト分の段階の記録（Server-Timing ヘッダ用）"""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = []
+        self.marks = []
+        self.memory = MemoryTracker().start() if MEMORY_REPORT else None
+
+    def server_timing(self):
+        """Server-Timing ヘッダの値（同じ名前の段階は合算する）"""
+        durations = {}
+        for name, wall, cpu in self.stages:
+            total_wall, total_cpu = durations.get(name, (0.0, 0.0))
+            durations[name] = (total_wall + wall, total_cpu + cpu)
+        parts = [f'{name};dur={wall * 1000:.1f};desc="cpu {cpu * 1000:.1f}ms"'
+                 for name, (wall, cpu) in durations.items()]
+        parts += [f'{name};desc="{value}"' for name, value in self.marks]
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(parts)
+
+
+class _Stage:
+    """計測中の段階（with で囲んだ範囲の経過時間・CPU時間を記録する）"""
+
+    __slots__ = ('name', 'pixels', 'bytes', '_wall', '_cpu')
+
+    def __init__(self, name, pixels=None, nbytes=None):
+        self.name = name
+        self.pixels = pixels
+        self.bytes = nbytes
+
+    def record(self, pixels=None, nbytes=None):
+        """段階の中で分かった画素数・バイト数を記録する"""
+        if pixels is not None:
+            self.pixels = pixels
+        if nbytes is not None:
+            self.bytes = nbytes
+
+    def __enter__(self):
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        registry.record_stage(self.name, wall, cpu, self.pixels, self.bytes)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.stages.append((self.name, wall, cpu))
+        return False
+
+
+class _NullStage:
+    """計測が無効なときの段階（何も記録しない）"""
+
+    __slots__ = ()
+
+    def record(self, pixels=None, nbytes=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, pixels=None, nbytes=None):
+    """
+    with stage('decode', nbytes=len(data)) as s: ... のように段階を囲んで計測する
+    CPU時間は実行中のスレッドの分だけを数える
+    """
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, pixels, nbytes)
+
+
+def begin_trace(route):
+    """このリクエスト（コンテキスト）の記録を始める"""
+    if ENABLED:
+        _current_trace.set(Trace(route))
+
+
+def mark(name, value):
+    """数値以外の情報（キャッシュの当否など）を Server-Timing に載せる"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.marks.append((name, value))
+
+
+def end_trace():
+    """
+    記録を終えてリクエストのヒストグラムに加える
+    戻り値: Server-Timing ヘッダの値（記録していなければ None）
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    return _finish_trace(trace)
+
+
+def _finish_trace(trace):
+    registry.record_request(trace.route, time.perf_counter() - trace.started)
+    if trace.memory is not None:
+        memory = trace.memory.stop()
+        registry.record_memory(trace.route, memory.peak_traced, memory.peak_rss)
+        report = memory.report()
+        trace.marks.append(('memory', f'peak_rss {report["peak_rss_mb"]}MB ({report["peak_rss_scope"]}),'
+                                      f' traced {report["peak_traced_mb"]}MB'))
+    return trace.server_timing()
+
+
+class TracedStream:
+    """
+    ストリーミングのレスポンスの本文（events）を送り終えるまで、このリクエストの記録を続ける
+    本文を作る間の段階も同じ記録に入り、送り終えた（または切断された）ときにリクエストの処理時間を記録する
+    Server-Timing ヘッダは本文より前に送るので、ストリーミングのレスポンスには付けない
+    """
+
+    def __init__(self, events):
+        self._events = iter(events)
+        self._trace = _current_trace.get()
+        _current_trace.set(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = _current_trace.set(self._trace)
+        try:
+            return next(self._events)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            _current_trace.reset(token)
+
+    def close(self):
+        """本文の残りを捨てて記録を終える（何度呼んでもよい）"""
+        close = getattr(self._events, 'close', None)
+        if close is not None:
+            close()
+        trace, self._trace = self._trace, None
+        if trace is not None:
+            _finish_trace(trace)
@@ -0,0 +1,189 @@
+"""
+非同期の解析ジョブ（app.py の /api/jobs 用）
+受け付けたジョブは上限付きの待ち行列に入れ、決まった数のワーカースレッドが順に解析する
+待ち行列が満杯なら受け付けずに再試行までの目安を返し、混雑時も待ち時間が伸び続けないようにする
+
+環境変数:
+  PALM_JOB_WORKERS     ワーカースレッド数（既定: CPUコア数）
+  PALM_JOB_QUEUE_SIZE  待ち行列に入れられるジョブ数（既定: 32）
+  PALM_JOB_TTL         終わったジョブの結果を保持する時間（秒）
+"""
+
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from palm_analysis import analyze_image_bytes
+
+DEFAULT_QUEUE_SIZE = 32
+DEFAULT_TTL = 300
+# 解析時間の実績がまだないときの見積もり（秒）
+INITIAL_SERVICE_TIME = 0.5
+# 解析時間の移動平均の重み
+SERVICE_TIME_ALPHA = 0.2
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    """待ち行列が満杯（retry_after 秒後の再試行を勧める）"""
+
+    def __init__(self, retry_after, queue_depth, estimated_wait):
+        super().__init__('queue full')
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+        self.estimated_wait = estimated_wait
+
+
+class Job:
+    """1件の解析ジョブ"""
+
+    def __init__(self, img_bytes, image_mode, output, interpretations):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self._args = (img_bytes, image_mode, output, interpretations)
+
+
+class JobQueue:
+    """上限付き待ち行列 + 固定数のワーカースレッド"""
+
+    def __init__(self, workers=None, max_queued=DEFAULT_QUEUE_SIZE, ttl=DEFAULT_TTL):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.service_time = INITIAL_SERVICE_TIME
+        self.rejected = 0
+        self.completed = 0
+        self._pending = deque()
+        self._jobs = {}  # id → Job
+        self._finished = deque()  # 終わったジョブ（終わった順。保持期間はここから切れる）
+        self._running = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _start_workers(self):
+        # 最初の受付時に起動する（import しただけではスレッドを作らない）
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'palm-job-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _expire(self, now):
+        # 受付順ではなく終わった順に見る（長く終わらないジョブがあっても、その後のジョブの結果は期限で消える）
+        while self._finished and now - self._finished[0].finished >= self.ttl:
+            job = self._finished.popleft()
+            del self._jobs[job.id]
+
+    def estimated_wait(self, position):
+        """待ち行列の position 番目（0始まり）のジョブが終わるまでの見積もり（秒）"""
+        return (position + self._running) / self.workers * self.service_time + self.service_time
+
+    def submit(self, img_bytes, image_mode='inline', output=None, interpretations='full'):
+        """ジョブを受け付けて返す（満杯なら QueueFull）"""
+        with self._cond:
+            self._expire(time.monotonic())
+            depth = len(self._pending)
+            if depth >= self.max_queued:
+                self.rejected += 1
+                # 先頭のジョブが1つ進むまでの目安
+                retry_after = max(1, math.ceil(self.service_time / self.workers))
+                raise QueueFull(retry_after, depth, self.estimated_wait(depth))
+            job = Job(img_bytes, image_mode, output, interpretations)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._start_workers()
+            self._cond.notify()
+            return job
+
+    def get(self, job_id):
+        with self._cond:
+            self._expire(time.monotonic())
+            return self._jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.popleft()
+                job.status = RUNNING
+                job.started = time.monotonic()
+                self._running += 1
+            try:
+                result, err = analyze_image_bytes(*job._args)
+            except Exception as e:
+                result, err = None, str(e)
+            with self._cond:
+                job.finished = time.monotonic()
+                job.status = FAILED if err else DONE
+                job.result, job.error = result, err
+                job._args = None  # 画像バイト列を手放す
+                self._finished.append(job)
+                self._running -= 1
+                self.completed += 1
+                elapsed = job.finished - job.started
+                self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+            job.done.set()
+
+    def describe(self, job):
+        """ジョブの状態（レスポンス用）"""
+        with self._cond:
+            info = {'job_id': job.id, 'status': job.status}
+            if job.status == QUEUED:
+                try:
+                    position = self._pending.index(job)
+                except ValueError:
+                    position = 0
+                info['position'] = position
+                info['estimated_wait'] = round(self.estimated_wait(position), 2)
+            elif job.status == RUNNING:
+                remaining = self.service_time - (time.monotonic() - job.started)
+                info['estimated_wait'] = round(max(0.0, remaining), 2)
+            else:
+                info['elapsed'] = round(job.finished - job.submitted, 3)
+            info['queue_depth'] = len(self._pending)
+        if job.status == DONE:
+            info['result'] = job.result
+        elif job.status == FAILED:
+            info['error'] = job.error
+        return info
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._pending)
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queue_depth': depth,
+                'max_queued': self.max_queued,
+                'estimated_wait': round(self.estimated_wait(depth), 2),
+                'service_time': round(self.service_time, 3),
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """プロセス共通のジョブ待ち行列を返す（環境変数で設定）"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(
+                workers=int(os.environ.get('PALM_JOB_WORKERS', 0)) or None,
+                max_queued=int(os.environ.get('PALM_JOB_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+                ttl=float(os.environ.get('PALM_JOB_TTL', DEFAULT_TTL)),
+            )
+        return _queue
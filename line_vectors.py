@@ -0,0 +1,249 @@
+"""
+検出線のベクトル化（images=vector の折れ線・kind=lines の SVG）
+太らせた検出線を細線化して1画素幅の骨格にし、つながった画素をたどって折れ線にする
+折れ線は Douglas-Peucker 法で間引き、長さと曲がり具合を添えて返す
+クライアントは手元の写真の上に折れ線を描くので、合成・ラスター画像のエンコードが要らない
+"""
+
+import math
+import re
+
+from PIL import Image, ImageFilter, ImageMorph
+
+from image_processing import LINE_ZONES, threshold_lut, zone_bounds
+
+# 細線化の前に検出線を縮める倍率（太らせた線は5画素幅なので、半分にしても線はつながったまま）
+VECTOR_SCALE = 2
+# 細線化の繰り返しの上限（通常は数回で収束する）
+MAX_THIN_ITERATIONS = 30
+# Douglas-Peucker 法の許容誤差（解析画像の画素）
+SIMPLIFY_EPSILON = 1.5
+# これより短い折れ線（細線化で出るひげ・点状のノイズ）は返さない（解析画像の画素）
+MIN_LINE_LENGTH = 12
+# 返す折れ線の数の上限（長い順）
+MAX_POLYLINES = 200
+
+# 細線化の構造要素（Golay の L、3x3 を行ごとに並べたもの。. はどちらでもよい）
+_THINNING_ELEMENTS = ('000.1.111', '.00110.1.')
+# 8近傍（4近傍を先に試して斜めに飛ばないようにする）
+_NEIGHBORS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1))
+
+# 骨格の画素 → 1（近傍の数を数えるため）
+_ONE_LUT = [0] + [1] * 255
+_NEIGHBOR_COUNT = ImageFilter.Kernel((3, 3), (1, 1, 1, 1, 0, 1, 1, 1, 1), scale=1)
+
+_thinning_ops = None
+
+
+def _rotate(pattern):
+    rows = (pattern[0:3], pattern[3:6], pattern[6:9])
+    return ''.join(rows[2 - c][r] for r in range(3) for c in range(3))
+
+
+def _get_thinning_ops():
+    """8方向の構造要素それぞれの MorphOp（1方向ずつ順に削らないと線が切れる）"""
+    global _thinning_ops
+    if _thinning_ops is None:
+        ops = []
+        for pattern in _THINNING_ELEMENTS:
+            for _ in range(4):
+                rows = f'{pattern[0:3]} {pattern[3:6]} {pattern[6:9]}'
+                ops.append(ImageMorph.MorphOp(lut=ImageMorph.LutBuilder(patterns=[f'1:({rows})->0']).build_lut()))
+                pattern = _rotate(pattern)
+        _thinning_ops = ops
+    return _thinning_ops
+
+
+def thin(binary):
+    """二値画像（L、0/255）を1画素幅の骨格にする"""
+    ops = _get_thinning_ops()
+    for _ in range(MAX_THIN_ITERATIONS):
+        changed = 0
+        for op in ops:
+            count, binary = op.apply(binary)
+            changed += count
+        if not changed:
+            break
+    return binary
+
+
+def trace_polylines(skeleton):
+    """
+    骨格の画素をたどって折れ線（画素座標の列）にする
+    端点から順にたどり、分岐点で折れ線を区切る。残った画素（輪になった線）は任意の点から始める
+    """
+    w, h = skeleton.size
+    # 1画素の余白を付けて、近傍を見るときに端の判定をしなくて済むようにする
+    padded = Image.new('L', (w + 2, h + 2), 0)
+    padded.paste(skeleton.point(_ONE_LUT), (1, 1))
+    stride = w + 2
+    data = padded.tobytes()
+    # 近傍の画素数は畳み込み1回で求める
+    degree = padded.filter(_NEIGHBOR_COUNT).tobytes()
+    offsets = [dy * stride + dx for dx, dy in _NEIGHBORS]
+    pixels = [m.start() for m in re.finditer(rb'\x01', data)]
+
+    visited = bytearray(len(data))
+    paths = []
+    starts = [i for i in pixels if degree[i] == 1] + pixels
+    for start in starts:
+        if visited[start]:
+            continue
+        path = [start]
+        # 分岐点から出る枝は、すでにたどった分岐点からつなげる
+        for offset in offsets:
+            n = start + offset
+            if data[n] and visited[n] and degree[n] > 2:
+                path.insert(0, n)
+                break
+        visited[start] = 1
+        current = start
+        while True:
+            following = None
+            for offset in offsets:
+                n = current + offset
+                if data[n] and not visited[n]:
+                    following = n
+                    break
+            if following is None:
+                break
+            path.append(following)
+            visited[following] = 1
+            if degree[following] > 2:
+                break
+            current = following
+        paths.append([(i % stride - 1, i // stride - 1) for i in path])
+    return paths
+
+
+def simplify(points, epsilon=SIMPLIFY_EPSILON):
+    """Douglas-Peucker 法で折れ線を間引く（端点は残す）"""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x0, y0), (x1, y1) = points[first], points[last]
+        dx, dy = x1 - x0, y1 - y0
+        norm = math.hypot(dx, dy)
+        farthest, max_distance = None, epsilon
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if norm:
+                distance = abs(dy * (px - x0) - dx * (py - y0)) / norm
+            else:
+                distance = math.hypot(px - x0, py - y0)
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def polyline_length(points):
+    return sum(math.hypot(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(points, points[1:]))
+
+
+def turning_angle(points):
+    """折れ線の向きの変化の合計（ラジアン）"""
+    total = 0.0
+    for (x0, y0), (x1, y1), (x2, y2) in zip(points, points[1:], points[2:]):
+        a = math.atan2(y1 - y0, x1 - x0)
+        b = math.atan2(y2 - y1, x2 - x1)
+        total += abs((b - a + math.pi) % (2 * math.pi) - math.pi)
+    return total
+
+
+def extract_lines(edges):
+    """
+    検出線（L、元画像の大きさ）を折れ線にする
+    戻り値: [{points: [x0, y0, x1, y1, ...], length, curvature}]（長い順、座標は解析画像の画素）
+    curvature は100画素あたりの向きの変化（ラジアン）
+    """
+    bbox = edges.getbbox()
+    if bbox is None:
+        return []
+    region = edges.crop(bbox)
+    if VECTOR_SCALE > 1:
+        # 面積平均で縮めて半分以上が線の画素を線とする
+        region = region.reduce(VECTOR_SCALE).point(threshold_lut(127))
+    skeleton = thin(region)
+
+    lines = []
+    for path in trace_polylines(skeleton):
+        if (len(path) - 1) * VECTOR_SCALE * math.sqrt(2) < MIN_LINE_LENGTH:
+            continue
+        points = [(bbox[0] + x * VECTOR_SCALE, bbox[1] + y * VECTOR_SCALE) for x, y in path]
+        length = polyline_length(points)
+        if length < MIN_LINE_LENGTH:
+            continue
+        simplified = simplify(points)
+        lines.append({
+            'points': [value for point in simplified for value in point],
+            'length': round(length, 1),
+            'curvature': round(turning_angle(simplified) / length * 100, 3),
+        })
+    lines.sort(key=lambda line: -line['length'])
+    return lines[:MAX_POLYLINES]
+
+
+def zone_line_features(lines, bbox, zones=LINE_ZONES):
+    """
+    ゾーンごとの線の特徴（bbox は手のひらの範囲、ゾーンはその範囲に対する比率）
+    戻り値: {ゾーン名: {length: 線の長さの合計, lines: 通る折れ線の数, curvature: 長さで重み付けした曲がり具合}}
+    """
+    left, upper, right, lower = bbox
+    bounds = [(name, l + left, u + upper, r + left, b + upper)
+              for name, l, u, r, b in zone_bounds((right - left, lower - upper), zones)]
+    features = {name: {'length': 0.0, 'lines': 0, 'curvature': 0.0} for name, *_ in bounds}
+    for line in lines:
+        coords = line['points']
+        points = list(zip(coords[0::2], coords[1::2]))
+        touched = set()
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            # 線分はその中点が入るゾーンに数える
+            mx, my = (x0 + x1) / 2, (y0 + y1) / 2
+            segment = math.hypot(x1 - x0, y1 - y0)
+            for name, zl, zu, zr, zb in bounds:
+                if zl <= mx < zr and zu <= my < zb:
+                    features[name]['length'] += segment
+                    features[name]['curvature'] += segment * line['curvature']
+                    touched.add(name)
+        for name in touched:
+            features[name]['lines'] += 1
+    for values in features.values():
+        if values['length']:
+            values['curvature'] = round(values['curvature'] / values['length'], 3)
+        values['length'] = round(values['length'], 1)
+    return features
+
+
+def vectorize(edges):
+    """images=vector のレスポンス用（座標の大きさ・折れ線・ゾーンごとの線の特徴）"""
+    lines = extract_lines(edges)
+    bbox = edges.info.get('palm_bbox') or (0, 0, edges.width, edges.height)
+    return {
+        'width': edges.width,
+        'height': edges.height,
+        'polylines': lines,
+        'zones': zone_line_features(lines, bbox),
+    }
+
+
+def lines_to_svg(vector, color='#00ffdc', stroke_width=3):
+    """折れ線を SVG にする（viewBox は解析画像の大きさ。写真の上に重ねると表示の大きさに合わせて伸縮する）"""
+    paths = []
+    for line in vector['polylines']:
+        coords = line['points']
+        points = ' '.join(f'{x},{y}' for x, y in zip(coords[0::2], coords[1::2]))
+        paths.append(f'M{points}')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {vector["width"]} {vector["height"]}"'
+        f' preserveAspectRatio="none"><path d="{" ".join(paths)}" fill="none" stroke="{color}"'
+        f' stroke-width="{stroke_width}" stroke-linecap="round" stroke-linejoin="round"'
+        f' vector-effect="non-scaling-stroke"/></svg>'
+    ).encode('utf-8')
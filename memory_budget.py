@@ -0,0 +1,114 @@
+"""
+メモリ予算モードと、リクエストごとのメモリ使用量の計測
+予算を決めると、デコード後の画像がその予算を超える画像は読み込まず、
+大きな画像はRGBへの変換と縮小を帯状に少しずつ行って、全画素分の中間画像を同時に持たないようにする
+
+計測するもの:
+  peak_traced  tracemalloc で追跡したPythonのメモリ確保のピーク（バイト列・base64・JSONなど）
+  peak_rss     プロセスの最大常駐メモリ（Linux ではリクエスト開始時にリセットするのでリクエスト単位、
+               Pillow の画素データのように tracemalloc に現れない確保も含む）
+  同時に複数のリクエストを処理するプロセスでは、他のリクエストの分も含まれる
+
+環境変数:
+  PALM_MEMORY_BUDGET_MB  1リクエストで画像に使ってよいメモリの目安（MB）。指定すると予算モード
+  PALM_MEMORY_REPORT     1 で計測を有効にする（予算モードでは既定で有効）
+"""
+
+import os
+import sys
+import tracemalloc
+
+_MB = 1024 * 1024
+
+
+def get_memory_budget():
+    """予算（バイト）。予算モードでなければ None"""
+    value = os.environ.get('PALM_MEMORY_BUDGET_MB')
+    try:
+        return int(float(value) * _MB) if value else None
+    except ValueError:
+        return None
+
+
+def report_enabled():
+    flag = os.environ.get('PALM_MEMORY_REPORT')
+    if flag is not None:
+        return flag.lower() not in ('0', 'false', 'off', '')
+    return get_memory_budget() is not None
+
+
+def decoded_bytes(size, mode):
+    """デコード後の画素データの大きさの見積もり（Pillow は RGB も1画素4バイトで持つ）"""
+    if mode in ('1', 'L', 'P'):
+        per_pixel = 1
+    elif mode.startswith('I;16'):
+        per_pixel = 2
+    else:
+        per_pixel = 4
+    return size[0] * size[1] * per_pixel
+
+
+def _proc_status(field):
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """最大常駐メモリ（VmHWM）を現在値に戻す（Linux 4.0 以降。できなければ False）"""
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    peak = _proc_status('VmHWM')
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux などは KB
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class MemoryTracker:
+    """start() から stop() までのメモリのピークを測る"""
+
+    def __init__(self):
+        self.peak_traced = None
+        self.peak_rss = None
+        self.rss_reset = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            # 一度始めたら止めない（並行するリクエストの計測を壊さないため）
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.rss_reset = _reset_peak_rss()
+        return self
+
+    def stop(self):
+        self.peak_traced = tracemalloc.get_traced_memory()[1]
+        self.peak_rss = _peak_rss()
+        return self
+
+    def report(self):
+        """計測結果（MB）。peak_rss_scope は request（リクエスト単位）か process（起動以来）"""
+        budget = get_memory_budget()
+        return {
+            'peak_traced_mb': round(self.peak_traced / _MB, 1) if self.peak_traced is not None else None,
+            'peak_rss_mb': round(self.peak_rss / _MB, 1) if self.peak_rss is not None else None,
+            'peak_rss_scope': 'request' if self.rss_reset else 'process',
+            'budget_mb': round(budget / _MB, 1) if budget else None,
+        }
@@ -0,0 +1,88 @@
+"""
+multipart/form-data のストリーミングパーサ（cgi非依存・api/analyze.py用）
+リクエスト本文を Content-Length 分の1つのバッファへ少しずつ読み込みながら境界を探し、
+完成したパートから順に memoryview のスライス（コピーなし）として返す
+"""
+
+import re
+
+CHUNK_SIZE = 64 * 1024
+MAX_BODY_SIZE = 16 * 1024 * 1024  # 16MB（app.py の MAX_CONTENT_LENGTH と同じ）
+
+
+class PayloadTooLarge(ValueError):
+    """本文がサイズ上限を超えている"""
+
+
+def parse_boundary(content_type):
+    match = re.search(r'boundary=([^;\s]+)', content_type)
+    if not match:
+        return None
+    boundary = match.group(1).strip().encode()
+    if boundary.startswith(b'"') and boundary.endswith(b'"'):
+        boundary = boundary[1:-1]
+    return boundary or None
+
+
+def _parse_part(buf, view, start, end):
+    """区切りと区切りの間 [start, end) を (name, kind, memoryview) にする"""
+    # 終端の区切り（--boundary--）以降は無視
+    if buf.startswith(b'--', start, end):
+        return None
+    if buf.startswith(b'\r\n', start, end):
+        start += 2
+    elif buf.startswith(b'\n', start, end):
+        start += 1
+    header_end, sep = buf.find(b'\r\n\r\n', start, end), 4
+    if header_end == -1:
+        header_end, sep = buf.find(b'\n\n', start, end), 2
+    if header_end == -1:
+        return None
+    headers = buf[start:header_end].decode('utf-8', errors='ignore')
+    disp_match = re.search(r'name="([^"]+)"', headers)
+    if not disp_match:
+        return None
+    content_start = header_end + sep
+    # 次の区切りの直前の改行は本文に含めない
+    content_end = end
+    if buf.endswith(b'\r\n', content_start, end):
+        content_end -= 2
+    elif buf.endswith(b'\n', content_start, end):
+        content_end -= 1
+    kind = 'file' if re.search(r'filename="([^"]*)"', headers) else 'field'
+    return disp_match.group(1), kind, view[content_start:content_end]
+
+
+def iter_multipart(rfile, content_type, content_length, max_size=MAX_BODY_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    rfile から本文を読みながら (name, kind, data) を順に返す
+    kind は 'file' か 'field'、data は本文バッファの memoryview（フィールドは呼び出し側でデコード）
+    上限を超える本文は読み込む前に PayloadTooLarge を送出する
+    """
+    boundary = parse_boundary(content_type)
+    if boundary is None or content_length <= 0:
+        return
+    if content_length > max_size:
+        raise PayloadTooLarge(f'本文が大きすぎます（{content_length} > {max_size} バイト）')
+    delimiter = b'--' + boundary
+    buf = bytearray(content_length)
+    view = memoryview(buf)
+    filled = 0
+    scan_from = 0
+    part_start = None
+    while filled < content_length:
+        n = rfile.readinto(view[filled:filled + chunk_size])
+        if not n:
+            break
+        filled += n
+        # 読み込んだ範囲だけ区切りを探し、完成したパートはすぐに返す
+        while True:
+            pos = buf.find(delimiter, scan_from, filled)
+            if pos == -1:
+                scan_from = max(scan_from, filled - len(delimiter) + 1)
+                break
+            if part_start is not None:
+                part = _parse_part(buf, view, part_start, pos)
+                if part is not None:
+                    yield part
+            part_start = scan_from = pos + len(delimiter)
@@ -0,0 +1,336 @@
+"""手相解析パイプライン（app.pyとapi/analyze.pyで共有）"""
+
+import base64
+import time
+
+from image_processing import (
+    BLUR_RADII,
+    EDGE_TARGET_PIXELS,
+    MAX_IMAGE_PIXELS,
+    WORKING_SIZE,
+    AnalysisContext,
+    load_image,
+    resize_if_needed,
+    assess_lighting,
+    detect_palm_lines,
+    analyze_line_characteristics,
+    segment_palm,
+)
+from image_output import output_key, render_output
+from line_vectors import vectorize
+from instrumentation import mark, stage
+from memory_budget import get_memory_budget
+from palm_interpretation import (
+    CATEGORIES,
+    catalog_version,
+    compact_interpretation,
+    get_catalog,
+    get_palm_reading_interpretation,
+)
+from analysis_cache import content_key, get_cache
+from deadline import analysis_passes, record_cost
+from palm_signature import (
+    MAX_SIMILAR,
+    SIMILAR_COUNT,
+    get_signature_index,
+    index_signature,
+    make_signature,
+    parse_signature,
+    similar_entries,
+)
+from render_store import get_render_store, image_url
+
+# 画像の返し方: inline = base64 の data URL を埋め込む / url = 取得時に描画する短期URLを返す
+# vector = 画像の代わりに検出線の折れ線を返す（クライアントが写真に重ねて描く）
+# none = 画像を作らない（一括解析など文章・数値だけ必要な場合）
+IMAGE_MODES = ('inline', 'url', 'vector', 'none')
+
+# レスポンスの項目名 → 画像の種類
+RESULT_IMAGES = (('visualization', 'visualization'), ('edges_image', 'edges'))
+
+
+def decode_image(img_bytes, max_pixels=MAX_IMAGE_PIXELS):
+    """画像を読み込んで解析用の大きさ（WORKING_SIZE）に縮小する（読み込めない画像は None）"""
+    with stage('decode', nbytes=len(img_bytes)) as s:
+        img = load_image(img_bytes, max_size=WORKING_SIZE, max_pixels=max_pixels, budget=get_memory_budget())
+        if img is not None:
+            s.record(pixels=img.width * img.height)
+    if img is None or 0 in img.size:
+        return None
+    with stage('resize', pixels=img.width * img.height):
+        return resize_if_needed(img)
+
+
+def analyze_decoded(img, target_pixels=EDGE_TARGET_PIXELS, blur_radii=BLUR_RADII):
+    """
+    読み込み済みの画像の照明の評価・線の検出・ゾーンの採点を行う
+    戻り値: (検出線, 照明, ゾーン別スコア)
+    """
+    # グレースケール・平均輝度は照明の評価と補正で共有する
+    ctx = AnalysisContext(img)
+    with stage('lighting', pixels=img.width * img.height):
+        lighting = assess_lighting(img, ctx)
+
+    # 手のひらの範囲だけで線を探す（線の画素数の目標は切り出した面積に合わせて縮める）
+    with stage('segment', pixels=img.width * img.height):
+        region = segment_palm(img, ctx)
+    palm = ctx if region.is_full else ctx.crop(region.bbox)
+    palm_target = max(1, round(target_pixels * region.area_ratio))
+    mark('palm_region', f'{region.method} {region.area_ratio:.0%}')
+
+    # 手相解析（前処理・線の探索は detect_palm_lines の中で計測する）
+    edges, _ = detect_palm_lines(palm.img, palm_target, blur_radii=blur_radii, ctx=palm,
+                                 mask=region.crop_mask(palm.img.size))
+    # ゾーンは手のひらの範囲に対する比率で採点する
+    with stage('zones', pixels=edges.width * edges.height):
+        analysis = analyze_line_characteristics(edges)
+    mark('passes_saved', ctx.report()['passes_saved'] + (0 if palm is ctx else palm.report()['passes_saved']))
+    return region.expand(edges), lighting, analysis
+
+
+def run_pipeline(img_bytes, max_pixels=MAX_IMAGE_PIXELS, deadline=None, image_mode='inline'):
+    """
+    画像を読み込み、照明の評価・線の検出・ゾーンの採点を行う
+    deadline（deadline.Deadline）を渡すと、残り時間に合わせてぼかし半径・解析用の画像の大きさを減らす
+    戻り値: (解析用に縮小した画像, 検出線, 照明, ゾーン別スコア)（読み込めない画像は None）
+    """
+    img = decode_image(img_bytes, max_pixels)
+    if img is None:
+        return None
+    return analyze_working_image(img, deadline, image_mode)
+
+
+def analyze_working_image(img, deadline=None, image_mode='inline'):
+    """
+    decode_image で読み込んだ画像の照明の評価・線の検出・ゾーンの採点を行う（run_pipeline の読み込み以降）
+    戻り値: (解析に使った画像, 検出線, 照明, ゾーン別スコア)
+    """
+    if deadline is None:
+        return (img, *analyze_decoded(img))
+
+    working_size, blur_radii = deadline.plan_analysis(img.size, image_mode)
+    target_pixels = EDGE_TARGET_PIXELS
+    if working_size is not None and max(img.size) > working_size:
+        with stage('resize', pixels=img.width * img.height):
+            reduced = resize_if_needed(img, working_size)
+        # 線の画素数の目標は面積に合わせて縮める
+        target_pixels = max(1, round(target_pixels * reduced.width * reduced.height / (img.width * img.height)))
+        img = reduced
+    started = time.perf_counter()
+    analyzed = analyze_decoded(img, target_pixels, blur_radii)
+    record_cost('analysis', time.perf_counter() - started, img.width * img.height, analysis_passes(blur_radii))
+    return (img, *analyzed)
+
+
+def build_result(img, edges, lighting, analysis, image_mode='inline', output=None, deadline=None):
+    """
+    解析結果からレスポンス用の結果を作る（image_mode に応じて画像を埋め込む・URLにする・省く）
+    deadline を渡すと、残り時間に合わせて画像を軽い設定でエンコードする・省く
+    """
+    if deadline is not None:
+        image_mode, output = deadline.plan_output(img.width * img.height, image_mode, output)
+    with stage('interpret'):
+        interpretations = get_palm_reading_interpretation(analysis)
+
+    result = {
+        'success': True,
+        'interpretations': interpretations,
+        'categories': CATEGORIES,
+        'analysis': analysis,
+        'lighting': lighting,
+        # 似た手のひらの検索・再投稿の判定に使う固定長の署名（16進）
+        'signature': make_signature(edges, analysis).hex(),
+    }
+    if image_mode == 'url':
+        # 画像はURLだけ返し、クライアントが取得した時点で描画・エンコードする
+        token = get_render_store().put(img, edges)
+        result['image_token'] = token
+        for field, kind in RESULT_IMAGES:
+            result[field] = image_url(token, kind, output)
+        # 写真に重ねる検出線（SVG）。クライアントが手元の写真を使えば合成画像を取得しなくてよい
+        result['lines_svg'] = image_url(token, 'lines')
+        return result
+    if image_mode == 'vector':
+        started = time.perf_counter()
+        with stage('vectorize', pixels=edges.width * edges.height):
+            result['lines'] = vectorize(edges)
+        record_cost('vectorize', time.perf_counter() - started, edges.width * edges.height)
+        return result
+    if image_mode == 'none':
+        return result
+
+    # ビジュアル画像生成（画像ごとに形式を選び、サイズとエンコード時間を報告）
+    result['images'] = {}
+    started = time.perf_counter()
+    for field, kind in RESULT_IMAGES:
+        data, meta = render_output(kind, img, edges, output)
+        result[field] = data_url(data, meta)
+        result['images'][field] = meta
+    # 見積もりは出力する画像の画素数あたり（縮めて出力した分は速くなる）
+    meta = result['images']['visualization']
+    record_cost('output', time.perf_counter() - started, meta['width'] * meta['height'])
+    return result
+
+
+def data_url(data, meta):
+    return f'data:{meta["mime"]};base64,{base64.b64encode(data).decode("ascii")}'
+
+
+def process_analyze(img_bytes, image_mode='inline', output=None, deadline=None, img=None):
+    """
+    画像を解析してレスポンス用の結果を作る。戻り値: (result, error)
+    output は image_output.parse_output_options の出力設定（形式・品質・最大サイズ）
+    deadline（deadline.Deadline）を渡すと時間の予算に合わせて品質を下げ、達成した品質を quality に入れる
+    img: decode_image で読み込み済みの画像（渡すと img_bytes は読み込まない）
+    """
+    if img is None:
+        pipeline = run_pipeline(img_bytes, deadline=deadline, image_mode=image_mode)
+    else:
+        pipeline = analyze_working_image(img, deadline, image_mode)
+    if pipeline is None:
+        return None, '画像の読み込みに失敗しました'
+    result = build_result(*pipeline, image_mode, output, deadline)
+    if deadline is not None:
+        result['quality'] = deadline.report()
+        mark('quality', deadline.level)
+    return result, None
+
+
+def compact_result(result):
+    """解析結果の解釈文・カテゴリ一覧を [線の番号, 段階, スコア] とカタログのバージョンに置き換える（元の dict は変更しない）"""
+    compact = {key: value for key, value in result.items() if key != 'categories'}
+    compact['interpretations'] = compact_interpretation(result['analysis'])
+    compact['catalog_version'] = catalog_version()
+    return compact
+
+
+def result_cache_key(img_bytes, image_mode, output=None):
+    """
+    解析結果のキャッシュキーと、キャッシュ値がまだ使えるかを判定する関数（不要なら None）
+    出力設定（Accept ヘッダで決まる形式を含む）が違えば別の結果として扱う
+    """
+    is_valid = None
+    variant = [image_mode]
+    if image_mode == 'url':
+        # 画像URLが失効していれば解析し直す
+        store = get_render_store()
+        is_valid = lambda value: value[0] is None or store.has(value[0]['image_token'])
+        variant += [(output or {}).get(name) for name in ('format', 'quality', 'max_size')]
+    elif image_mode == 'inline':
+        variant += [output_key(kind, output) for _, kind in RESULT_IMAGES]
+    return f'{content_key(img_bytes)}:{variant!r}', is_valid
+
+
+def compute_result(img_bytes, image_mode='inline', output=None, deadline=None, img=None):
+    """
+    キャッシュに入れる解析結果を作る（analyze_image_bytes と progressive の共通の計算）
+    索引を使う設定なら、似た手のひらを探してから索引に加える。戻り値: (result, error)
+    """
+    result, err = process_analyze(img_bytes, image_mode, output, deadline, img)
+    if result is not None and get_signature_index() is not None:
+        with stage('similar'):
+            similar, duplicate_of = index_signature(content_key(img_bytes), bytes.fromhex(result['signature']))
+        result['similar'] = similar
+        result['duplicate_of'] = duplicate_of
+    return result, err
+
+
+def full_quality(value):
+    """キャッシュ値が品質を下げずに作られたか（下げた結果は次のリクエストで作り直す）"""
+    result = value[0]
+    return result is None or result.get('quality', {}).get('level', 'full') == 'full'
+
+
+def request_quality(result, deadline=None):
+    """
+    キャッシュから返す結果の quality を、このリクエストのものにする（元の dict は変更しない）
+    品質の段階は結果を作ったときのまま、予算・経過時間はこのリクエストの deadline から入れ直す
+    """
+    if result is None or (deadline is None and 'quality' not in result):
+        return result
+    cached = result.get('quality', {})
+    quality = {'level': cached.get('level', 'full'), 'degraded': list(cached.get('degraded', []))}
+    if deadline is not None:
+        current = deadline.report()
+        quality.update((name, current[name]) for name in ('budget_ms', 'elapsed_ms') if name in current)
+    return {**result, 'quality': quality}
+
+
+def cached_result(img_bytes, image_mode='inline', output=None, deadline=None, img=None):
+    """
+    キャッシュ付きの compute_result（analyze_image_bytes と progressive で共有）
+    品質を下げた結果はキャッシュから返さない。戻り値: (result, error)
+    """
+    key, check = result_cache_key(img_bytes, image_mode, output)
+    is_valid = lambda value: full_quality(value) and (check is None or check(value))
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return compute_result(img_bytes, image_mode, output, deadline, img)
+
+    result, err = get_cache().get_or_compute(key, compute, is_valid)
+    mark('cache', 'miss' if computed else 'hit')
+    if not computed:
+        result = request_quality(result, deadline)
+    return result, err
+
+
+def analyze_image_bytes(img_bytes, image_mode='inline', output=None, interpretations='full', deadline=None):
+    """
+    キャッシュ付きの process_analyze
+    同じ画像バイト列は再計算せず、同時に届いた同じ画像は1回の計算を共有する
+    interpretations: full = 解釈文とカテゴリ一覧を含める（従来のクライアント向け）
+                     compact = [線の番号, 段階, スコア] とカタログのバージョンだけ返す（文章はカタログから引く）
+    deadline: 時間の予算（deadline.Deadline、省略すると無制限）。品質を下げた結果はキャッシュから返さない
+    """
+    if image_mode not in IMAGE_MODES:
+        image_mode = 'inline'
+    result, err = cached_result(img_bytes, image_mode, output, deadline)
+    if result is not None and interpretations == 'compact':
+        result = compact_result(result)
+    return result, err
+
+
+def catalog_response(requested_version, etag_header=''):
+    """
+    解釈カタログのレスポンス内容
+    戻り値: (ステータス, 本文, ヘッダ)。要求されたバージョンが現在のものなら長期キャッシュを許す
+    """
+    catalog, body = get_catalog()
+    version = catalog['version']
+    headers = {
+        'ETag': f'"{version}"',
+        'Cache-Control': 'public, max-age=31536000, immutable' if requested_version == version else 'no-cache',
+    }
+    if f'"{version}"' in (etag_header or ''):
+        return 304, b'', headers
+    return 200, body, headers
+
+
+def similar_response(signature_text, k=None):
+    """
+    署名（16進）に似た手のひらを索引から探す（similar=署名 の問い合わせ）
+    戻り値: (ステータス, レスポンスの dict)
+    """
+    index = get_signature_index()
+    if index is None:
+        return 404, {'error': '似た手のひらの索引が設定されていません'}
+    signature = parse_signature(signature_text)
+    if signature is None:
+        return 400, {'error': '署名の形式が正しくありません'}
+    try:
+        count = min(max(int(k or SIMILAR_COUNT), 1), MAX_SIMILAR)
+    except ValueError:
+        count = SIMILAR_COUNT
+    with stage('similar'):
+        matches = index.search(signature, count)
+    return 200, {'similar': similar_entries(matches), 'entries': len(index)}
+
+
+def render_image(token, kind, output=None):
+    """
+    url モードの画像を描画・エンコードする
+    戻り値: (バイト列, メタ情報)（失効・不明な種類は None）
+    """
+    return get_render_store().render(token, kind, output)
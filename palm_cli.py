@@ -0,0 +1,196 @@
+"""
+手相解析のコマンドライン版（HTTP・base64を通さずに大量の写真を解析する）
+ディレクトリやファイル一覧の画像をCPUコア数分並列に解析し、1枚ごとに1行のJSON（JSONL）を出力する
+
+使い方:
+  python palm_cli.py photos/ -o results.jsonl
+  python palm_cli.py --file-list paths.txt -o results.jsonl --resume
+  python palm_cli.py photos/ -o results.jsonl --visualize out_images/ --workers 4 --memory-limit 512
+  python palm_cli.py photos/ -o results.jsonl --index palms.sig
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from analysis_cache import content_key
+from image_output import render_output
+from image_processing import MAX_IMAGE_PIXELS
+from palm_analysis import RESULT_IMAGES, run_pipeline
+from palm_interpretation import get_palm_reading_interpretation
+from palm_signature import SignatureIndex, make_signature
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+
+# ワーカープロセスの設定（initializer で受け取る）
+_options = {}
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def iter_inputs(paths, file_list=None):
+    """指定されたファイル・ディレクトリ（再帰）・ファイル一覧から画像のパスを順に返す"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if allowed_file(name):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+    if file_list:
+        f = sys.stdin if file_list == '-' else open(file_list, encoding='utf-8')
+        with f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def load_done(output_path):
+    """既存の出力から解析済み（成功した）パスを集める（--resume 用）"""
+    done = set()
+    if not output_path or not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 中断時に書きかけになった行
+            if record.get('success'):
+                done.add(record.get('path'))
+    return done
+
+
+def _init_worker(options):
+    _options.update(options)
+    limit_mb = options.get('memory_limit')
+    if limit_mb and 'PALM_MEMORY_BUDGET_MB' not in os.environ:
+        # 上限の半分を画像の予算にして、大きな画像はデコード前に断る・帯状に縮小する
+        os.environ['PALM_MEMORY_BUDGET_MB'] = str(limit_mb // 2)
+    if limit_mb:
+        try:
+            import resource
+            limit = limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+
+def _visualization_paths(path):
+    base = os.path.splitext(os.path.basename(path))[0]
+    # 同名ファイルが別ディレクトリにあっても衝突しないようにパスのハッシュを付ける
+    suffix = content_key(os.path.abspath(path).encode())[:8]
+    return {kind: os.path.join(_options['visualize'], f'{base}-{suffix}-{kind}') for _, kind in RESULT_IMAGES}
+
+
+def analyze_path(path):
+    """ワーカーで1枚解析して出力する1行分の dict を返す（失敗も dict で返す）"""
+    started = time.perf_counter()
+    record = {'path': path}
+    try:
+        with open(path, 'rb') as f:
+            img_bytes = f.read()
+        pipeline = run_pipeline(img_bytes, max_pixels=_options.get('max_pixels', MAX_IMAGE_PIXELS))
+        if pipeline is None:
+            record.update(success=False, error='画像の読み込みに失敗しました')
+        else:
+            img, edges, lighting, analysis = pipeline
+            record.update(success=True, width=img.width, height=img.height, lighting=lighting, analysis=analysis,
+                          signature=make_signature(edges, analysis).hex())
+            if _options.get('index'):
+                record['key'] = content_key(img_bytes)
+            if _options.get('interpretations'):
+                record['interpretations'] = get_palm_reading_interpretation(analysis)
+            if _options.get('visualize'):
+                record['images'] = {}
+                for kind, base in _visualization_paths(path).items():
+                    data, meta = render_output(kind, img, edges, {'accept': 'image/webp'})
+                    out_path = f'{base}.{meta["format"]}'
+                    with open(out_path, 'wb') as f:
+                        f.write(data)
+                    record['images'][kind] = out_path
+    except MemoryError:
+        record.update(success=False, error='メモリ上限を超えました')
+    except Exception as e:
+        record.update(success=False, error=str(e))
+    record['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='手相解析をまとめて実行し、1枚1行のJSONで出力します')
+    parser.add_argument('paths', nargs='*', help='画像ファイルまたはディレクトリ（再帰的に探索）')
+    parser.add_argument('--file-list', help='画像パスを1行ずつ書いたファイル（- で標準入力）')
+    parser.add_argument('-o', '--output', help='出力先のJSONLファイル（省略時は標準出力）')
+    parser.add_argument('--resume', action='store_true', help='出力先に成功済みの画像は飛ばして追記する')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='並列数（既定: CPUコア数）')
+    parser.add_argument('--visualize', metavar='DIR', help='線の画像を描画してこのディレクトリに保存する（省略時は描画しない）')
+    parser.add_argument('--no-interpretations', action='store_true', help='解釈文を出力しない')
+    parser.add_argument('--memory-limit', type=int, metavar='MB', help='ワーカー1つあたりのメモリ上限')
+    parser.add_argument('--max-pixels', type=int, default=MAX_IMAGE_PIXELS, help='これを超える画素数の画像は読み込まない')
+    parser.add_argument('--index', metavar='FILE', help='署名を似た手のひらの索引ファイルに追記する（なければ作る。同じ画像は重ねない）')
+    parser.add_argument('--max-tasks-per-worker', type=int, default=500, help='この枚数ごとにワーカーを作り直す（メモリ断片化対策）')
+    args = parser.parse_args(argv)
+    if not args.paths and not args.file_list:
+        parser.error('画像ファイル・ディレクトリか --file-list を指定してください')
+    if args.resume and not args.output:
+        parser.error('--resume には --output が必要です')
+    if args.visualize:
+        os.makedirs(args.visualize, exist_ok=True)
+
+    done = load_done(args.output) if args.resume else set()
+    skipped = 0
+
+    def pending():
+        nonlocal skipped
+        for path in iter_inputs(args.paths, args.file_list):
+            if path in done:
+                skipped += 1
+                continue
+            yield path
+
+    options = {
+        'visualize': args.visualize,
+        'interpretations': not args.no_interpretations,
+        'memory_limit': args.memory_limit,
+        'max_pixels': args.max_pixels,
+        'index': bool(args.index),
+    }
+    # 索引への追記は親プロセスだけで行う
+    index = SignatureIndex(args.index) if args.index else None
+    out = open(args.output, 'a' if args.resume else 'w', encoding='utf-8') if args.output else sys.stdout
+    processed = failed = 0
+    started = time.perf_counter()
+    try:
+        with Pool(args.workers, initializer=_init_worker, initargs=(options,),
+                  maxtasksperchild=args.max_tasks_per_worker) as pool:
+            for record in pool.imap_unordered(analyze_path, pending(), chunksize=4):
+                if index is not None and record['success']:
+                    # 再実行・中断後のやり直しで同じ画像を重ねて加えない（サーバーと同じ add_unique）
+                    index.add_unique(bytes.fromhex(record.pop('key')), bytes.fromhex(record['signature']))
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+                processed += 1
+                if not record['success']:
+                    failed += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if index is not None:
+            index.close()
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed > 0 else 0
+    print(f'解析 {processed} 枚（失敗 {failed}・スキップ {skipped}）{elapsed:.1f}秒 {rate:.1f}枚/秒', file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
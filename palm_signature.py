@@ -0,0 +1,291 @@
+"""
+手のひらの特徴の署名と、似た手のひらを探す索引（app.pyとapi/analyze.pyで共有）
+署名は固定長17バイト: ゾーンごとの線の密度（analyze_line_characteristics のスコア、9バイト）
+                    + 手のひらの範囲の検出線を8x8に縮めたハッシュ（64ビット）
+似ているほど距離（ゾーンの差の合計 + ハッシュの異なるビット数 × HASH_WEIGHT）が小さい
+
+索引は追記だけのファイル（先頭の見出し + 32バイトの固定長レコードの配列）で、起動時に mmap で読む
+追加はファイルの末尾に書き足すだけで作り直しは要らず、他のプロセスが書き足した分も次の検索で見える
+検索は全件の距離を Pillow の画像演算でまとめて求めて候補を絞り、候補だけ正確な距離で並べる
+（numpy の配列演算も試したが、レコードが飛び飛びに並ぶため Pillow より速くならなかった）
+
+環境変数:
+  PALM_SIGNATURE_INDEX  索引ファイルのパス。指定すると解析した画像を索引に加え、似た手のひらを結果に入れる
+"""
+
+import heapq
+import mmap
+import os
+import re
+import struct
+import threading
+
+from PIL import Image
+
+from image_processing import LINE_ZONES
+
+SIGNATURE_ZONES = tuple(name for name, *_ in LINE_ZONES)
+# 検出線のハッシュの格子（HASH_SIZE x HASH_SIZE ビット）
+HASH_SIZE = 8
+HASH_BYTES = HASH_SIZE * HASH_SIZE // 8
+SIGNATURE_SIZE = len(SIGNATURE_ZONES) + HASH_BYTES
+# ハッシュの1ビットの違いをゾーンの差いくつ分に数えるか（ゾーンは0〜255、ハッシュは0〜64ビット）
+HASH_WEIGHT = 8
+# これ以下の距離なら同じ写真の再投稿とみなす（再圧縮・半分までの縮小では0〜8、ハッシュ1ビット分）
+DUPLICATE_DISTANCE = 12
+# 解析結果に入れる似た手のひらの数・問い合わせで返せる数の上限
+SIMILAR_COUNT = 5
+MAX_SIMILAR = 50
+
+# 索引ファイル: 見出し（識別子・レコード長・署名長）+ レコード（画像のキー8バイト・署名・余白）
+INDEX_MAGIC = b'PALMSIG\x01'
+KEY_SIZE = 8
+RECORD_SIZE = 32
+HEADER = struct.Struct(f'<8sII{RECORD_SIZE - 16}x')
+RECORD = struct.Struct(f'<{KEY_SIZE}s{SIGNATURE_SIZE}s{RECORD_SIZE - KEY_SIZE - SIGNATURE_SIZE}x')
+
+_POPCOUNT = [bin(i).count('1') for i in range(256)]
+
+
+class IndexFormatError(ValueError):
+    """索引ファイルの見出しがこの版のものと合わない"""
+
+
+def make_signature(edges, analysis):
+    """検出線（L、palm_bbox があれば手のひらの範囲）とゾーン別スコアから署名（bytes）を作る"""
+    zones = bytes(round(min(100, max(0, analysis.get(name, 0))) * 255 / 100) for name in SIGNATURE_ZONES)
+    bbox = edges.info.get('palm_bbox') or (0, 0, edges.width, edges.height)
+    cells = edges.crop(bbox).resize((HASH_SIZE, HASH_SIZE), Image.Resampling.BOX).tobytes()
+    mean = sum(cells) / len(cells)
+    bits = 0
+    for value in cells:
+        bits = bits << 1 | (value > mean)
+    return zones + bits.to_bytes(HASH_BYTES, 'big')
+
+
+def parse_signature(text):
+    """16進の署名を bytes にする（形式が違えば None）"""
+    try:
+        signature = bytes.fromhex(text or '')
+    except ValueError:
+        return None
+    return signature if len(signature) == SIGNATURE_SIZE else None
+
+
+def signature_distance(a, b):
+    zones = len(SIGNATURE_ZONES)
+    distance = sum(abs(x - y) for x, y in zip(a[:zones], b[:zones]))
+    return distance + HASH_WEIGHT * sum(_POPCOUNT[x ^ y] for x, y in zip(a[zones:], b[zones:]))
+
+
+def _column_luts(query):
+    """署名の各バイトについて、値 → そのバイトの距離 の point 用テーブル"""
+    zones = len(SIGNATURE_ZONES)
+    luts = [[abs(value - q) for value in range(256)] for q in query[:zones]]
+    luts += [[_POPCOUNT[value ^ q] * HASH_WEIGHT for value in range(256)] for q in query[zones:]]
+    return luts
+
+
+class SignatureIndex:
+    """
+    追記だけの署名の索引（ファイルを mmap で読み、追加は末尾に書き足す）
+    レコードの番号は追加した順（0から）
+    書きかけで終わった末尾のレコード（書き込み中に止まったもの）は、開くとき・追加の前に切り捨てる
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._map = None
+        self._count = 0
+        self._columns = None  # 検索用: 署名のバイトごとの行（1 x レコード数 の画像を縦に並べたもの）
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._file = os.fdopen(fd, 'r+b', buffering=0)
+        if os.fstat(fd).st_size == 0:
+            self._file.write(HEADER.pack(INDEX_MAGIC, RECORD_SIZE, SIGNATURE_SIZE))
+        self._file.seek(0)
+        magic, record_size, signature_size = HEADER.unpack(self._file.read(HEADER.size))
+        if (magic, record_size, signature_size) != (INDEX_MAGIC, RECORD_SIZE, SIGNATURE_SIZE):
+            self._file.close()
+            raise IndexFormatError(f'{path} は署名の索引ファイルではないか、形式の版が違います')
+        self._truncate_partial()
+        self._refresh()
+
+    def _refresh(self):
+        """ファイルが伸びていれば（自分・他のプロセスの追記）mmap し直す"""
+        size = os.fstat(self._file.fileno()).st_size
+        count = (size - HEADER.size) // RECORD_SIZE
+        if self._map is None or count != self._count:
+            # 前の mmap は検索中の配列が参照しているかもしれないので閉じずに手放す
+            self._map = mmap.mmap(self._file.fileno(), HEADER.size + count * RECORD_SIZE, access=mmap.ACCESS_READ)
+            self._count = count
+
+    def _truncate_partial(self):
+        """末尾の書きかけのレコードを切り捨てる（残すと以降の追記がレコードの境目からずれる）"""
+        fd = self._file.fileno()
+        size = os.fstat(fd).st_size
+        partial = (size - HEADER.size) % RECORD_SIZE
+        if partial:
+            os.ftruncate(fd, size - partial)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    def add(self, key, signature):
+        """署名を追加する（key は画像のキー、先頭 KEY_SIZE バイトを使う）。戻り値: レコードの番号"""
+        if len(signature) != SIGNATURE_SIZE:
+            raise ValueError('署名の長さが違います')
+        record = RECORD.pack(bytes(key[:KEY_SIZE]), bytes(signature))
+        with self._lock:
+            return self._append(record)
+
+    def add_unique(self, key, signature):
+        """
+        同じキーのレコードがなければ追加する（同じプロセスの中では確かめてから書くまでの間に割り込まれない）
+        戻り値: (レコードの番号, 追加したか)
+        """
+        if len(signature) != SIGNATURE_SIZE:
+            raise ValueError('署名の長さが違います')
+        key = bytes(key[:KEY_SIZE])
+        with self._lock:
+            self._refresh()
+            number = self._find_key(key)
+            if number is not None:
+                return number, False
+            return self._append(RECORD.pack(key, bytes(signature))), True
+
+    def _append(self, record):
+        self._truncate_partial()
+        self._refresh()
+        # O_APPEND の1回の書き込みなので、同時に追記する他のプロセスとレコードが混ざらない
+        self._file.write(record)
+        self._refresh()
+        return self._count - 1
+
+    def find_key(self, key):
+        """キーのレコードの番号（なければ None）。検索の上位だけでなく全件から探す"""
+        with self._lock:
+            self._refresh()
+            return self._find_key(bytes(key[:KEY_SIZE]))
+
+    def _find_key(self, key):
+        # mmap の find で探し、レコードの先頭（キーの位置）に揃っていない一致は飛ばす
+        end = HEADER.size + self._count * RECORD_SIZE
+        position = self._map.find(key, HEADER.size, end)
+        while position != -1:
+            offset = position - HEADER.size
+            if offset % RECORD_SIZE == 0:
+                return offset // RECORD_SIZE
+            position = self._map.find(key, position + 1, end)
+        return None
+
+    def entry(self, number):
+        """レコードの (キー, 署名)"""
+        with self._lock:
+            self._refresh()
+            if not 0 <= number < self._count:
+                raise IndexError(number)
+            return RECORD.unpack_from(self._map, HEADER.size + number * RECORD_SIZE)
+
+    def search(self, signature, k=SIMILAR_COUNT):
+        """距離の近い順に k 件。戻り値: [(距離, レコードの番号, キー)]"""
+        with self._lock:
+            self._refresh()
+            buffer, count = self._map, self._count
+            if not count or k <= 0:
+                return []
+            candidates = self._candidates(buffer, count, signature, k)
+        ranked = []
+        for number in candidates:
+            key, stored = RECORD.unpack_from(buffer, HEADER.size + number * RECORD_SIZE)
+            ranked.append((signature_distance(signature, stored), number, key))
+        return heapq.nsmallest(k, ranked)
+
+    def _candidates(self, buffer, count, signature, k):
+        """
+        レコードを画像として扱い、署名のバイトごとの距離を point のテーブルで求めて合計する
+        距離の合計の近い候補をヒストグラムで絞り、正確な距離はレコードから計算し直す
+        """
+        columns = self._columns_image(buffer, count)
+        distances = Image.new('L', (count, SIGNATURE_SIZE))
+        for row, lut in enumerate(_column_luts(signature)):
+            distances.paste(columns.crop((0, row, count, row + 1)).point(lut), (0, row))
+        # 縦に平均をとると1レコードの距離の平均（候補を絞るのに使うだけなので、丸めの誤差は問題にならない）
+        total = distances.convert('F').reduce((1, SIGNATURE_SIZE))
+        low, high = total.getextrema()
+        if high == low:
+            # どれも同じ距離
+            return range(min(count, k))
+        limit, seen = high, 0
+        for i, n in enumerate(total.histogram(extrema=(low, high))):
+            seen += n
+            if seen >= k:
+                limit = low + (high - low) * (i + 1) / 256
+                break
+        # limit 以下（L への変換の丸めで少し上も含む）を 0 にした画像の 0 の位置が候補
+        mask = total.point(lambda value: value - limit).convert('L').tobytes()
+        return [m.start() for m in re.finditer(b'\x00', mask)]
+
+    def _columns_image(self, buffer, count):
+        """署名のバイトを行にした画像（追加された分だけ転置して継ぎ足す）"""
+        cached = self._columns
+        done = cached.width if cached is not None else 0
+        if done == count:
+            return cached
+        tail = Image.frombuffer('L', (RECORD_SIZE, count - done), memoryview(buffer)[HEADER.size + done * RECORD_SIZE:],
+                                'raw', 'L', 0, 1)
+        tail = tail.crop((KEY_SIZE, 0, KEY_SIZE + SIGNATURE_SIZE, count - done)).transpose(Image.Transpose.TRANSPOSE)
+        if cached is None:
+            columns = tail
+        else:
+            columns = Image.new('L', (count, SIGNATURE_SIZE))
+            columns.paste(cached, (0, 0))
+            columns.paste(tail, (done, 0))
+        self._columns = columns
+        return columns
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def similar_entries(matches):
+    """search の結果をレスポンス用にする"""
+    return [{'key': key.hex(), 'distance': distance, 'entry': number} for distance, number, key in matches]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_signature_index():
+    """プロセス共通の索引（PALM_SIGNATURE_INDEX が未指定なら None）"""
+    global _index
+    path = os.environ.get('PALM_SIGNATURE_INDEX')
+    if not path:
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path:
+            _index = SignatureIndex(path)
+        return _index
+
+
+def index_signature(key, signature, k=SIMILAR_COUNT):
+    """
+    似た手のひらを探してから索引に加える（同じ画像がすでにあれば加えない）
+    key は画像のキー（analysis_cache.content_key の16進）。同じキーは検索の上位に入っていなくても全件から探す
+    戻り値: (似た手のひら, 再投稿とみなした元の画像のキー（なければ None))（索引を使わなければ (None, None)）
+    """
+    index = get_signature_index()
+    if index is None:
+        return None, None
+    raw_key = bytes.fromhex(key)[:KEY_SIZE]
+    matches = index.search(signature, k)
+    duplicate = next((match[2] for match in matches if match[0] <= DUPLICATE_DISTANCE), None)
+    _, added = index.add_unique(raw_key, signature)
+    if duplicate is None and not added:
+        # 同じ画像がすでにある（距離の近い別の画像で上位が埋まっていた）
+        duplicate = raw_key
+    return similar_entries(matches), duplicate.hex() if duplicate else None
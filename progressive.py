@@ -0,0 +1,119 @@
+"""
+段階的な解析結果（/api/analyze の progressive モード、app.pyとapi/analyze.pyで共有）
+1. preview: 縮小画像（PREVIEW_SIZE）で照明・ゾーンのスコアを先に返す（数十ミリ秒）
+2. result:  解析用の大きさでの解析結果（通常の /api/analyze と同じ内容）
+3. image:   描画・エンコードが終わった画像から1枚ずつ
+4. done
+照明が too_dark なら preview を受け取った時点でクライアントが接続を切れば、以降の段階は実行しない
+"""
+
+import json
+import time
+
+from image_processing import EDGE_TARGET_PIXELS, resize_if_needed
+from palm_analysis import (
+    IMAGE_MODES,
+    RESULT_IMAGES,
+    analyze_decoded,
+    cached_result,
+    compact_result,
+    data_url,
+    decode_image,
+    render_image,
+)
+from palm_interpretation import compact_interpretation, get_palm_reading_interpretation
+
+PREVIEW_SIZE = 256
+
+# 出力形式 → MIMEタイプ
+STREAM_MIME_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+
+def stream_format(value, accept=''):
+    """progressive の指定（1 / ndjson / sse）と Accept ヘッダから出力形式を決める（指定がなければ None）"""
+    value = (value or '').lower()
+    if value in ('', '0', 'false'):
+        return None
+    if value == 'sse' or 'text/event-stream' in (accept or ''):
+        return 'sse'
+    return 'ndjson'
+
+
+def encode_event(event, fmt):
+    """1件分のイベントを NDJSON の1行、または Server-Sent Events の1件にする"""
+    data = json.dumps(event, ensure_ascii=False)
+    if fmt == 'sse':
+        return f'event: {event["phase"]}\ndata: {data}\n\n'.encode('utf-8')
+    return (data + '\n').encode('utf-8')
+
+
+def _interpretations(analysis, interpretations):
+    if interpretations == 'compact':
+        return compact_interpretation(analysis)
+    return get_palm_reading_interpretation(analysis)
+
+
+def iter_progressive(img_bytes, image_mode='inline', output=None, interpretations='full', deadline=None):
+    """
+    段階ごとのイベント（dict、phase に段階名）を順に返す
+    画像は url モードと同じく描画用に保持し、inline なら image イベントで data URL を、url ならURLを result で返す
+    deadline（deadline.Deadline）を渡すと、通常の解析と同じく時間の予算に合わせて品質を下げる
+    （画像は image イベントの前に残り時間を確かめ、軽い設定でエンコードする・省く）。達成した品質は done の quality
+    """
+    if image_mode not in IMAGE_MODES:
+        image_mode = 'inline'
+    started = time.perf_counter()
+
+    def elapsed():
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    img = decode_image(img_bytes)
+    if img is None:
+        yield {'phase': 'error', 'error': '画像の読み込みに失敗しました'}
+        return
+
+    # 1. 縮小画像での速報（線の画素数の目標は面積に合わせて縮める）
+    preview = resize_if_needed(img, PREVIEW_SIZE)
+    ratio = preview.width * preview.height / (img.width * img.height)
+    _, lighting, analysis = analyze_decoded(preview, max(1, round(EDGE_TARGET_PIXELS * ratio)))
+    yield {
+        'phase': 'preview',
+        'lighting': lighting,
+        'analysis': analysis,
+        'interpretations': _interpretations(analysis, interpretations),
+        'elapsed_ms': elapsed(),
+    }
+
+    # 2. 解析用の大きさでの結果（通常の解析とキャッシュを共有する）
+    cached_mode = image_mode if image_mode in ('none', 'vector') else 'url'
+    # 計算は通常の解析と同じ（似た手のひらの索引への追加・品質を下げた結果を使い回さないのも同じ）
+    result = cached_result(img_bytes, cached_mode, output, deadline, img)[0]
+    token = result.get('image_token')
+    if interpretations == 'compact':
+        result = compact_result(result)
+    if image_mode == 'inline':
+        # 画像は後の image イベントで埋め込むのでURLは返さない
+        image_fields = {field for field, _ in RESULT_IMAGES} | {'image_token', 'lines_svg'}
+        result = {name: value for name, value in result.items() if name not in image_fields}
+    yield {**result, 'phase': 'result', 'elapsed_ms': elapsed()}
+
+    # 3. 画像（描画・エンコードが終わった順）
+    if image_mode == 'inline' and deadline is not None:
+        # 解析用に縮めた大きさは分からないので、読み込んだ画像の画素数で見積もる（多めになる）
+        image_mode, output = deadline.plan_output(img.width * img.height, image_mode, output)
+    if image_mode == 'inline':
+        for field, kind in RESULT_IMAGES:
+            rendered = render_image(token, kind, output)
+            if rendered is None:
+                yield {'phase': 'error', 'field': field, 'error': '画像の有効期限が切れています。もう一度解析してください'}
+                continue
+            data, meta = rendered
+            yield {'phase': 'image', 'field': field, 'data': data_url(data, meta), 'meta': meta,
+                   'elapsed_ms': elapsed()}
+    done = {'phase': 'done', 'elapsed_ms': elapsed()}
+    if deadline is not None:
+        done['quality'] = deadline.report()
+    yield done
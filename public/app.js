@@ -13,6 +13,7 @@ const loadingSpinner = document.getElementById('loadingSpinner');
 const resultsSection = document.getElementById('resultsSection');
 const edgesImage = document.getElementById('edgesImage');
 const vizImage = document.getElementById('vizImage');
+const linesOverlay = document.getElementById('linesOverlay');
 const interpretationsList = document.getElementById('interpretationsList');
 const newAnalysisBtn = document.getElementById('newAnalysisBtn');
 const cameraBtn = document.getElementById('cameraBtn');
@@ -24,6 +25,10 @@ const captureBtn = document.getElementById('captureBtn');
 
 let currentImageData = null;
 let cameraStream = null;
+// カメラの連写（data URL の配列）。解析時にサーバーが一番よいフレームを選ぶ
+let currentBurst = null;
+const BURST_FRAMES = 4;
+const BURST_INTERVAL_MS = 120;
 
 // ドラッグ＆ドロップ
 uploadArea.addEventListener('click', () => fileInput.click());
@@ -57,6 +62,7 @@ function handleFile(file) {
     const reader = new FileReader();
     reader.onload = (e) => {
         currentImageData = e.target.result;
+        currentBurst = null;
         showPreview(currentImageData);
     };
     reader.readAsDataURL(file);
@@ -90,26 +96,9 @@ analyzeBtn.addEventListener('click', async () => {
     analyzeBtn.disabled = true;
     
     try {
-        const formData = new FormData();
-        if (currentImageData.startsWith('data:')) {
-            formData.append('image_data', currentImageData);
-        } else {
-            const blob = await fetch(currentImageData).then(r => r.blob());
-            formData.append('image', blob);
-        }
-        
-        const response = await fetch('/api/analyze', {
-            method: 'POST',
-            body: formData
-        });
-        
-        const data = await response.json();
-        
-        if (!response.ok) {
-            throw new Error(data.error || '解析に失敗しました');
-        }
-        
-        showResults(data);
+        // 画像はURLで受け取り、表示するときに取得する
+        const data = currentBurst ? await requestBurstAnalysis() : await requestProgressiveAnalysis();
+        if (data) showResults(await expandInterpretations(data));
     } catch (err) {
         alert(err.message || '解析中にエラーが発生しました。');
     } finally {
@@ -119,6 +108,151 @@ analyzeBtn.addEventListener('click', async () => {
     }
 });
 
+async function buildAnalysisForm(imagesMode, interpretationsMode) {
+    const formData = new FormData();
+    formData.append('images', imagesMode);
+    formData.append('interpretations', interpretationsMode);
+    if (currentImageData.startsWith('data:')) {
+        formData.append('image_data', currentImageData);
+    } else {
+        const blob = await fetch(currentImageData).then(r => r.blob());
+        formData.append('image', blob);
+    }
+    return formData;
+}
+
+async function requestAnalysis(imagesMode, interpretationsMode = 'compact') {
+    const formData = await buildAnalysisForm(imagesMode, interpretationsMode);
+    
+    const response = await fetch('/api/analyze', {
+        method: 'POST',
+        body: formData
+    });
+    
+    const data = await response.json();
+    
+    if (!response.ok) {
+        throw new Error(data.error || '解析に失敗しました');
+    }
+    return data;
+}
+
+// 段階的な解析: 縮小画像での速報（照明）を先に受け取り、照明が不足していれば続けるか確認する
+// 続けない場合は接続を切り、サーバー側の本解析・描画を省く（戻り値 null）
+async function requestProgressiveAnalysis() {
+    const formData = await buildAnalysisForm('url', 'compact');
+    formData.append('progressive', '1');
+    const controller = new AbortController();
+    const response = await fetch('/api/analyze', {
+        method: 'POST',
+        body: formData,
+        signal: controller.signal
+    });
+    if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.error || '解析に失敗しました');
+    }
+    if (!response.body) return requestAnalysis('url');
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+            const event = JSON.parse(line);
+            if (event.phase === 'error') throw new Error(event.error || '解析に失敗しました');
+            if (event.phase === 'preview' && event.lighting && event.lighting.status === 'too_dark'
+                && !confirm(`${event.lighting.message}\n\nこのまま解析を続けますか？`)) {
+                controller.abort();
+                return null;
+            }
+            if (event.phase === 'result') {
+                reader.cancel().catch(() => {});
+                return event;
+            }
+        }
+    }
+    throw new Error('解析に失敗しました');
+}
+
+// 連写の解析: サーバーが縮小画像でフレームを採点し、一番よいフレームだけを解析する
+async function requestBurstAnalysis() {
+    const formData = new FormData();
+    formData.append('burst', '1');
+    formData.append('images', 'url');
+    formData.append('interpretations', 'compact');
+    currentBurst.forEach((frame) => formData.append('image_data', frame));
+
+    const response = await fetch('/api/analyze', {
+        method: 'POST',
+        body: formData
+    });
+    const data = await response.json();
+    if (!response.ok) {
+        throw new Error(data.error || '解析に失敗しました');
+    }
+    // 選ばれたフレームをプレビューにし、以降の取り直しはそのフレームで行う
+    currentImageData = currentBurst[data.burst.best];
+    currentBurst = null;
+    previewImage.src = currentImageData;
+    return data;
+}
+
+// 解釈カタログ（バージョンごとに Service Worker がキャッシュする）
+const catalogs = {};
+
+async function loadCatalog(version) {
+    if (!catalogs[version]) {
+        catalogs[version] = fetch(`/api/analyze?catalog=${encodeURIComponent(version)}`)
+            .then((r) => (r.ok ? r.json() : null))
+            .catch(() => null);
+    }
+    const catalog = await catalogs[version];
+    if (!catalog || catalog.version !== version) {
+        delete catalogs[version];
+        return null;
+    }
+    return catalog;
+}
+
+// [線の番号, 段階, スコア] の解析結果をカタログの文章で展開する（カタログが使えなければ文章付きで取り直す）
+async function expandInterpretations(data) {
+    if (!data.catalog_version) return data;
+    const catalog = await loadCatalog(data.catalog_version);
+    if (!catalog) return requestAnalysis('url', 'full');
+    const interpretations = data.interpretations.map(([index, band, score]) => {
+        const line = catalog.lines[index];
+        return { line: line.line, category: line.category, reading: line.readings[band], score };
+    });
+    return { ...data, interpretations, categories: catalog.categories };
+}
+
+// 画像URLが取得できない場合（有効期限切れ・別インスタンス）は画像を埋め込んだ結果を取り直す
+let inlineImagesRequested = false;
+
+function handleResultImageError() {
+    if (inlineImagesRequested || !currentImageData) return;
+    inlineImagesRequested = true;
+    requestAnalysis('inline')
+        .then((data) => {
+            edgesImage.src = data.edges_image;
+            vizImage.src = data.visualization;
+            linesOverlay.classList.add('hidden');
+        })
+        .catch(() => {});
+}
+
+edgesImage.addEventListener('error', handleResultImageError);
+vizImage.addEventListener('error', handleResultImageError);
+linesOverlay.addEventListener('error', handleResultImageError);
+
 let currentInterpretations = [];
 let currentCategories = [];
 
@@ -162,8 +296,17 @@ const LIGHTING_LABELS = {
 };
 
 function showResults(data) {
+    inlineImagesRequested = false;
     edgesImage.src = data.edges_image;
-    vizImage.src = data.visualization;
+    if (data.lines_svg) {
+        // 手元の写真に検出線（SVG）を重ねる（サーバーでの合成・エンコードを省く）
+        vizImage.src = currentImageData;
+        linesOverlay.src = data.lines_svg;
+        linesOverlay.classList.remove('hidden');
+    } else {
+        vizImage.src = data.visualization;
+        linesOverlay.classList.add('hidden');
+    }
     
     const lightingEl = document.getElementById('lightingStatus');
     if (lightingEl && data.lighting) {
@@ -245,13 +388,23 @@ closeCameraBtn.addEventListener('click', () => {
     cameraModal.setAttribute('aria-hidden', 'true');
 });
 
-captureBtn.addEventListener('click', () => {
+captureBtn.addEventListener('click', async () => {
     const ctx = cameraCanvas.getContext('2d');
     cameraCanvas.width = cameraVideo.videoWidth;
     cameraCanvas.height = cameraVideo.videoHeight;
-    ctx.drawImage(cameraVideo, 0, 0);
-    
-    currentImageData = cameraCanvas.toDataURL('image/jpeg', 0.9);
+    captureBtn.disabled = true;
+
+    // 少し間隔をあけて数枚撮り、ぶれ・照明の採点はサーバーに任せる
+    const frames = [];
+    for (let i = 0; i < BURST_FRAMES; i++) {
+        if (i > 0) await new Promise((resolve) => setTimeout(resolve, BURST_INTERVAL_MS));
+        ctx.drawImage(cameraVideo, 0, 0);
+        frames.push(cameraCanvas.toDataURL('image/jpeg', 0.9));
+    }
+    captureBtn.disabled = false;
+
+    currentBurst = frames;
+    currentImageData = frames[0];
     stopCamera();
     cameraModal.classList.remove('active');
     cameraModal.setAttribute('aria-hidden', 'true');
@@ -2,12 +2,17 @@
  * 手相解析アプリ - Service Worker
  * オフライン対応・PWAインストール用
  */
-const CACHE_NAME = 'palm-reading-v3';
+// CACHE_NAME と urlsToCache は static_assets.py が public/ のファイルから作る（npm run build・python static_assets.py で更新）
+const CACHE_NAME = 'palm-reading-34fe039555';
+// 解釈カタログ（/api/analyze?catalog=バージョン）。バージョンごとに内容が変わらないので長く保持する
+const CATALOG_CACHE_NAME = 'palm-reading-catalog';
 const urlsToCache = [
   '/',
-  '/styles.css',
   '/app.js',
-  '/manifest.json'
+  '/icon-192.png',
+  '/icon-512.png',
+  '/manifest.json',
+  '/styles.css'
 ];
 
 self.addEventListener('install', (event) => {
@@ -23,14 +28,36 @@ self.addEventListener('activate', (event) => {
   event.waitUntil(
     caches.keys().then((names) => {
       return Promise.all(
-        names.filter((name) => name !== CACHE_NAME).map((name) => caches.delete(name))
+        names.filter((name) => name !== CACHE_NAME && name !== CATALOG_CACHE_NAME).map((name) => caches.delete(name))
       );
     }).then(() => self.clients.claim())
   );
 });
 
+// カタログはバージョン付きURLなのでキャッシュ優先（古いバージョンは消す）
+function fetchCatalog(request) {
+  return caches.open(CATALOG_CACHE_NAME).then((cache) =>
+    cache.match(request).then((cached) => {
+      if (cached) return cached;
+      return fetch(request).then((response) => {
+        if (response.ok) {
+          cache.keys()
+            .then((keys) => Promise.all(keys.filter((key) => key.url !== request.url).map((key) => cache.delete(key))))
+            .then(() => cache.put(request, response.clone()));
+        }
+        return response;
+      });
+    })
+  );
+}
+
 self.addEventListener('fetch', (event) => {
   if (event.request.method !== 'GET') return;
+  const url = new URL(event.request.url);
+  if (url.pathname === '/api/analyze' && url.searchParams.has('catalog')) {
+    event.respondWith(fetchCatalog(event.request));
+    return;
+  }
   if (event.request.url.includes('/api/')) return;
   
   event.respondWith(
@@ -0,0 +1,108 @@
+"""
+解析画像の遅延レンダリング（app.pyとapi/analyze.pyで共有）
+解析時は元画像と検出線だけを短時間保持し、クライアントが画像URLを取得した時点で初めて描画・エンコードする
+文章の解析結果だけを表示するクライアントは画像のレンダリングコストを払わない
+
+環境変数:
+  PALM_RENDER_STORE_SIZE  保持する解析の件数
+  PALM_RENDER_STORE_TTL   画像URLの有効期間（秒）
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from image_output import RENDERERS, output_key, render_output
+
+DEFAULT_MAX_ENTRIES = 16
+DEFAULT_TTL = 120
+
+
+def image_url(token, kind, options=None):
+    """
+    画像取得用のURL（app.py・api/analyze.py 共通で GET /api/analyze が応答する）
+    明示された出力設定はURLに含め、それ以外は取得時の Accept ヘッダで決める
+    """
+    options = options or {}
+    query = {'image': token, 'kind': kind}
+    for name in ('format', 'quality', 'max_size'):
+        if options.get(name):
+            query[f'image_{name}'] = options[name]
+    return f'/api/analyze?{urlencode(query)}'
+
+
+class RenderStore:
+    """
+    トークン → (元画像, 検出線, 描画済み画像) を LRU + TTL で保持する
+    取得されたトークンは新しい側に移し、件数の上限を超えたら一番長く使われていないものから捨てる
+    元画像と検出線は、別の出力設定（Accept・image_format など）での取得に備えて TTL の間保持する
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, img, edges):
+        """画像を登録してトークンを返す"""
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            self._entries[token] = {'created': time.time(), 'img': img, 'edges': edges, 'rendered': {}}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return token
+
+    def _get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        if time.time() - entry['created'] >= self.ttl:
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return entry
+
+    def has(self, token):
+        with self._lock:
+            return self._get(token) is not None
+
+    def render(self, token, kind, options=None):
+        """
+        画像を描画・エンコードする（同じ出力設定の2回目以降は保存済みのものを返す）
+        戻り値: (バイト列, メタ情報)（トークン切れ・不明な種類は None）
+        """
+        if kind not in RENDERERS:
+            return None
+        key = output_key(kind, options)
+        with self._lock:
+            entry = self._get(token)
+            if entry is None:
+                return None
+            rendered = entry['rendered'].get(key)
+            img, edges = entry['img'], entry['edges']
+        if rendered is not None:
+            return rendered
+        rendered = render_output(kind, img, edges, options)
+        with self._lock:
+            entry['rendered'][key] = rendered
+        return rendered
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_render_store():
+    """環境変数の設定でプロセス共通のストアを作成して返す"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RenderStore(
+                max_entries=int(os.environ.get('PALM_RENDER_STORE_SIZE', DEFAULT_MAX_ENTRIES)),
+                ttl=float(os.environ.get('PALM_RENDER_STORE_TTL', DEFAULT_TTL)),
+            )
+        return _store
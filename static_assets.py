@@ -0,0 +1,258 @@
+"""
+静的ファイル（public/）の配信（app.py）
+起動時に全ファイルを読み込み、内容のハッシュ（フィンガープリント）と gzip / brotli で圧縮したものを作っておく
+
+- index.html・manifest.json の中の他のファイルへの参照は /app.js?v=<ハッシュ> のように書き換える
+  v が現在のハッシュと一致するリクエストには長期キャッシュ（immutable）を許し、それ以外は ETag で再検証させる
+- Accept-Encoding に応じて圧縮済みのもの（br > gzip）を返し、表現ごとの強い ETag で 304 を返す
+- sw.js の CACHE_NAME と urlsToCache は配信時に現在のファイルから作る
+  （python static_assets.py で public/sw.js にも書き込む。Vercel 版はこのファイルをそのまま配信する）
+
+brotli は brotli パッケージが読み込めるときだけ使う（なければ gzip のみ）
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public')
+SERVICE_WORKER = 'sw.js'
+# URLが固定のファイル（フィンガープリントを付けられないので、常に再検証させる）
+FIXED_URL_FILES = ('index.html', SERVICE_WORKER)
+# 他のファイルへの参照を書き換えるもの（参照される側のハッシュが先に決まるように最後にこの順で処理する）
+REFERRING_FILES = ('manifest.json', 'index.html')
+# Service Worker のキャッシュ名の接頭辞（後ろに全ファイルのハッシュを付ける）
+CACHE_NAME_PREFIX = 'palm-reading-'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+FINGERPRINT_LENGTH = 10
+# これより小さいファイルは圧縮しない（ヘッダの分で得にならない）
+MIN_COMPRESS_SIZE = 256
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/manifest+json',
+                      'image/svg+xml')
+# 選ぶ順（ブラウザが両方受け付けるなら小さい brotli）
+ENCODINGS = ('br', 'gzip')
+_ETAG_SUFFIX = {'br': '.br', 'gzip': '.gz'}
+
+_MIME_OVERRIDES = {'manifest.json': 'application/manifest+json', SERVICE_WORKER: 'application/javascript'}
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 で同じ内容からは同じバイト列（ETag を変えない）
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11)
+    return None
+
+
+def mime_type(name):
+    mime = _MIME_OVERRIDES.get(name) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if mime.startswith('text/') or mime in ('application/javascript', 'application/json', 'application/manifest+json'):
+        mime += '; charset=utf-8'
+    return mime
+
+
+def parse_accept_encoding(header):
+    """Accept-Encoding から受け付ける圧縮形式の集合（q=0 は除く、* は br・gzip を含む）"""
+    accepted, refused = set(), set()
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        (accepted if q > 0 else refused).add(token)
+    if '*' in accepted:
+        accepted.update(encoding for encoding in ENCODINGS if encoding not in refused)
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match に etag が含まれるか（弱い比較: W/ は無視する）"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+def rewrite_references(text, urls):
+    """"/name" や "/name?v=古い値" の参照を現在のフィンガープリント付きのURLに書き換える"""
+    for name, url in urls.items():
+        text = re.sub(rf'(["\'(])/{re.escape(name)}(?:\?v=[^"\')]*)?(?=["\')])', rf'\g<1>{url}', text)
+    return text
+
+
+def render_service_worker(source, cache_name, urls):
+    """sw.js の CACHE_NAME と urlsToCache を書き換える"""
+    source = re.sub(r"const CACHE_NAME = '[^']*';", f"const CACHE_NAME = '{cache_name}';", source, count=1)
+    listing = ',\n'.join(f"  '{url}'" for url in urls)
+    return re.sub(r'const urlsToCache = \[[^\]]*\];', lambda _: f'const urlsToCache = [\n{listing}\n];',
+                  source, count=1)
+
+
+class Asset:
+    """配信する1ファイル（本文・フィンガープリント・圧縮したもの）"""
+
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+        self.mime = mime_type(name)
+        self.digest = fingerprint(body)
+        self.encoded = {}
+        if len(body) >= MIN_COMPRESS_SIZE and self.mime.startswith(COMPRESSIBLE_TYPES):
+            for encoding in ENCODINGS:
+                data = compress(body, encoding)
+                if data is not None and len(data) < len(body):
+                    self.encoded[encoding] = data
+
+    def etag(self, encoding=None):
+        return f'"{self.digest}{_ETAG_SUFFIX.get(encoding, "")}"'
+
+    def select(self, accept_encoding):
+        """Accept-Encoding に合う表現。戻り値: (圧縮形式（なしは None）, 本文)"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in accepted and encoding in self.encoded:
+                return encoding, self.encoded[encoding]
+        return None, self.body
+
+
+class StaticAssets:
+    """public/ の全ファイル（起動時に読み込んで、フィンガープリントを付け、圧縮しておく）"""
+
+    def __init__(self, root=PUBLIC_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._load()
+
+    def _scan(self):
+        files = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                files[os.path.relpath(path, self.root).replace(os.sep, '/')] = path
+        return files
+
+    def _load(self):
+        files = self._scan()
+        self.mtimes = {name: os.stat(path).st_mtime_ns for name, path in files.items()}
+        sources = {}
+        for name, path in files.items():
+            with open(path, 'rb') as f:
+                sources[name] = f.read()
+
+        assets, urls = {}, {}
+        ordered = [name for name in sorted(sources) if name not in REFERRING_FILES and name != SERVICE_WORKER]
+        ordered += [name for name in REFERRING_FILES if name in sources]
+        for name in ordered:
+            body = sources[name]
+            if name in REFERRING_FILES:
+                body = rewrite_references(body.decode('utf-8'), urls).encode('utf-8')
+            asset = assets[name] = Asset(name, body)
+            if name not in FIXED_URL_FILES:
+                urls[name] = f'/{name}?v={asset.digest}'
+
+        # キャッシュ名は Service Worker 以外の全ファイルの内容から決める（どれかが変われば古いキャッシュを消す）
+        self.version = fingerprint(''.join(f'{name}:{assets[name].digest}' for name in sorted(assets)).encode())
+        self.cache_name = CACHE_NAME_PREFIX + self.version
+        self.urls = urls
+        if SERVICE_WORKER in sources:
+            worker = render_service_worker(sources[SERVICE_WORKER].decode('utf-8'), self.cache_name,
+                                           ['/'] + [urls[name] for name in sorted(urls)])
+            assets[SERVICE_WORKER] = Asset(SERVICE_WORKER, worker.encode('utf-8'))
+        self.assets = assets
+
+    def reload_if_changed(self):
+        """ファイルが追加・変更・削除されていれば読み込み直す（開発時用）"""
+        current = {name: os.stat(path).st_mtime_ns for name, path in self._scan().items()}
+        if current != self.mtimes:
+            with self._lock:
+                self._load()
+
+    def response(self, name, version=None, accept_encoding='', if_none_match=''):
+        """
+        name のレスポンス内容（catalog_response と同じ形）
+        戻り値: (ステータス, 本文, ヘッダ)。ない名前は (404, b'', {})
+        """
+        asset = self.assets.get(name)
+        if asset is None:
+            return 404, b'', {}
+        encoding, body = asset.select(accept_encoding)
+        immutable = name not in FIXED_URL_FILES and version == asset.digest
+        headers = {
+            'ETag': asset.etag(encoding),
+            'Cache-Control': IMMUTABLE if immutable else REVALIDATE,
+            'Vary': 'Accept-Encoding',
+        }
+        if name == SERVICE_WORKER:
+            headers['Service-Worker-Allowed'] = '/'
+        if etag_matches(if_none_match, headers['ETag']):
+            return 304, b'', headers
+        headers['Content-Type'] = asset.mime
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return 200, body, headers
+
+
+_assets = None
+_assets_lock = threading.Lock()
+
+
+def get_static_assets(reload=False):
+    """プロセス共通の静的ファイル（reload=True ならファイルの変更を確かめて読み込み直す）"""
+    global _assets
+    with _assets_lock:
+        if _assets is None:
+            _assets = StaticAssets()
+    if reload:
+        _assets.reload_if_changed()
+    return _assets
+
+
+def write_service_worker(root=PUBLIC_DIR):
+    """
+    public/sw.js の CACHE_NAME を現在のファイルの内容から決めたものに書き換える（変わらなければ書かない）
+    Vercel 版は index.html をそのまま配信するので、urlsToCache はフィンガープリントのないURLのままにする
+    戻り値: 書き換えたか
+    """
+    assets = StaticAssets(root)
+    path = os.path.join(root, SERVICE_WORKER)
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    urls = ['/'] + [f'/{name}' for name in sorted(assets.urls)]
+    updated = render_service_worker(source, assets.cache_name, urls)
+    if updated == source:
+        return False
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(updated)
+    return True
+
+
+if __name__ == '__main__':
+    changed = write_service_worker()
+    print(f'{SERVICE_WORKER}: {"更新しました" if changed else "変更なし"}（{StaticAssets().cache_name}）', file=sys.stderr)
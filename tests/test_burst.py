@@ -0,0 +1,48 @@
+"""連写から解析に使うフレームを選ぶ（ぶれ・照明で順位が決まること）"""
+
+from PIL import ImageEnhance, ImageFilter
+
+from benchmarks.synthetic import encode_upload, make_palm_image
+from burst import analyze_burst, rank_frames
+
+
+def frames_of(*images):
+    return [(f'image[{i}]', encode_upload(img), None) for i, img in enumerate(images)]
+
+
+def test_sharp_frame_ranks_above_blurred():
+    sharp = make_palm_image(0.2, 'normal', 31)
+    blurred = sharp.filter(ImageFilter.GaussianBlur(4))
+
+    ranking = rank_frames(frames_of(blurred, sharp))
+
+    assert [entry['index'] for entry in ranking] == [1, 0]
+    assert ranking[0]['sharpness'] > ranking[1]['sharpness']
+
+
+def test_dark_and_broken_frames_rank_last():
+    img = make_palm_image(0.2, 'normal', 32)
+    dark = ImageEnhance.Brightness(img).enhance(0.08)
+    frames = frames_of(dark, img) + [('image[2]', b'broken', None), ('image[3]', None, '画像が送信されていません')]
+
+    ranking = rank_frames(frames)
+
+    assert [entry['index'] for entry in ranking] == [1, 0, 2, 3]
+    assert ranking[1]['lighting']['status'] == 'too_dark'
+    assert ranking[2]['error'] == '画像の読み込みに失敗しました'
+    assert 'score' not in ranking[3]
+
+
+def test_analyze_burst_uses_best_frame():
+    sharp = make_palm_image(0.2, 'normal', 33)
+    frames = frames_of(sharp.filter(ImageFilter.GaussianBlur(4)), sharp)
+
+    result, err = analyze_burst(frames, 'none')
+
+    assert err is None
+    assert result['burst']['best'] == 1
+    assert len(result['burst']['frames']) == 2
+
+
+def test_analyze_burst_without_readable_frames():
+    assert analyze_burst([('image[0]', b'broken', None)], 'none') == (None, '画像の読み込みに失敗しました')
@@ -0,0 +1,26 @@
+"""実装の選び方（auto だけが pillow に切り替わる）"""
+
+import builtins
+
+import pytest
+
+from compute_backend import PillowBackend, create_backend
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_backend('cuda')
+
+
+def test_only_auto_falls_back_without_numpy(monkeypatch):
+    real_import = builtins.__import__
+
+    def without_numpy(name, *args, **kwargs):
+        if name == 'numpy':
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', without_numpy)
+    assert isinstance(create_backend('auto'), PillowBackend)
+    with pytest.raises(ImportError):
+        create_backend('numpy')
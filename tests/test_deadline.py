@@ -0,0 +1,110 @@
+"""時間の予算と品質の段階的な引き下げ"""
+
+import pytest
+
+import deadline as deadline_module
+from benchmarks.synthetic import encode_upload, make_palm_image
+from deadline import (
+    DEGRADED_WORKING_SIZE,
+    FAST_OUTPUT_MAX_SIZE,
+    REDUCED_BLUR_RADII,
+    SAFETY_FACTOR,
+    Deadline,
+    analysis_passes,
+    estimate,
+    record_cost,
+    request_deadline,
+    reset_costs,
+)
+from image_processing import BLUR_RADII
+from palm_analysis import analyze_image_bytes
+
+SIZE = (1000, 1000)
+PIXELS = SIZE[0] * SIZE[1]
+
+
+@pytest.fixture(autouse=True)
+def default_costs():
+    # 解析のたびに見積もりが実測で更新されるので、テストごとに初期値へ戻す
+    reset_costs()
+    yield
+    reset_costs()
+
+
+def fast_reserve():
+    return estimate('output', FAST_OUTPUT_MAX_SIZE * FAST_OUTPUT_MAX_SIZE)
+
+
+def budget_for(seconds):
+    """見積もり seconds がちょうど収まる予算（ミリ秒）"""
+    return seconds * SAFETY_FACTOR * 1000 * 1.05
+
+
+def test_unlimited_keeps_full_quality():
+    deadline = Deadline()
+
+    assert deadline.plan_analysis(SIZE) == (None, BLUR_RADII)
+    assert deadline.plan_output(PIXELS, 'inline') == ('inline', None)
+    assert deadline.report()['level'] == 'full'
+
+
+def test_reduced_search_when_full_search_does_not_fit():
+    reduced = estimate('analysis', PIXELS, analysis_passes(REDUCED_BLUR_RADII)) + fast_reserve()
+    deadline = Deadline(budget_for(reduced))
+
+    assert deadline.plan_analysis(SIZE) == (None, REDUCED_BLUR_RADII)
+    assert deadline.level == 'reduced_search'
+
+
+def test_levels_degrade_in_order():
+    deadline = Deadline(1)
+
+    assert deadline.plan_analysis(SIZE) == (DEGRADED_WORKING_SIZE, REDUCED_BLUR_RADII)
+    assert deadline.plan_output(PIXELS, 'inline') == ('none', None)
+    report = deadline.report()
+    assert report['level'] == 'no_images'
+    assert report['degraded'] == ['reduced_search', 'reduced_resolution', 'no_images']
+    assert report['budget_ms'] == 1
+
+
+def test_fast_encoding_when_only_small_output_fits():
+    deadline = Deadline(budget_for(fast_reserve()))
+
+    image_mode, output = deadline.plan_output(PIXELS, 'inline', {'quality': 90})
+
+    assert image_mode == 'inline'
+    assert output['max_size'] == FAST_OUTPUT_MAX_SIZE
+    assert output['quality'] == deadline_module.FAST_OUTPUT_QUALITY
+    assert deadline.level == 'fast_encoding'
+
+
+def test_request_deadline_only_shortens_budget(monkeypatch):
+    monkeypatch.setenv('PALM_DEADLINE_MS', '5000')
+    assert request_deadline('200').budget_ms == 200
+    assert request_deadline('90000').budget_ms == 5000
+    assert request_deadline('abc').budget_ms == 5000
+
+    monkeypatch.setenv('PALM_DEADLINE_MS', '0')
+    assert request_deadline().budget_ms is None
+    assert request_deadline('300').budget_ms == 300
+
+
+def test_reset_costs_restores_estimates():
+    initial = estimate('analysis', PIXELS)
+    record_cost('analysis', 10.0, PIXELS)
+    assert estimate('analysis', PIXELS) > initial
+
+    reset_costs()
+    assert estimate('analysis', PIXELS) == initial
+
+
+def test_degraded_result_is_not_served_from_cache():
+    upload = encode_upload(make_palm_image(0.3, 'normal', 21))
+
+    degraded, _ = analyze_image_bytes(upload, 'inline', deadline=Deadline(1))
+    full, _ = analyze_image_bytes(upload, 'inline', deadline=Deadline())
+
+    assert degraded['quality']['level'] == 'no_images'
+    assert 'visualization' not in degraded
+    assert full['quality']['level'] == 'full'
+    assert full['visualization'].startswith('data:')
@@ -0,0 +1,23 @@
+"""アップロードの読み込み（JPEG・PNG・WebP 以外の形式も受け付けること）"""
+
+import io
+
+import pytest
+from PIL import Image
+
+from image_processing import load_image
+
+
+@pytest.mark.parametrize('fmt', ['GIF', 'BMP', 'TIFF'])
+def test_other_formats_are_accepted(fmt):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), (200, 150, 120)).save(buffer, fmt)
+
+    img = load_image(memoryview(buffer.getvalue()))
+
+    assert img is not None
+    assert (img.mode, img.size) == ('RGB', (40, 30))
+
+
+def test_unknown_bytes_are_rejected():
+    assert load_image(b'not an image') is None
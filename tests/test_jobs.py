@@ -0,0 +1,27 @@
+"""解析ジョブの結果の保持期間（終わらないジョブがあっても後のジョブの結果は期限で消える）"""
+
+import threading
+
+import jobs
+from jobs import JobQueue
+
+
+def test_stuck_job_does_not_block_expiry(monkeypatch):
+    release = threading.Event()
+
+    def analyze(img_bytes, *args):
+        if img_bytes == b'stuck':
+            release.wait(5)
+        return {'success': True}, None
+
+    monkeypatch.setattr(jobs, 'analyze_image_bytes', analyze)
+    queue = JobQueue(workers=2, ttl=0)
+    stuck = queue.submit(b'stuck')
+    quick = queue.submit(b'quick')
+    assert quick.done.wait(5)
+
+    try:
+        assert queue.get(quick.id) is None
+        assert queue.get(stuck.id) is stuck
+    finally:
+        release.set()
@@ -0,0 +1,19 @@
+"""palm_cli.py を同じ画像で再実行しても索引に同じ画像が重ならないこと"""
+
+import palm_cli
+from benchmarks.synthetic import encode_upload, make_palm_image
+from palm_signature import SignatureIndex
+
+
+def test_rerun_does_not_duplicate_index(tmp_path):
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    for seed in range(2):
+        (photos / f'palm{seed}.jpg').write_bytes(encode_upload(make_palm_image(0.2, 'normal', seed)))
+    index = str(tmp_path / 'palms.sig')
+    argv = [str(photos), '-o', str(tmp_path / 'out.jsonl'), '--index', index, '--workers', '1']
+
+    assert palm_cli.main(argv) == 0
+    assert palm_cli.main(argv) == 0
+
+    assert len(SignatureIndex(index)) == 2
@@ -0,0 +1,41 @@
+"""progressive モードが通常の解析と同じく似た手のひらの索引に加わり、時間の予算で品質を下げること"""
+
+import io
+import json
+
+from app import app
+from benchmarks.synthetic import encode_upload, make_palm_image
+from palm_signature import SignatureIndex
+
+
+def test_progressive_request_grows_index(tmp_path, monkeypatch):
+    path = str(tmp_path / 'palms.sig')
+    monkeypatch.setenv('PALM_SIGNATURE_INDEX', path)
+    upload = encode_upload(make_palm_image(0.3, 'normal', 11))
+
+    response = app.test_client().post('/api/analyze', data={
+        'image': (io.BytesIO(upload), 'palm.jpg'),
+        'progressive': '1',
+        'images': 'none',
+    })
+    events = [json.loads(line) for line in response.get_data().splitlines() if line]
+
+    result = next(event for event in events if event['phase'] == 'result')
+    assert 'similar' in result and 'duplicate_of' in result
+    assert len(SignatureIndex(path)) == 1
+
+
+def test_progressive_request_degrades_with_deadline(monkeypatch):
+    monkeypatch.setenv('PALM_DEADLINE_MS', '1')
+    upload = encode_upload(make_palm_image(0.3, 'normal', 13))
+
+    response = app.test_client().post('/api/analyze', data={
+        'image': (io.BytesIO(upload), 'palm.jpg'),
+        'progressive': '1',
+    })
+    events = [json.loads(line) for line in response.get_data().splitlines() if line]
+
+    done = events[-1]
+    assert done['phase'] == 'done'
+    assert done['quality']['level'] == 'no_images'
+    assert not any(event['phase'] == 'image' for event in events)
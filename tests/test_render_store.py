@@ -0,0 +1,18 @@
+"""画像URLのストアが取得されたトークンを残すこと（LRU）"""
+
+from PIL import Image
+
+from render_store import RenderStore
+
+
+def test_lookup_keeps_recent_token():
+    store = RenderStore(max_entries=2)
+    img, edges = Image.new('RGB', (8, 8)), Image.new('L', (8, 8))
+    first = store.put(img, edges)
+    second = store.put(img, edges)
+
+    assert store.has(first)
+    store.put(img, edges)
+
+    assert store.has(first)
+    assert not store.has(second)
@@ -0,0 +1,73 @@
+"""手のひらの切り出し（肌色・輝度で範囲を決め、見つからなければ画像全体を使うこと）"""
+
+from PIL import Image, ImageDraw
+
+from benchmarks.synthetic import make_palm_image
+from image_processing import segment_palm
+from palm_analysis import analyze_decoded
+
+SIZE = (400, 300)
+HAND_BOX = (120, 60, 300, 260)
+
+
+def hand_on_background(hand, background):
+    img = Image.new('RGB', SIZE, background)
+    ImageDraw.Draw(img).ellipse(HAND_BOX, fill=hand)
+    return img
+
+
+def assert_covers_hand(bbox):
+    left, upper, right, lower = bbox
+    assert left <= HAND_BOX[0] and upper <= HAND_BOX[1]
+    assert right >= HAND_BOX[2] and lower >= HAND_BOX[3]
+    # 余白（縮小画像で数画素分）を除けば背景は含まない
+    assert left >= HAND_BOX[0] - 20 and right <= HAND_BOX[2] + 20
+
+
+def test_skin_colored_hand_is_cropped():
+    region = segment_palm(hand_on_background((224, 172, 140), (40, 90, 160)))
+
+    assert region.method == 'skin'
+    assert_covers_hand(region.bbox)
+    assert region.area_ratio < 0.5
+
+
+def test_luminance_fallback_for_non_skin_hand():
+    region = segment_palm(hand_on_background((230, 230, 230), (20, 20, 20)))
+
+    assert region.method == 'luminance'
+    assert_covers_hand(region.bbox)
+
+
+def test_uniform_image_uses_full_frame():
+    region = segment_palm(Image.new('RGB', SIZE, (128, 128, 128)))
+
+    assert region.is_full
+    assert region.bbox == (0, 0, *SIZE)
+    assert region.crop_mask(SIZE) is None
+
+
+def test_expand_restores_full_size_edges():
+    region = segment_palm(hand_on_background((224, 172, 140), (40, 90, 160)))
+    left, upper, right, lower = region.bbox
+    cropped = Image.new('L', (right - left, lower - upper), 255)
+
+    edges = region.expand(cropped)
+
+    assert edges.size == SIZE
+    assert edges.getbbox() == region.bbox
+    assert edges.info['palm_bbox'] == region.bbox
+    assert region.crop_mask(cropped.size).size == cropped.size
+
+
+def test_detected_lines_stay_inside_palm():
+    img = make_palm_image(0.3, 'normal', 1)
+
+    edges, _, _ = analyze_decoded(img)
+
+    bbox = edges.info['palm_bbox']
+    assert edges.size == img.size
+    assert edges.crop(bbox).getbbox() is not None
+    outside = Image.new('L', edges.size, 0)
+    outside.paste(edges.crop(bbox), bbox[:2])
+    assert edges.tobytes() == outside.tobytes()
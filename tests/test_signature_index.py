@@ -0,0 +1,29 @@
+"""似た手のひらの索引の追記（同じキーを重ねない・書きかけの末尾を切り捨てる）"""
+
+import os
+
+from palm_signature import HEADER, RECORD_SIZE, SIGNATURE_SIZE, SignatureIndex
+
+
+def test_add_unique_finds_key_outside_top_k(tmp_path):
+    index = SignatureIndex(str(tmp_path / 'palms.sig'))
+    index.add(b'original', bytes([200]) * SIGNATURE_SIZE)
+    for i in range(20):
+        index.add(i.to_bytes(8, 'big'), bytes(SIGNATURE_SIZE))
+
+    # 上位 k 件は別の画像で埋まるが、同じキーは全件から見つかる
+    assert all(key != b'original' for _, _, key in index.search(bytes(SIGNATURE_SIZE), 5))
+    assert index.add_unique(b'original', bytes(SIGNATURE_SIZE)) == (0, False)
+    assert len(index) == 21
+
+
+def test_partial_record_is_truncated(tmp_path):
+    path = str(tmp_path / 'palms.sig')
+    SignatureIndex(path).add(b'first---', bytes(SIGNATURE_SIZE))
+    with open(path, 'ab') as f:
+        f.write(b'torn')
+
+    index = SignatureIndex(path)
+    assert os.path.getsize(path) == HEADER.size + RECORD_SIZE
+    assert index.add(b'second--', bytes(SIGNATURE_SIZE)) == 1
+    assert index.entry(1)[0] == b'second--'
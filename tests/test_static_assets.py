@@ -0,0 +1,66 @@
+"""静的ファイルの配信（フィンガープリント・ETag・304・sw.js が public/ と合っていること）"""
+
+import gzip
+import shutil
+
+from static_assets import IMMUTABLE, PUBLIC_DIR, REVALIDATE, StaticAssets, write_service_worker
+
+
+def test_service_worker_matches_public(tmp_path):
+    # public/sw.js を更新し忘れると、Vercel版の古いキャッシュが残り続ける（python static_assets.py で直る）
+    root = tmp_path / 'public'
+    shutil.copytree(PUBLIC_DIR, root)
+    assert not write_service_worker(str(root))
+
+
+def make_assets(tmp_path):
+    root = tmp_path / 'site'
+    root.mkdir()
+    (root / 'app.js').write_text('console.log("palm");\n' * 40, encoding='utf-8')
+    (root / 'index.html').write_text('<script src="/app.js"></script>\n', encoding='utf-8')
+    return StaticAssets(str(root))
+
+
+def test_references_are_fingerprinted(tmp_path):
+    assets = make_assets(tmp_path)
+    digest = assets.assets['app.js'].digest
+
+    _, body, _ = assets.response('index.html')
+    assert f'/app.js?v={digest}'.encode() in body
+    assert assets.response('app.js', version=digest)[2]['Cache-Control'] == IMMUTABLE
+    assert assets.response('app.js', version='old')[2]['Cache-Control'] == REVALIDATE
+    assert assets.response('index.html')[2]['Cache-Control'] == REVALIDATE
+
+
+def test_compressed_representation_and_etag(tmp_path):
+    assets = make_assets(tmp_path)
+
+    status, body, headers = assets.response('app.js', accept_encoding='gzip, deflate')
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == assets.assets['app.js'].body
+    assert headers['Vary'] == 'Accept-Encoding'
+
+    plain = assets.response('app.js', accept_encoding='gzip;q=0')[2]
+    assert 'Content-Encoding' not in plain
+    assert plain['ETag'] != headers['ETag']
+
+
+def test_not_modified_and_missing(tmp_path):
+    assets = make_assets(tmp_path)
+    etag = assets.response('app.js', accept_encoding='gzip')[2]['ETag']
+
+    assert assets.response('app.js', accept_encoding='gzip', if_none_match=f'W/{etag}')[:2] == (304, b'')
+    assert assets.response('app.js', accept_encoding='', if_none_match=etag)[0] == 200
+    assert assets.response('missing.js') == (404, b'', {})
+
+
+def test_flask_serves_index_with_etag():
+    from app import app
+
+    client = app.test_client()
+    response = client.get('/', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
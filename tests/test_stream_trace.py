@@ -0,0 +1,31 @@
+"""計測の記録（ストリーミングのレスポンスは本文を送り終えるまでを1リクエストとする）と /metrics"""
+
+import io
+
+from app import app
+from benchmarks.synthetic import encode_upload, make_palm_image
+from instrumentation import registry
+
+
+def test_progressive_trace_covers_stream():
+    registry.clear()
+    upload = encode_upload(make_palm_image(0.3, 'normal', 12))
+
+    response = app.test_client().post('/api/analyze', data={
+        'image': (io.BytesIO(upload), 'palm.jpg'),
+        'progressive': '1',
+        'images': 'none',
+    })
+    response.get_data()
+
+    assert 'Server-Timing' not in response.headers
+    request = registry.requests['analyze']
+    assert request.count == 1
+    # 本文を作る間の段階（線の検出）よりリクエストの記録が短くならない
+    assert request.sum >= registry.stages['detect'].latency.sum
+
+
+def test_metrics_content_type():
+    response = app.test_client().get('/metrics')
+
+    assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'